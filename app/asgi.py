@@ -0,0 +1,9 @@
+"""
+LLM Shell Sandbox - ASGI entry point, with task execution on the asyncio core.
+
+    uvicorn app.asgi:app --host 0.0.0.0 --port 5220
+"""
+from app.core.asgi import create_asgi_app
+
+# Create the application
+app = create_asgi_app()
@@ -1,12 +1,19 @@
-from flask import Blueprint, request, jsonify
+import os
+import json
+import queue
+from flask import Blueprint, Response, request, jsonify
 from sqlalchemy.orm import Session
 
+from app.core import database
 from app.core.database import SessionLocal
 from app.services.task_service import TaskService
 from app.services.filesystem_service import FilesystemService
 from app.services.llm_service import LLMService
 from app.services.command_service import CommandService
 from app.services.python_service import PythonService
+from app.services.snapshot_pipeline import SnapshotPipeline
+from app.services.task_queue import TaskQueue
+from app.utils.resource_limits import ResourceLimiter
 from app.controllers.task_controller import TaskController
 
 
@@ -15,10 +22,13 @@ api = Blueprint('api', __name__)
 
 # Initialize services
 filesystem_service = FilesystemService()
-task_service = TaskService(filesystem_service=filesystem_service)
+snapshot_pipeline = (SnapshotPipeline()
+                     if os.getenv("SNAPSHOT_ASYNC", "true").lower() in ['true', '1', 't'] else None)
+task_service = TaskService(filesystem_service=filesystem_service, snapshot_pipeline=snapshot_pipeline)
 llm_service = LLMService()
-command_service = CommandService()
-python_service = PythonService()
+resource_limiter = ResourceLimiter()
+command_service = CommandService(resource_limiter=resource_limiter)
+python_service = PythonService(resource_limiter=resource_limiter)
 
 # Initialize controller
 task_controller = TaskController(
@@ -28,11 +38,16 @@ task_controller = TaskController(
     python_service=python_service
 )
 
+# Background workers that execute queued tasks
+task_queue = TaskQueue(task_controller)
+
 
 @api.route('/execute', methods=['POST'])
 def execute_task():
     """
-    Execute a task based on the natural language description.
+    Queue a task based on the natural language description.
+    Set "use_cache": false to bypass the LLM response cache for this task.
+    Returns the task ID immediately; poll /tasks/<id>/status for progress.
     """
     data = request.get_json()
     task_description = data.get('task')
@@ -44,9 +59,11 @@ def execute_task():
     db = SessionLocal()
     
     try:
-        # Execute the task
-        result = task_controller.execute_task(db, task_description)
-        return jsonify(result), 200
+        task_id, error = _enqueue_task(db, task_description, use_cache=data.get('use_cache', True))
+        if error:
+            return error
+        
+        return jsonify({"task_id": task_id, "status": "queued"}), 202
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -55,6 +72,79 @@ def execute_task():
         db.close()
 
 
+@api.route('/execute/stream', methods=['POST'])
+def execute_task_stream():
+    """
+    Queue a task and stream its progress as Server-Sent Events.
+    Emits task_created, command, command_output (live output chunks), command_result, filesystem_changes, analysis
+    and finally task_complete (or error) as they happen.
+    Accepts "use_cache" like /execute.
+    """
+    data = request.get_json()
+    task_description = data.get('task')
+
+    if not task_description:
+        return jsonify({"error": "No task provided."}), 400
+    
+    # Get database session
+    db = SessionLocal()
+    
+    try:
+        # Subscribe before the task can start so no event is missed; the task keeps
+        # running on its worker even if the client disconnects
+        events = queue.Queue()
+        task_id, error = _enqueue_task(db, task_description, events, use_cache=data.get('use_cache', True))
+        if error:
+            return error
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    finally:
+        db.close()
+    
+    return Response(
+        _sse_stream(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def _enqueue_task(db, task_description, events: queue.Queue = None, use_cache: bool = True):
+    """
+    Create a queued task and hand it to the task queue.
+    Returns (task_id, None) or (None, error_response).
+    """
+    task = task_service.create_task(db, task_description, final_status="queued", capture_initial_state=False)
+    if events is not None:
+        events.put(("task_queued", {"task_id": task.id}))
+    
+    try:
+        task_queue.submit(task.id, task_description, subscriber=events, use_cache=bool(use_cache))
+    except queue.Full:
+        task_service.complete_task(db, task.id, "failed", error_message="Task queue is full.")
+        return None, (jsonify({"error": "Task queue is full, try again later."}), 503)
+    
+    return task.id, None
+
+
+def _sse_stream(events: queue.Queue, keepalive_seconds: int = 15):
+    """Format queued (event, data) pairs as Server-Sent Events until a None marker arrives."""
+    while True:
+        try:
+            item = events.get(timeout=keepalive_seconds)
+        except queue.Empty:
+            # Comment line keeps proxies from closing an idle stream during long LLM calls
+            yield ": keep-alive\n\n"
+            continue
+        
+        if item is None:
+            return
+        
+        event, data = item
+        yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @api.route('/tasks', methods=['GET'])
 def get_recent_tasks():
     """
@@ -76,6 +166,47 @@ def get_recent_tasks():
         db.close()
 
 
+@api.route('/tasks/<int:task_id>/status', methods=['GET'])
+def get_task_status(task_id):
+    """
+    Get the execution status of a task.
+    """
+    # Get database session
+    db = SessionLocal()
+    
+    try:
+        task = task_service.get_task(db, task_id)
+        if not task:
+            return jsonify({"error": f"Task with ID {task_id} not found"}), 404
+        
+        job = task_queue.get_job(task_id)
+        return jsonify({
+            "task_id": task.id,
+            "status": task.final_status,
+            "is_completed": task.is_completed,
+            "commands_executed": task_service.get_command_count(db, task.id),
+            "queue_position": task_queue.queue_position(task_id),
+            "cancel_requested": bool(job and job.cancel_event.is_set())
+        }), 200
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    finally:
+        db.close()
+
+
+@api.route('/tasks/<int:task_id>/cancel', methods=['POST'])
+def cancel_task(task_id):
+    """
+    Cancel a queued or running task. A running task stops before its next command.
+    """
+    if not task_queue.cancel(task_id):
+        return jsonify({"error": f"Task with ID {task_id} is not queued or running"}), 409
+    
+    return jsonify({"task_id": task_id, "status": "cancelling"}), 202
+
+
 @api.route('/tasks/<int:task_id>', methods=['GET'])
 def get_task_details(task_id):
     """
@@ -108,7 +239,10 @@ def create_filesystem_snapshot():
     
     try:
         state_id = filesystem_service.capture_filesystem_state(db)
-        return jsonify({"state_id": state_id}), 200
+        return jsonify({
+            "state_id": state_id,
+            "scan_stats": filesystem_service.last_scan_stats
+        }), 200
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -139,7 +273,8 @@ def compare_filesystem_states():
         
         return jsonify({
             "state_id": state_id,
-            "changes": changes
+            "changes": changes,
+            "scan_stats": filesystem_service.last_scan_stats
         }), 200
     
     except ValueError as e:
@@ -152,6 +287,47 @@ def compare_filesystem_states():
         db.close()
 
 
+@api.route('/metrics/phases', methods=['GET'])
+def get_phase_metrics():
+    """
+    Get p50/p95/p99 latency by task phase (LLM calls, commands, snapshots, DB writes)
+    across the most recent tasks (?limit=, default 100).
+    """
+    limit = request.args.get('limit', default=100, type=int)
+    
+    # Get database session
+    db = SessionLocal()
+    
+    try:
+        return jsonify(task_service.get_phase_stats(db, limit=limit)), 200
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
+    finally:
+        db.close()
+
+
+@api.route('/llm/stats', methods=['GET'])
+def get_llm_stats():
+    """
+    Get LLM transport, prompt evaluation and response cache statistics.
+    """
+    return jsonify(llm_service.get_stats()), 200
+
+
+@api.route('/db/stats', methods=['GET'])
+def get_db_stats():
+    """
+    Get database commit counts and latency, and the SQLite pragmas in effect.
+    """
+    try:
+        return jsonify(database.get_stats()), 200
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @api.route('/command', methods=['POST'])
 def execute_single_command():
     """
@@ -200,4 +376,11 @@ def create_python_file():
     
     # Create the file
     result = python_service.create_python_file(file_path, code_content)
-    return jsonify(result), 200 if result.get('success', False) else 400 
\ No newline at end of file
+    return jsonify(result), 200 if result.get('success', False) else 400 
+
+@api.route('/python/stats', methods=['GET'])
+def get_python_stats():
+    """
+    Get Python execution mode and worker pool statistics.
+    """
+    return jsonify(python_service.get_stats()), 200
@@ -0,0 +1,176 @@
+import json
+import queue
+import asyncio
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from app.core.database import SessionLocal
+from app.services.async_task_queue import AsyncTaskQueue
+from app.controllers.async_task_controller import AsyncTaskController
+from app.controllers.api_controller import task_service, llm_service, command_service, python_service
+
+
+# The asyncio core shares the services (and their caches and pools) of the Flask API
+async_task_controller = AsyncTaskController(
+    task_service=task_service,
+    llm_service=llm_service,
+    command_service=command_service,
+    python_service=python_service
+)
+
+# Tasks run as coroutines on the server's event loop
+async_task_queue = AsyncTaskQueue(async_task_controller)
+
+
+async def execute_task(request: Request):
+    """
+    Queue a task based on the natural language description.
+    Same request and response as the Flask /api/execute.
+    """
+    data = await request.json()
+    task_description = data.get('task')
+
+    if not task_description:
+        return JSONResponse({"error": "No task provided."}, 400)
+
+    try:
+        task_id, error = await _enqueue_task(task_description, use_cache=data.get('use_cache', True))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, 500)
+    if error:
+        return error
+
+    return JSONResponse({"task_id": task_id, "status": "queued"}, 202)
+
+
+async def execute_task_stream(request: Request):
+    """
+    Queue a task and stream its progress as Server-Sent Events.
+    Same events as the Flask /api/execute/stream.
+    """
+    data = await request.json()
+    task_description = data.get('task')
+
+    if not task_description:
+        return JSONResponse({"error": "No task provided."}, 400)
+
+    # Subscribe before the task can start so no event is missed; the task keeps
+    # running if the client disconnects
+    events = asyncio.Queue()
+    try:
+        task_id, error = await _enqueue_task(task_description, events, use_cache=data.get('use_cache', True))
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, 500)
+    if error:
+        return error
+
+    return StreamingResponse(
+        _sse_stream(events),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+async def get_task_status(request: Request):
+    """Get the execution status of a task."""
+    task_id = request.path_params["task_id"]
+
+    def load():
+        db = SessionLocal()
+        try:
+            task = task_service.get_task(db, task_id)
+            if not task:
+                return None
+            return {
+                "task_id": task.id,
+                "status": task.final_status,
+                "is_completed": task.is_completed,
+                "commands_executed": task_service.get_command_count(db, task.id)
+            }
+        finally:
+            db.close()
+
+    try:
+        status = await asyncio.to_thread(load)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, 500)
+    if status is None:
+        return JSONResponse({"error": f"Task with ID {task_id} not found"}, 404)
+
+    job = async_task_queue.get_job(task_id)
+    status["queue_position"] = async_task_queue.queue_position(task_id)
+    status["cancel_requested"] = bool(job and job.cancel_event.is_set())
+    return JSONResponse(status, 200)
+
+
+async def cancel_task(request: Request):
+    """Cancel a queued or running task. A running task stops before its next command."""
+    task_id = request.path_params["task_id"]
+    if not async_task_queue.cancel(task_id):
+        return JSONResponse({"error": f"Task with ID {task_id} is not queued or running"}, 409)
+
+    return JSONResponse({"task_id": task_id, "status": "cancelling"}, 202)
+
+
+async def get_queue_stats(request: Request):
+    """Counts of queued and running tasks on the asyncio core."""
+    return JSONResponse(async_task_queue.stats(), 200)
+
+
+async def _enqueue_task(task_description, events: asyncio.Queue = None, use_cache: bool = True):
+    """
+    Create a queued task and hand it to the asyncio task queue.
+    Returns (task_id, None) or (None, error_response).
+    """
+    def create():
+        db = SessionLocal()
+        try:
+            return task_service.create_task(db, task_description, final_status="queued",
+                                            capture_initial_state=False).id
+        finally:
+            db.close()
+
+    task_id = await asyncio.to_thread(create)
+    if events is not None:
+        events.put_nowait(("task_queued", {"task_id": task_id}))
+
+    try:
+        async_task_queue.submit(task_id, task_description, subscriber=events, use_cache=bool(use_cache))
+    except queue.Full:
+        def fail():
+            db = SessionLocal()
+            try:
+                task_service.complete_task(db, task_id, "failed", error_message="Task queue is full.")
+            finally:
+                db.close()
+        await asyncio.to_thread(fail)
+        return None, JSONResponse({"error": "Task queue is full, try again later."}, 503)
+
+    return task_id, None
+
+
+async def _sse_stream(events: asyncio.Queue, keepalive_seconds: int = 15):
+    """Format queued (event, data) pairs as Server-Sent Events until a None marker arrives."""
+    while True:
+        try:
+            item = await asyncio.wait_for(events.get(), keepalive_seconds)
+        except asyncio.TimeoutError:
+            # Comment line keeps proxies from closing an idle stream during long LLM calls
+            yield ": keep-alive\n\n"
+            continue
+
+        if item is None:
+            return
+
+        event, data = item
+        yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+routes = [
+    Route('/api/execute', execute_task, methods=['POST']),
+    Route('/api/execute/stream', execute_task_stream, methods=['POST']),
+    Route('/api/tasks/{task_id:int}/status', get_task_status, methods=['GET']),
+    Route('/api/tasks/{task_id:int}/cancel', cancel_task, methods=['POST']),
+    Route('/api/queue/stats', get_queue_stats, methods=['GET'])
+]
@@ -0,0 +1,266 @@
+import os
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable
+from sqlalchemy.orm import Session
+
+from app.controllers.task_controller import TaskController
+from app.utils.context_manager import ContextManager
+from app.utils.timing import PhaseTimer
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTaskController(TaskController):
+    """
+    TaskController for the asyncio core.
+
+    The LLM calls and the commands are awaited (async HTTP to Ollama and
+    asyncio.create_subprocess_exec), so a task that waits on either holds no
+    thread and one event loop can run hundreds of tasks. Database writes and
+    snapshots stay blocking and run on a small executor of db_threads threads,
+    which bounds how many pooled connections the tasks use at once; Python
+    execution runs on the loop's default thread pool. Prompts, step modes and
+    recorded results are the same as with TaskController.
+    """
+
+    def __init__(self, *args, db_threads: int = None, **kwargs):
+        """Initialize like TaskController; db_threads defaults to ASYNC_DB_THREADS."""
+        super().__init__(*args, **kwargs)
+        self.db_threads = int(db_threads or os.getenv("ASYNC_DB_THREADS", "8"))
+        self._executor = ThreadPoolExecutor(self.db_threads, thread_name_prefix="async-db")
+
+    async def execute_task(self, db: Session, task_description: str,
+                           on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                           task_id: Optional[int] = None,
+                           cancel_event=None,
+                           use_cache: bool = True) -> Dict[str, Any]:
+        """
+        TaskController.execute_task as a coroutine. cancel_event is anything with
+        is_set(); cancelling the coroutine itself kills the running command.
+        """
+        emit = on_event or (lambda event, data: None)
+        timer = PhaseTimer()
+
+        # Create a new task in the database, or start the queued one
+        # Sessions are closed between calls, so keep the id rather than the Task
+        with timer.span("task_start"):
+            if task_id is None:
+                task_id = await self._blocking(lambda db: self.task_service.create_task(db, task_description).id, db)
+            else:
+                task_id = await self._blocking(lambda db: self.task_service.start_task(db, task_id).id, db)
+        emit("task_created", {"task_id": task_id, "task_description": task_description})
+
+        context = self._new_context(task_description)
+
+        command_count = 0
+        task_complete = False
+        cancelled = False
+        final_output = ""
+        executed_commands = []
+
+        try:
+            while command_count < self.max_commands and not task_complete:
+                if cancel_event is not None and cancel_event.is_set():
+                    cancelled = True
+                    break
+
+                messages = context.messages()
+                self._log_prompt(task_id, command_count, context)
+                with timer.span("llm_step", command_count):
+                    step = await self._next_step_async(messages, use_cache)
+                    if self._is_empty_step(step):
+                        logger.warning(f"Task {task_id} step {command_count}: no usable step in the reply; "
+                                       f"asking again")
+                        step = await self._next_step_async(self._retry_messages(messages, step), use_cache)
+                if step.get("error") or self._is_empty_step(step):
+                    error_msg = self._step_error_message(step)
+                    await self._blocking(self.task_service.complete_task, db, task_id, "failed",
+                                         error_message=error_msg, timer=timer)
+                    result = self._failure_result(task_id, error_msg)
+                    emit("task_complete", result)
+                    return result
+
+                action, payload = self._interpret_step(task_id, step, command_count, emit)
+                if action == "complete":
+                    task_complete = True
+                    break
+
+                if cancel_event is not None and cancel_event.is_set():
+                    cancelled = True
+                    break
+
+                if action == "batch":
+                    final_output += await self._run_batch_async(db, task_id, payload, executed_commands, context,
+                                                                emit, command_count, step["assistant_content"], timer)
+                    command_count += len(payload)
+                    continue
+
+                command = payload
+                emit("command", {"task_id": task_id, "index": command_count, "command": command})
+
+                if action == "python":
+                    await self._handle_python_command_async(db, task_id, command, executed_commands, context, emit,
+                                                            command_count, step["assistant_content"], use_cache,
+                                                            timer)
+                    command_count += 1
+                    continue
+
+                with timer.span("snapshot_before", command_count):
+                    before_state_id = await self._blocking(self.task_service.capture_before_command,
+                                                           db, task_id, command)
+
+                with timer.span("command", command_count):
+                    execution_result = await self.command_service.execute_command_async(
+                        command,
+                        session_id=task_id,
+                        on_output=self._output_emitter(emit, task_id, command_count)
+                    )
+                final_output += self._record_result(task_id, command_count, command, execution_result,
+                                                    executed_commands, emit)
+                await self._blocking(self._store_command, db, task_id, command_count, command, execution_result,
+                                     before_state_id, emit, timer)
+                self._add_step(context, command, step["assistant_content"], execution_result)
+
+                if self.step_mode == "two_call":
+                    with timer.span("llm_analysis", command_count):
+                        analysis = await self.llm_service.analyze_command_result_async(
+                            task_description,
+                            command,
+                            execution_result.get("output", ""),
+                            executed_commands,
+                            messages=context.messages()
+                        )
+                    emit("analysis", {"task_id": task_id, "index": command_count, **analysis})
+
+                    if analysis.get("task_complete", False):
+                        task_complete = True
+                        break
+
+                command_count += 1
+        finally:
+            await self.command_service.close_session_async(task_id)
+
+        await self._blocking(self.task_service.complete_task, db, task_id,
+                             self._final_status(task_complete, cancelled), final_output=final_output, timer=timer)
+
+        result = self._task_result(task_id, task_complete, cancelled, command_count, final_output, context, timer)
+        emit("task_complete", result)
+        return result
+
+    async def _blocking(self, fn, db: Session, *args, **kwargs):
+        """
+        Run fn(db, ...), a blocking database call, on the executor. The session is
+        closed afterwards, which returns its connection to the pool while the task
+        waits on the LLM or a command; the objects it returns are detached.
+        """
+        def call():
+            try:
+                return fn(db, *args, **kwargs)
+            finally:
+                db.close()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(call))
+
+    async def _next_step_async(self, messages: List[Dict[str, str]], use_cache: bool = True) -> Dict[str, Any]:
+        """TaskController._next_step with async LLM calls."""
+        if self.step_mode in ("single", "batch"):
+            return self._structured_step(await self.llm_service.generate_step_async(messages, use_cache=use_cache))
+
+        try:
+            command = await self.llm_service.generate_shell_command_async(messages, use_cache=use_cache)
+        except Exception as e:
+            return {"task_complete": False, "next_command": "", "error": str(e)}
+        return self._command_step(command)
+
+    async def _run_batch_async(self, db: Session, task_id, batch, executed_commands, context: ContextManager, emit,
+                               index, assistant_content, timer: PhaseTimer) -> str:
+        """TaskController._run_batch with the commands awaited on the event loop."""
+        commands = self._start_batch(task_id, batch, index, emit)
+
+        with timer.span("snapshot_before", index):
+            before_state_id = await self._blocking(self.task_service.capture_before_command,
+                                                   db, task_id, "; ".join(commands))
+
+        cwd = self.command_service.session_cwd(task_id)
+        results = await self._execute_batch_async(task_id, batch, cwd, emit, index, timer)
+
+        final_output = self._record_batch(task_id, batch, results, index, executed_commands, context,
+                                          assistant_content, emit)
+        await self._blocking(self._store_batch, db, task_id, index, commands, results, before_state_id, cwd,
+                             emit, timer)
+        return final_output
+
+    async def _execute_batch_async(self, task_id, batch, cwd, emit, index, timer: PhaseTimer) -> List[Dict[str, Any]]:
+        """TaskController._execute_batch with each command as an asyncio task."""
+        semaphore = asyncio.Semaphore(self.batch_workers)
+
+        async def run(position, command):
+            async with semaphore:
+                with timer.span("command", index + position):
+                    return await self.command_service.execute_command_async(
+                        command, cwd=cwd, on_output=self._output_emitter(emit, task_id, index + position))
+
+        dependencies = self._batch_dependencies(batch)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(batch)
+        running = {}
+
+        try:
+            while True:
+                for position in self._ready_commands(batch, dependencies, results, running.values()):
+                    running[asyncio.ensure_future(run(position, batch[position]["command"]))] = position
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = self._future_result(future)
+        finally:
+            for future in running:
+                future.cancel()
+
+        return self._batch_results(results)
+
+    async def _handle_python_command_async(self, db: Session, task_id, command, executed_commands, context, emit,
+                                           index, assistant_content, use_cache, timer: PhaseTimer):
+        """TaskController._handle_python_command with the code generated asynchronously."""
+        with timer.span("snapshot_before", index):
+            before_state_id = await self._blocking(self.task_service.capture_before_command,
+                                                   db, task_id, command)
+
+        result = await self._run_python_directive_async(task_id, command, emit, index, use_cache, timer)
+
+        self._record_result(task_id, index, command, result, executed_commands, emit)
+        await self._blocking(self._store_command, db, task_id, index, command, result, before_state_id, emit, timer)
+        self._add_step(context, command, assistant_content or command, result)
+
+    async def _run_python_directive_async(self, task_id: int, command: str, emit, index: int, use_cache: bool,
+                                          timer: PhaseTimer) -> Dict[str, Any]:
+        """TaskController._run_python_directive with async code generation."""
+        directive = self._parse_python_directive(command)
+        error = self._python_directive_error(directive)
+        if error:
+            return error
+        kind, filename, description = directive
+
+        with timer.span("llm_codegen", index):
+            code_result = await self.llm_service.generate_python_code_async(description, filename,
+                                                                            use_cache=use_cache)
+        if not code_result.get("success", False):
+            return code_result
+
+        if kind == "file":
+            file_result = await asyncio.to_thread(self.python_service.create_python_file,
+                                                  filename, code_result.get("code", ""))
+            return self._python_file_result(filename, file_result)
+
+        # The worker pool is blocking; run it off the event loop
+        with timer.span("python", index):
+            exec_result = await asyncio.to_thread(
+                self.python_service.execute_python_code,
+                code_result.get("code", ""),
+                use_file=True,
+                on_output=self._output_emitter(emit, task_id, index)
+            )
+        return self._python_code_result(exec_result)
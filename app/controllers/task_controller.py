@@ -1,5 +1,10 @@
+import os
+import json
 import time
-from typing import Dict, Any, List, Optional
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, List, Optional, Callable
 from sqlalchemy.orm import Session
 
 from app.services.task_service import TaskService
@@ -7,6 +12,13 @@ from app.services.llm_service import LLMService
 from app.services.command_service import CommandService
 from app.services.python_service import PythonService
 from app.services.filesystem_service import FilesystemService
+from app.utils.context_manager import ContextManager
+from app.utils.timing import PhaseTimer
+
+logger = logging.getLogger(__name__)
+
+# How much of an unusable LLM response goes into the task's error message
+STEP_ERROR_RESPONSE_CHARS = 2000
 
 
 class TaskController:
@@ -17,217 +29,659 @@ class TaskController:
                  llm_service: LLMService,
                  command_service: CommandService,
                  python_service: PythonService = None,
-                 max_commands: int = 10):
-        """Initialize with required services."""
+                 max_commands: int = 10,
+                 step_mode: str = None,
+                 batch_workers: int = None):
+        """
+        Initialize with required services.
+        step_mode "single" asks the LLM for completion status and the next command in
+        one structured call per step; "two_call" uses a command call plus an analysis call;
+        "batch" is like "single" but the LLM may return several commands with dependency
+        hints, of which up to batch_workers independent ones run at the same time.
+        """
         self.task_service = task_service
         self.llm_service = llm_service
         self.command_service = command_service
         self.python_service = python_service
         self.max_commands = max_commands
+        self.step_mode = step_mode or os.getenv("LLM_STEP_MODE", "single")
+        self.batch_workers = int(batch_workers or os.getenv("COMMAND_BATCH_WORKERS", "4"))
     
-    def execute_task(self, db: Session, task_description: str) -> Dict[str, Any]:
+    def execute_task(self, db: Session, task_description: str,
+                     on_event: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+                     task_id: Optional[int] = None,
+                     cancel_event: Optional[threading.Event] = None,
+                     use_cache: bool = True) -> Dict[str, Any]:
         """
         Execute a complete task, generating and running commands as needed.
+        If on_event is given, it is called with (event_name, data) as each command is
+        generated, executed, diffed and analyzed. Filesystem change events may arrive
+        from a snapshot worker thread.
+        If task_id is given, the already created (queued) task is executed instead of
+        a new one. Setting cancel_event stops the task before its next command.
+        use_cache=False makes every LLM call of the task bypass the response cache.
+        Every phase of every step is timed (see PhaseTimer) and stored with the task.
         Returns a dict with task execution results.
         """
-        # Create a new task in the database
-        task = self.task_service.create_task(db, task_description)
+        emit = on_event or (lambda event, data: None)
+        timer = PhaseTimer()
+        
+        # Create a new task in the database, or start the queued one
+        with timer.span("task_start"):
+            if task_id is None:
+                task = self.task_service.create_task(db, task_description)
+            else:
+                task = self.task_service.start_task(db, task_id)
+        emit("task_created", {"task_id": task.id, "task_description": task_description})
         
         # Initialize conversation history with system prompt
-        messages = [
-            {
-                "role": "system",
-                "content": (
-                    "You are an AI assistant that helps execute shell commands based on the user's task. "
-                    "Provide only the necessary shell commands to accomplish the task. Output only one command at a time. "
-                    "After each command, evaluate if the task is complete based on the command output. "
-                    "If the task is complete, respond with exactly 'TASK_COMPLETE'. "
-                    "Consider all previously executed commands and their outputs when determining if additional commands are needed. "
-                    "Avoid repeating commands unless absolutely necessary."
-                )
-            },
-            {
-                "role": "user",
-                "content": f"Task: {task_description}\nPreviously executed commands: []"
-            }
-        ]
+        context = self._new_context(task_description)
         
         command_count = 0
         task_complete = False
+        cancelled = False
         final_output = ""
         executed_commands = []
         
         # Execute commands until task is complete or max commands reached
         while command_count < self.max_commands and not task_complete:
-            # Generate command
-            try:
-                command = self.llm_service.generate_shell_command(messages)
-            except Exception as e:
-                error_msg = f"Failed to get command from LLM: {str(e)}"
-                self.task_service.complete_task(db, task.id, "failed", error_message=error_msg)
-                return {
-                    "task_id": task.id,
-                    "success": False,
-                    "error": error_msg
-                }
+            if cancel_event is not None and cancel_event.is_set():
+                cancelled = True
+                break
             
-            # Check if task is complete
-            if command.strip() == "TASK_COMPLETE":
+            # Generate the next step
+            messages = context.messages()
+            self._log_prompt(task.id, command_count, context)
+            with timer.span("llm_step", command_count):
+                step = self._next_step(messages, use_cache)
+                if self._is_empty_step(step):
+                    logger.warning(f"Task {task.id} step {command_count}: no usable step in the reply; asking again")
+                    step = self._next_step(self._retry_messages(messages, step), use_cache)
+            if step.get("error") or self._is_empty_step(step):
+                error_msg = self._step_error_message(step)
+                self.task_service.complete_task(db, task.id, "failed", error_message=error_msg, timer=timer)
+                self.command_service.close_session(task.id)
+                result = self._failure_result(task.id, error_msg)
+                emit("task_complete", result)
+                return result
+            
+            action, payload = self._interpret_step(task.id, step, command_count, emit)
+            if action == "complete":
                 task_complete = True
                 break
             
-            # Check if command is a special directive for generating Python code
-            if command.startswith("PYTHON_FILE:") or command.startswith("PYTHON_CODE:"):
-                self._handle_python_command(db, task, command, executed_commands, messages)
-                command_count += 1
-                continue
-            
-            # Execute the command
-            execution_result = self.command_service.execute_command(command)
-            executed_commands.append({
-                "command": command,
-                "output": execution_result.get("output", ""),
-                "success": execution_result.get("success", False)
-            })
+            # The LLM call may have taken a while; honor a cancellation that arrived meanwhile
+            if cancel_event is not None and cancel_event.is_set():
+                cancelled = True
+                break
             
-            # Update task with command result
-            self.task_service.update_task_with_command(
-                db, 
-                task.id, 
-                command, 
-                execution_result.get("output", ""), 
-                execution_result.get("success", False)
-            )
+            if action == "batch":
+                final_output += self._run_batch(db, task, payload, executed_commands, context, emit,
+                                                command_count, step["assistant_content"], timer)
+                command_count += len(payload)
+                continue
             
-            # Append to final output
-            final_output += f"Command: {command}\nOutput:\n{execution_result.get('output', '')}\n\n"
+            command = payload
+            emit("command", {"task_id": task.id, "index": command_count, "command": command})
             
-            # Analyze command result to determine if task is complete
-            analysis = self.llm_service.analyze_command_result(
-                task_description,
-                command,
-                execution_result.get("output", ""),
-                executed_commands
-            )
+            # PYTHON_FILE: and PYTHON_CODE: directives generate Python code instead of running a command
+            if action == "python":
+                self._handle_python_command(db, task, command, executed_commands, context, emit, command_count,
+                                            assistant_content=step["assistant_content"], use_cache=use_cache,
+                                            timer=timer)
+                command_count += 1
+                continue
             
-            if analysis.get("task_complete", False):
-                task_complete = True
-                break
+            # Record the filesystem state the command starts from
+            with timer.span("snapshot_before", command_count):
+                before_state_id = self.task_service.capture_before_command(db, task.id, command)
             
-            # Add the executed command and its output to conversation history
-            messages.append({
-                "role": "assistant",
-                "content": command
-            })
-            messages.append({
-                "role": "user",
-                "content": (
-                    f"Command output: {execution_result.get('output', '')}\n"
-                    f"Current task status: {task_description}\n"
-                    f"Previously executed commands: {[cmd.get('command') for cmd in executed_commands]}\n"
-                    "If the task is complete, respond with exactly 'TASK_COMPLETE'. "
-                    "Otherwise, provide the next command needed."
+            # Execute the command
+            with timer.span("command", command_count):
+                execution_result = self.command_service.execute_command(
+                    command,
+                    session_id=task.id,
+                    on_output=self._output_emitter(emit, task.id, command_count)
                 )
-            })
+            final_output += self._record_result(task.id, command_count, command, execution_result,
+                                                executed_commands, emit)
+            self._store_command(db, task.id, command_count, command, execution_result, before_state_id, emit, timer)
+            self._add_step(context, command, step["assistant_content"], execution_result)
+            
+            # In two-call mode, analyze command result to determine if task is complete;
+            # in single and batch mode the next step call makes that judgement
+            if self.step_mode == "two_call":
+                with timer.span("llm_analysis", command_count):
+                    analysis = self.llm_service.analyze_command_result(
+                        task_description,
+                        command,
+                        execution_result.get("output", ""),
+                        executed_commands,
+                        messages=context.messages()
+                    )
+                emit("analysis", {"task_id": task.id, "index": command_count, **analysis})
+                
+                if analysis.get("task_complete", False):
+                    task_complete = True
+                    break
             
             command_count += 1
         
         # Update task status
-        final_status = "completed" if task_complete else "incomplete"
-        self.task_service.complete_task(db, task.id, final_status, final_output=final_output)
+        self.task_service.complete_task(db, task.id, self._final_status(task_complete, cancelled),
+                                        final_output=final_output, timer=timer)
+        self.command_service.close_session(task.id)
+        
+        result = self._task_result(task.id, task_complete, cancelled, command_count, final_output, context, timer)
+        emit("task_complete", result)
+        return result
+    
+    @staticmethod
+    def _log_prompt(task_id: int, index: int, context: ContextManager):
+        logger.info(f"Task {task_id} step {index}: prompt ~{context.last_prompt_tokens} tokens "
+                    f"(budget {context.token_budget}, {context.dropped_steps} earlier steps dropped)")
+    
+    def _interpret_step(self, task_id: int, step: Dict[str, Any], index: int, emit) -> tuple:
+        """
+        Report a step's analysis and decide what it asks for, as (action, payload):
+        ("complete", None), ("batch", commands) for several commands of a batch step,
+        ("python", directive) or ("command", command). Empty steps are handled before
+        (see _is_empty_step).
+        """
+        if self.step_mode in ("single", "batch"):
+            emit("analysis", {
+                "task_id": task_id,
+                "index": index,
+                "task_complete": step["task_complete"],
+                "explanation": step.get("explanation", "")
+            })
         
+        if step["task_complete"]:
+            return "complete", None
+        
+        if self.step_mode == "batch":
+            batch = self._batch_commands(step)[:self.max_commands - index]
+            if len(batch) > 1:
+                return "batch", batch
+            command = batch[0]["command"] if batch else ""
+        else:
+            command = step["next_command"]
+        
+        if command.startswith(("PYTHON_FILE:", "PYTHON_CODE:")):
+            return "python", command
+        return "command", command
+    
+    def _is_empty_step(self, step: Dict[str, Any]) -> bool:
+        """Whether a step has neither a command nor completion, e.g. from a reply that is not valid JSON."""
+        if step.get("error") or step["task_complete"]:
+            return False
+        if self.step_mode == "batch":
+            return not self._batch_commands(step)
+        return not step["next_command"].strip()
+    
+    def _retry_messages(self, messages: List[Dict[str, str]], step: Dict[str, Any]) -> List[Dict[str, str]]:
+        """The prompt for a second try at an empty step: the unusable reply and a correction."""
+        if self.step_mode == "single":
+            correction = ("Your reply did not contain a usable step. Respond with the JSON object only, with "
+                          "task_complete, next_command and explanation.")
+        elif self.step_mode == "batch":
+            correction = ("Your reply did not contain a usable step. Respond with the JSON object only, with "
+                          "task_complete, commands and explanation.")
+        else:
+            correction = "Your reply was empty. Respond with the next shell command only, or exactly 'TASK_COMPLETE'."
+        return messages + [
+            {"role": "assistant", "content": step["assistant_content"]},
+            {"role": "user", "content": correction}
+        ]
+    
+    @staticmethod
+    def _step_error_message(step: Dict[str, Any]) -> str:
+        """The error_message for a task that ends on a failed or unusable step."""
+        if step.get("error"):
+            return f"Failed to get command from LLM: {step['error']}"
+        response = step["assistant_content"]
+        if len(response) > STEP_ERROR_RESPONSE_CHARS:
+            response = response[:STEP_ERROR_RESPONSE_CHARS] + "..."
+        return (f"The LLM returned neither a command nor task completion, also when asked again "
+                f"({step.get('explanation') or 'no explanation'}). Response: {response!r}")
+    
+    @staticmethod
+    def _final_status(task_complete: bool, cancelled: bool) -> str:
+        if cancelled:
+            return "cancelled"
+        return "completed" if task_complete else "incomplete"
+    
+    @staticmethod
+    def _failure_result(task_id: int, error_msg: str) -> Dict[str, Any]:
         return {
-            "task_id": task.id,
+            "task_id": task_id,
+            "success": False,
+            "error": error_msg
+        }
+    
+    @staticmethod
+    def _task_result(task_id: int, task_complete: bool, cancelled: bool, command_count: int, final_output: str,
+                     context: ContextManager, timer: PhaseTimer) -> Dict[str, Any]:
+        """The result returned and emitted when a task ends."""
+        result = {
+            "task_id": task_id,
             "success": task_complete,
             "commands_executed": command_count,
-            "output": final_output
+            "output": final_output,
+            "prompt_tokens": context.prompt_tokens,
+            "duration_ms": round(timer.elapsed_ms(), 3)
         }
+        if cancelled:
+            result["cancelled"] = True
+        return result
     
-    def _handle_python_command(self, db: Session, task, command, executed_commands, messages):
-        """Helper method to handle Python code generation and execution."""
-        if not self.python_service:
-            result = {
-                "success": False,
-                "output": "Python service is not available."
-            }
+    def _new_context(self, task_description: str) -> ContextManager:
+        """Start the conversation with the system prompt and task turn for the configured step mode."""
+        if self.step_mode == "single":
+            instructions = (
+                "You are an AI assistant that helps execute shell commands based on the user's task. "
+                "Work one shell command at a time. After each command, evaluate if the task is complete based on the command output. "
+                "Respond only with a JSON object with the following structure:\n"
+                "{\n"
+                '  "task_complete": true/false,\n'
+                '  "next_command": "the single shell command to run next, empty if the task is complete",\n'
+                '  "explanation": "brief explanation of your assessment"\n'
+                "}\n"
+                "Consider all previously executed commands and their outputs when determining if additional commands are needed. "
+                "Avoid repeating commands unless absolutely necessary."
+            )
+        elif self.step_mode == "batch":
+            instructions = (
+                "You are an AI assistant that helps execute shell commands based on the user's task. "
+                "Work in small batches of shell commands. After each batch, evaluate if the task is complete based on the command outputs. "
+                "Respond only with a JSON object with the following structure:\n"
+                "{\n"
+                '  "task_complete": true/false,\n'
+                '  "commands": [{"id": "1", "command": "a shell command", "depends_on": []}],\n'
+                '  "explanation": "brief explanation of your assessment"\n'
+                "}\n"
+                "Commands that do not depend on each other run at the same time, so list the ids of the commands "
+                "a command needs in its depends_on; a command is skipped if one of them fails. "
+                "In a batch of several commands each command runs in its own shell starting in the current "
+                "working directory, so 'cd' and 'export' only carry over when the command is alone in its batch. "
+                "PYTHON_FILE: and PYTHON_CODE: directives must be the only command in their batch. "
+                "Leave commands empty if the task is complete. "
+                "Consider all previously executed commands and their outputs when determining if additional commands are needed. "
+                "Avoid repeating commands unless absolutely necessary."
+            )
         else:
-            # Parse the Python command
-            if command.startswith("PYTHON_FILE:"):
-                # Format: PYTHON_FILE:filename.py:description
-                parts = command.split(":", 2)
-                filename = parts[1] if len(parts) > 1 else "script.py"
-                description = parts[2] if len(parts) > 2 else "Generate a Python script"
-                
-                # Generate code
-                code_result = self.llm_service.generate_python_code(description, filename)
-                
-                if code_result.get("success", False):
-                    # Create the file
-                    file_result = self.python_service.create_python_file(filename, code_result.get("code", ""))
-                    
-                    if file_result.get("success", False):
-                        result = {
-                            "success": True,
-                            "output": f"Created Python file: {filename}\n{file_result.get('message', '')}"
-                        }
-                    else:
-                        result = file_result
-                else:
-                    result = code_result
-            
-            elif command.startswith("PYTHON_CODE:"):
-                # Format: PYTHON_CODE:description
-                description = command[len("PYTHON_CODE:"):]
-                
-                # Generate code
-                code_result = self.llm_service.generate_python_code(description)
+            instructions = (
+                "You are an AI assistant that helps execute shell commands based on the user's task. "
+                "Provide only the necessary shell commands to accomplish the task. Output only one command at a time. "
+                "After each command, evaluate if the task is complete based on the command output. "
+                "If the task is complete, respond with exactly 'TASK_COMPLETE'. "
+                "Consider all previously executed commands and their outputs when determining if additional commands are needed. "
+                "Avoid repeating commands unless absolutely necessary."
+            )
+        
+        # A batch of several commands runs outside the session; the batch prompt explains that
+        if getattr(self.command_service, "use_sessions", False) and self.step_mode != "batch":
+            instructions += (
+                " All commands run in the same shell session, so the working directory and environment "
+                "variables carry over from one command to the next; there is no need to repeat 'cd'."
+            )
+        
+        return ContextManager(instructions, f"Task: {task_description}")
+    
+    def _followup_message(self, context: ContextManager, output: str, success: bool) -> str:
+        """
+        Build the user turn that reports a command's output back to the LLM.
+        The command itself is already in the preceding assistant turn, and long output
+        is cut to its head and tail.
+        """
+        if self.step_mode == "single":
+            closing = "Respond with the JSON object describing the task status and the next command."
+        elif self.step_mode == "batch":
+            closing = "Respond with the JSON object describing the task status and the next commands."
+        else:
+            closing = ("If the task is complete, respond with exactly 'TASK_COMPLETE'. "
+                       "Otherwise, provide the next command needed.")
+        
+        return (
+            f"Command {'succeeded' if success else 'failed'}. Output:\n"
+            f"{context.truncate_output(output) or '(no output)'}\n"
+            f"{closing}"
+        )
+    
+    def _next_step(self, messages: List[Dict[str, str]], use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Ask the LLM for the next step.
+        Returns task_complete, next_command, explanation, the assistant_content to
+        record in the conversation and, on failure, error.
+        """
+        if self.step_mode in ("single", "batch"):
+            return self._structured_step(self.llm_service.generate_step(messages, use_cache=use_cache))
+        
+        try:
+            command = self.llm_service.generate_shell_command(messages, use_cache=use_cache)
+        except Exception as e:
+            return {"task_complete": False, "next_command": "", "error": str(e)}
+        return self._command_step(command)
+    
+    @staticmethod
+    def _structured_step(step: Dict[str, Any]) -> Dict[str, Any]:
+        """Complete a step parsed from a JSON reply with the assistant_content to record."""
+        # Record exactly what the model produced so the next prompt extends the cached one
+        step["assistant_content"] = step.pop("raw_response", None) or json.dumps({
+            "task_complete": step["task_complete"],
+            "next_command": step["next_command"],
+            "explanation": step.get("explanation", "")
+        })
+        return step
+    
+    @staticmethod
+    def _command_step(command: str) -> Dict[str, Any]:
+        """The step for a plain command reply of two-call mode."""
+        return {
+            "task_complete": command.strip() == "TASK_COMPLETE",
+            "next_command": command,
+            "explanation": "",
+            "assistant_content": command
+        }
+    
+    def _batch_commands(self, step: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """The commands of a batch step, falling back to its single next_command."""
+        if step.get("commands"):
+            return step["commands"]
+        if step.get("next_command"):
+            return [{"id": "1", "command": step["next_command"], "depends_on": []}]
+        return []
+    
+    def _run_batch(self, db: Session, task, batch, executed_commands, context, emit, index,
+                   assistant_content, timer: PhaseTimer) -> str:
+        """
+        Run a batch of several commands concurrently, record them and report all of
+        their results back to the LLM in one turn.
+        One filesystem snapshot is taken before and one after the batch; the changes
+        are split between the commands by the paths they name.
+        Returns the text to append to the task's final output.
+        """
+        commands = self._start_batch(task.id, batch, index, emit)
+        
+        with timer.span("snapshot_before", index):
+            before_state_id = self.task_service.capture_before_command(db, task.id, "; ".join(commands))
+        
+        # Commands start where the task's shell session currently is
+        cwd = self.command_service.session_cwd(task.id)
+        results = self._execute_batch(task.id, batch, cwd, emit, index, timer)
+        
+        final_output = self._record_batch(task.id, batch, results, index, executed_commands, context,
+                                          assistant_content, emit)
+        self._store_batch(db, task.id, index, commands, results, before_state_id, cwd, emit, timer)
+        return final_output
+    
+    def _execute_batch(self, task_id, batch, cwd, emit, index, timer: PhaseTimer) -> List[Dict[str, Any]]:
+        """
+        Run the commands of a batch, each as soon as the commands it depends on have
+        succeeded, with up to batch_workers at a time (see _ready_commands).
+        Returns one execution result per command, in batch order.
+        """
+        def run(position, command):
+            with timer.span("command", index + position):
+                return self.command_service.execute_command(
+                    command, cwd=cwd, on_output=self._output_emitter(emit, task_id, index + position))
+        
+        dependencies = self._batch_dependencies(batch)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(batch)
+        running = {}
+        
+        with ThreadPoolExecutor(max_workers=self.batch_workers, thread_name_prefix="command-batch") as pool:
+            while True:
+                for position in self._ready_commands(batch, dependencies, results, running.values()):
+                    running[pool.submit(run, position, batch[position]["command"])] = position
+                if not running:
+                    break
                 
-                if code_result.get("success", False):
-                    # Execute the code
-                    exec_result = self.python_service.execute_python_code(
-                        code_result.get("code", ""),
-                        use_file=True
-                    )
-                    
-                    result = {
-                        "success": exec_result.get("success", False),
-                        "output": f"Python code execution:\n{exec_result.get('output', '')}"
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = self._future_result(future)
+        
+        return self._batch_results(results)
+    
+    def _start_batch(self, task_id: int, batch, index: int, emit) -> List[str]:
+        """Announce the commands of a batch; returns them in batch order."""
+        commands = [item["command"] for item in batch]
+        for offset, command in enumerate(commands):
+            emit("command", {"task_id": task_id, "index": index + offset, "command": command})
+        return commands
+    
+    @staticmethod
+    def _batch_dependencies(batch) -> List[set]:
+        """For each command of a batch, the positions of the commands it depends on."""
+        ids = {item["id"]: position for position, item in enumerate(batch)}
+        # Unknown ids and self-references are ignored
+        return [{ids[dep] for dep in item["depends_on"] if dep in ids and ids[dep] != position}
+                for position, item in enumerate(batch)]
+    
+    @staticmethod
+    def _ready_commands(batch, dependencies, results, running_positions) -> List[int]:
+        """
+        The positions of the batch commands that can start now: not started yet and
+        with every dependency succeeded. Commands with a failed dependency and
+        Python directives get a failed result in results instead.
+        """
+        running_positions = set(running_positions)
+        ready = []
+        progress = True
+        while progress:
+            progress = False
+            for position, item in enumerate(batch):
+                if results[position] is not None or position in running_positions or position in ready:
+                    continue
+                failed = [dep for dep in dependencies[position]
+                          if results[dep] is not None and not results[dep].get("success", False)]
+                if failed:
+                    results[position] = {
+                        "success": False,
+                        "output": f"Skipped: command {batch[failed[0]]['id']}, which this command depends on, failed."
                     }
+                    progress = True
+                elif any(results[dep] is None for dep in dependencies[position]):
+                    continue
+                elif item["command"].startswith(("PYTHON_FILE:", "PYTHON_CODE:")):
+                    results[position] = {
+                        "success": False,
+                        "output": "PYTHON_FILE: and PYTHON_CODE: directives must be the only command in their batch."
+                    }
+                    progress = True
                 else:
-                    result = code_result
-            else:
-                result = {
-                    "success": False,
-                    "output": "Invalid Python command format."
-                }
+                    ready.append(position)
+        return ready
+    
+    @staticmethod
+    def _future_result(future) -> Dict[str, Any]:
+        """The execution result of a finished command future, or a failed one if it raised."""
+        try:
+            return future.result()
+        except Exception as e:
+            return {"success": False, "output": f"Error executing command: {str(e)}"}
+    
+    @staticmethod
+    def _batch_results(results) -> List[Dict[str, Any]]:
+        # Whatever is left waits on itself through a dependency cycle
+        return [result or {"success": False, "output": "Skipped: its dependencies form a cycle."}
+                for result in results]
+    
+    def _record_batch(self, task_id: int, batch, results, index: int, executed_commands, context: ContextManager,
+                      assistant_content: str, emit) -> str:
+        """
+        Record the results of a batch and report them back to the LLM in one turn.
+        Returns the text to append to the task's final output.
+        """
+        final_output = ""
+        for offset, (item, result) in enumerate(zip(batch, results)):
+            final_output += self._record_result(task_id, index + offset, item["command"], result,
+                                                executed_commands, emit)
+        context.add_step("; ".join(item["command"] for item in batch), assistant_content,
+                         self._batch_followup_message(context, batch, results))
+        return final_output
+    
+    def _store_batch(self, db: Session, task_id: int, index: int, commands, results, before_state_id, cwd,
+                     emit, timer: PhaseTimer):
+        """Store the results of a batch with the task (blocking)."""
+        self.task_service.update_task_with_batch(
+            db,
+            task_id,
+            commands,
+            results,
+            before_state_id=before_state_id,
+            cwd=cwd,
+            on_changes=lambda offset, changes: emit(
+                "filesystem_changes", {"task_id": task_id, "index": index + offset, "changes": changes}),
+            timer=timer
+        )
+    
+    def _batch_followup_message(self, context: ContextManager, batch, results) -> str:
+        """Build the user turn that reports every command of a batch back to the LLM."""
+        # The commands share the output budget of one step
+        max_tokens = max(64, context.max_output_tokens // len(batch))
+        reports = []
+        for item, result in zip(batch, results):
+            output = context.truncate_output(result.get("output", ""), max_tokens=max_tokens)
+            reports.append(
+                f"Command {item['id']} ({item['command']}) {'succeeded' if result.get('success', False) else 'failed'}. "
+                f"Output:\n{output or '(no output)'}"
+            )
+        return "\n\n".join(reports) + "\nRespond with the JSON object describing the task status and the next commands."
+    
+    def _changes_emitter(self, emit, task_id, index):
+        """Build the callback that reports a command's filesystem changes once they are known."""
+        return lambda changes: emit("filesystem_changes", {"task_id": task_id, "index": index, "changes": changes})
+    
+    def _output_emitter(self, emit, task_id, index):
+        """Build the callback that streams a command's output as it is produced."""
+        return lambda chunk: emit("command_output", {"task_id": task_id, "index": index, "chunk": chunk})
+    
+    def _handle_python_command(self, db: Session, task, command, executed_commands, context,
+                               emit=None, index=None, assistant_content=None, use_cache=True,
+                               timer: PhaseTimer = None):
+        """Helper method to handle Python code generation and execution."""
+        emit = emit or (lambda event, data: None)
+        timer = timer or PhaseTimer()
+        
+        # Record the filesystem state the command starts from
+        with timer.span("snapshot_before", index):
+            before_state_id = self.task_service.capture_before_command(db, task.id, command)
+        
+        result = self._run_python_directive(task.id, command, emit, index, use_cache, timer)
+        
+        self._record_result(task.id, index, command, result, executed_commands, emit)
+        self._store_command(db, task.id, index, command, result, before_state_id, emit, timer)
+        self._add_step(context, command, assistant_content or command, result)
+    
+    def _run_python_directive(self, task_id: int, command: str, emit, index: int, use_cache: bool,
+                              timer: PhaseTimer) -> Dict[str, Any]:
+        """Generate the code of a Python directive and create the file or run the code."""
+        directive = self._parse_python_directive(command)
+        error = self._python_directive_error(directive)
+        if error:
+            return error
+        kind, filename, description = directive
+        
+        # Generate code
+        with timer.span("llm_codegen", index):
+            code_result = self.llm_service.generate_python_code(description, filename, use_cache=use_cache)
+        if not code_result.get("success", False):
+            return code_result
+        
+        if kind == "file":
+            file_result = self.python_service.create_python_file(filename, code_result.get("code", ""))
+            return self._python_file_result(filename, file_result)
         
-        # Update records
-        executed_commands.append({
+        with timer.span("python", index):
+            exec_result = self.python_service.execute_python_code(
+                code_result.get("code", ""),
+                use_file=True,
+                on_output=self._output_emitter(emit, task_id, index)
+            )
+        return self._python_code_result(exec_result)
+    
+    @staticmethod
+    def _parse_python_directive(command: str):
+        """
+        Split a directive into (kind, filename, description): PYTHON_FILE:filename.py:description
+        gives ("file", ...) and PYTHON_CODE:description ("code", None, ...). None if malformed.
+        """
+        if command.startswith("PYTHON_FILE:"):
+            parts = command.split(":", 2)
+            filename = parts[1] if len(parts) > 1 else "script.py"
+            description = parts[2] if len(parts) > 2 else "Generate a Python script"
+            return "file", filename, description
+        if command.startswith("PYTHON_CODE:"):
+            return "code", None, command[len("PYTHON_CODE:"):]
+        return None
+    
+    def _python_directive_error(self, directive) -> Optional[Dict[str, Any]]:
+        """The failed result for a directive that cannot run, or None."""
+        if not self.python_service:
+            return {"success": False, "output": "Python service is not available."}
+        if directive is None:
+            return {"success": False, "output": "Invalid Python command format."}
+        return None
+    
+    @staticmethod
+    def _python_file_result(filename: str, file_result: Dict[str, Any]) -> Dict[str, Any]:
+        if not file_result.get("success", False):
+            return file_result
+        return {
+            "success": True,
+            "output": f"Created Python file: {filename}\n{file_result.get('message', '')}"
+        }
+    
+    @staticmethod
+    def _python_code_result(exec_result: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "success": exec_result.get("success", False),
+            "output": f"Python code execution:\n{exec_result.get('output', '')}",
+            "capture": exec_result.get("capture"),
+            "resource_usage": exec_result.get("resource_usage")
+        }
+    
+    def _record_result(self, task_id: int, index: int, command: str, result: Dict[str, Any], executed_commands,
+                       emit) -> str:
+        """
+        Add a command's result to executed_commands and report it.
+        Returns the text to append to the task's final output.
+        """
+        output = result.get("output", "")
+        success = result.get("success", False)
+        executed_commands.append({"command": command, "output": output, "success": success})
+        emit("command_result", {
+            "task_id": task_id,
+            "index": index,
             "command": command,
-            "output": result.get("output", ""),
-            "success": result.get("success", False)
+            "output": output,
+            "success": success,
+            "capture": result.get("capture"),
+            "resource_usage": result.get("resource_usage")
         })
-        
-        # Update task with command result
+        return f"Command: {command}\nOutput:\n{output}\n\n"
+    
+    def _store_command(self, db: Session, task_id: int, index: int, command: str, result: Dict[str, Any],
+                       before_state_id, emit, timer: PhaseTimer):
+        """Store a command's result with the task (blocking)."""
         self.task_service.update_task_with_command(
-            db, 
-            task.id, 
-            command, 
-            result.get("output", ""), 
-            result.get("success", False)
+            db,
+            task_id,
+            command,
+            result.get("output", ""),
+            result.get("success", False),
+            before_state_id=before_state_id,
+            on_changes=self._changes_emitter(emit, task_id, index),
+            capture=result.get("capture"),
+            resource_usage=result.get("resource_usage"),
+            timer=timer
+        )
+    
+    def _add_step(self, context: ContextManager, command: str, assistant_content: str, result: Dict[str, Any]):
+        """Add an executed command and the report of its result to the conversation."""
+        context.add_step(
+            command,
+            assistant_content,
+            self._followup_message(context, result.get("output", ""), result.get("success", False))
         )
-        
-        # Add to conversation history
-        messages.append({
-            "role": "assistant",
-            "content": command
-        })
-        messages.append({
-            "role": "user",
-            "content": (
-                f"Command output: {result.get('output', '')}\n"
-                f"Previously executed commands: {[cmd.get('command') for cmd in executed_commands]}\n"
-                "If the task is complete, respond with exactly 'TASK_COMPLETE'. "
-                "Otherwise, provide the next command needed."
-            )
-        }) 
\ No newline at end of file
@@ -4,8 +4,8 @@ import logging
 from flask import Flask, send_from_directory
 from dotenv import load_dotenv
 
-from app.core.database import init_db
-from app.controllers.api_controller import api
+from app.core.database import init_db, SessionLocal
+from app.controllers.api_controller import api, task_service
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -19,22 +19,14 @@ def create_app():
     # Determine the correct static folder path
     current_dir = pathlib.Path(__file__).parent.absolute()
     static_folder = os.path.join(current_dir, '..', 'static')
-    
-    # Log static folder path for debugging
-    logger.info(f"Static folder path: {static_folder}")
-    logger.info(f"Static folder exists: {os.path.exists(static_folder)}")
-    if os.path.exists(static_folder):
-        logger.info(f"Static folder contents: {os.listdir(static_folder)}")
+    if not os.path.isdir(static_folder):
+        logger.warning(f"Static folder not found: {static_folder}")
     
     # Create Flask app with explicit static URL path
     app = Flask(__name__, 
                 static_url_path='', 
                 static_folder=static_folder)
     
-    # Log Flask configuration
-    logger.info(f"Flask app static_url_path: {app.static_url_path}")
-    logger.info(f"Flask app static_folder: {app.static_folder}")
-    
     # Register blueprints
     app.register_blueprint(api, url_prefix='/api')
     
@@ -42,7 +34,6 @@ def create_app():
     @app.route('/')
     def index():
         """Serve the main index.html page."""
-        logger.info(f"Serving index.html from {app.static_folder}")
         return send_from_directory(app.static_folder, 'index.html')
     
     @app.route('/ls')
@@ -66,13 +57,21 @@ def create_app():
     # Add route for static files explicitly
     @app.route('/<path:filename>')
     def serve_static(filename):
-        logger.info(f"Serving static file: {filename}")
         return send_from_directory(app.static_folder, filename)
     
     # Initialize the database
     with app.app_context():
         init_db()
     
+    # Queued and running tasks only live in this process's task queues
+    db = SessionLocal()
+    try:
+        interrupted = task_service.fail_interrupted_tasks(db)
+    finally:
+        db.close()
+    if interrupted:
+        logger.warning(f"Marked {interrupted} tasks interrupted by a restart as failed")
+    
     return app
 
 
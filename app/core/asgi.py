@@ -0,0 +1,37 @@
+import os
+import logging
+import contextlib
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+from app.core.app import create_app
+
+logger = logging.getLogger(__name__)
+
+
+def create_asgi_app():
+    """
+    Create the ASGI application: task execution runs on the asyncio core, and
+    every other route is served by the Flask app on a thread pool.
+    """
+    from app.controllers import async_api_controller
+    from app.controllers.api_controller import llm_service, command_service
+
+    flask_app = create_app()
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        yield
+        # Let running tasks finish, then release the loop's connections and shells
+        drain_timeout = float(os.getenv("TASK_DRAIN_TIMEOUT", "300"))
+        logger.info(f"Waiting up to {drain_timeout:.0f}s for running tasks to finish")
+        await async_api_controller.async_task_queue.shutdown(wait=True, timeout=drain_timeout)
+        if command_service.async_session_pool is not None:
+            await command_service.async_session_pool.close_all()
+        await llm_service.async_transport.close()
+
+    return Starlette(
+        routes=async_api_controller.routes + [Mount('/', app=WSGIMiddleware(flask_app))],
+        lifespan=lifespan
+    )
@@ -1,20 +1,183 @@
 import os
-from sqlalchemy import create_engine
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
+
+from app.utils.timing import percentile
 
 # Get database URL from environment variables or use SQLite as default
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app/data/llm_shell.db")
 
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+# Group the writes of one step into a single transaction (see BatchingSession.unit_of_work)
+UNIT_OF_WORK_ENABLED = os.getenv("DB_UNIT_OF_WORK", "true").lower() in ['true', '1', 't']
+
+# Applied to every SQLite connection. WAL lets readers run alongside the writer, and
+# with synchronous=NORMAL a commit only fsyncs at checkpoints instead of every time
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    # Negative values are KiB rather than pages
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE_MB", "256")) * 1024 * 1024,
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+}
+
+
+def _configure_sqlite(dbapi_connection, connection_record):
+    """Set SQLITE_PRAGMAS on a new connection."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def _create_engine(url):
+    """Create the engine for url, with SQLite connections tuned by SQLITE_PRAGMAS."""
+    is_sqlite = url.startswith("sqlite")
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False} if is_sqlite else {},
+        echo=False
+    )
+    if is_sqlite:
+        event.listen(new_engine, "connect", _configure_sqlite)
+    return new_engine
+
+
+class CommitStats:
+    """Thread-safe counts and latencies of database commits."""
+
+    def __init__(self, window: int = 1000):
+        """Keep latencies of the last window commits for percentiles."""
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.commits = 0
+        self.batched = 0
+        self.rollbacks = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, duration_ms: float):
+        with self._lock:
+            self.commits += 1
+            self.total_ms += duration_ms
+            self.max_ms = max(self.max_ms, duration_ms)
+            self._latencies.append(round(duration_ms, 3))
+
+    def record_batched(self):
+        with self._lock:
+            self.batched += 1
+
+    def record_rollback(self):
+        with self._lock:
+            self.rollbacks += 1
+
+    def stats(self):
+        """Counters plus mean and recent p50/p95/p99 commit latency in milliseconds."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "commits": self.commits,
+                "batched_commits": self.batched,
+                "rollbacks": self.rollbacks,
+                "commit_mean_ms": round(self.total_ms / self.commits, 3) if self.commits else None,
+                "commit_p50_ms": percentile(latencies, 0.50),
+                "commit_p95_ms": percentile(latencies, 0.95),
+                "commit_p99_ms": percentile(latencies, 0.99),
+                "commit_max_ms": round(self.max_ms, 3)
+            }
+
+
+commit_stats = CommitStats()
+
+
+class BatchingSession(Session):
+    """
+    Session that times every commit in commit_stats and can group commits.
+
+    Inside unit_of_work(), commit() only flushes; the transaction commits once
+    when the outermost block exits, or rolls back if it raises. The first flush
+    takes SQLite's write lock until then, so slow work (filesystem scans) should
+    come before the first write of a block.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._unit_depth = 0
+        self._after_commit = []
+
+    @contextmanager
+    def unit_of_work(self):
+        """Group every commit in the block into one transaction."""
+        if not UNIT_OF_WORK_ENABLED:
+            yield self
+            return
+
+        self._unit_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._unit_depth -= 1
+            if self._unit_depth == 0:
+                self.rollback()
+            raise
+        self._unit_depth -= 1
+        if self._unit_depth == 0:
+            self.commit()
+
+    def commit(self):
+        if self._unit_depth:
+            self.flush()
+            commit_stats.record_batched()
+            return
+
+        start = time.perf_counter()
+        super().commit()
+        commit_stats.record((time.perf_counter() - start) * 1000)
+
+        hooks, self._after_commit = self._after_commit, []
+        for hook in hooks:
+            hook()
+
+    def rollback(self):
+        self._after_commit = []
+        commit_stats.record_rollback()
+        super().rollback()
+
+    def close(self):
+        self._unit_depth = 0
+        self._after_commit = []
+        super().close()
+
+
+def unit_of_work(db: Session):
+    """Group db's commits in the block into one transaction; a no-op for plain sessions."""
+    if isinstance(db, BatchingSession):
+        return db.unit_of_work()
+    return nullcontext(db)
+
+
+def after_commit(db: Session, fn):
+    """Call fn once db's pending unit of work commits, or right away outside one."""
+    if isinstance(db, BatchingSession) and db._unit_depth:
+        db._after_commit.append(fn)
+    else:
+        fn()
+
+
 # Create engine
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
-    echo=False
-)
+engine = _create_engine(DATABASE_URL)
 
 # Create session factory
-session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=BatchingSession)
 SessionLocal = scoped_session(session_factory)
 
 # Create declarative base
@@ -28,10 +191,26 @@ def get_db():
     finally:
         db.close()
 
+
+def get_stats():
+    """Commit counters and latency, and the pragmas in effect on SQLite."""
+    stats = commit_stats.stats()
+    stats["unit_of_work"] = UNIT_OF_WORK_ENABLED
+    if engine.url.get_backend_name() == "sqlite":
+        with engine.connect() as conn:
+            stats["pragmas"] = {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in SQLITE_PRAGMAS}
+    return stats
+
+
 # Initialize database
 def init_db():
+    from alembic import command
+    from alembic.config import Config
     from app.models.task import Task
+    from app.models.task_command import TaskCommand
     from app.models.filesystem_state import FilesystemState
+    from app.models.filesystem_manifest import FilesystemManifest
+    from app.models.phase_timing import TaskPhaseTiming
     
     # Create data directory if using SQLite
     if DATABASE_URL.startswith("sqlite:///"):
@@ -45,11 +224,31 @@ def init_db():
             os.makedirs("app/data", exist_ok=True)
             # Update the database URL to use the default path
             global engine
-            engine = create_engine(
-                "sqlite:///app/data/llm_shell.db",
-                connect_args={"check_same_thread": False},
-                echo=False
-            )
+            engine = _create_engine("sqlite:///app/data/llm_shell.db")
     
-    # Create tables
-    Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+    # Create or upgrade the tables with the migrations in app/migrations
+    config = Config()
+    config.set_main_option("script_location", MIGRATIONS_PATH)
+    with engine.begin() as connection:
+        config.attributes["connection"] = connection
+        revision = _unversioned_revision(connection)
+        if revision:
+            command.stamp(config, revision)
+        command.upgrade(config, "head")
+
+
+def _unversioned_revision(connection):
+    """
+    The revision matching a database created by create_all before migrations
+    existed; None for new or versioned databases. create_all only ever added
+    tables, so columns decide first and later tables may already exist.
+    """
+    inspector = inspect(connection)
+    tables = inspector.get_table_names()
+    if "tasks" not in tables or "alembic_version" in tables:
+        return None
+    if "manifest_id" not in {column["name"] for column in inspector.get_columns("filesystem_states")}:
+        return "0001"
+    if "task_phase_timings" not in tables:
+        return "0002"
+    return "0003"
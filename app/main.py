@@ -1,5 +1,8 @@
 """
 LLM Shell Sandbox - Main entry point for the application.
+
+Production runs `gunicorn app.main:app` (see gunicorn.conf.py); running this
+module starts Flask's development server.
 """
 import os
 from app.core.app import create_app
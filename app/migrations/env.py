@@ -0,0 +1,57 @@
+"""
+Alembic environment for the application's database (DATABASE_URL).
+
+init_db passes its open connection in config.attributes["connection"]; the
+alembic command line (see alembic.ini) connects through the application's engine.
+"""
+from logging.config import fileConfig
+
+from alembic import context
+
+from app.core import database
+from app.core.database import Base
+# Register every table on Base.metadata for autogenerate
+from app.models import task, task_command, filesystem_state, filesystem_manifest, phase_timing  # noqa: F401
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    """Emit the migration SQL without a database connection (alembic upgrade --sql)."""
+    context.configure(
+        url=database.engine.url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        render_as_batch=True,
+        dialect_opts={"paramstyle": "named"}
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    """Run the migrations on init_db's connection, or on a new one from the engine."""
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        _run_migrations(connection)
+        return
+
+    with database.engine.connect() as connection:
+        _run_migrations(connection)
+
+
+def _run_migrations(connection):
+    # SQLite cannot alter most column definitions, so changes go through batch mode
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=True)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
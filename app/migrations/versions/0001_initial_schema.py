@@ -0,0 +1,56 @@
+"""Initial schema: tasks with their commands inline and full filesystem states
+
+Databases created with Base.metadata.create_all before migrations existed are
+stamped by init_db with the revision their tables and columns match.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'tasks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('task_description', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.Column('is_completed', sa.Boolean(), nullable=True),
+        sa.Column('commands', sa.JSON(), nullable=True),
+        sa.Column('final_status', sa.String(length=50), nullable=True),
+        sa.Column('final_output', sa.Text(), nullable=True),
+        sa.Column('execution_time_seconds', sa.Integer(), nullable=True),
+        sa.Column('error_message', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table(
+        'filesystem_states',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('task_id', sa.Integer(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('state_type', sa.String(length=50), nullable=True),
+        sa.Column('filesystem_data', sa.JSON(), nullable=False),
+        sa.Column('command_index', sa.Integer(), nullable=True),
+        sa.Column('command_text', sa.Text(), nullable=True),
+        sa.Column('changes', sa.JSON(), nullable=True),
+        sa.ForeignKeyConstraint(['task_id'], ['tasks.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('filesystem_states')
+    op.drop_table('tasks')
@@ -0,0 +1,87 @@
+"""Store filesystem states as deltas on content-addressed manifests
+
+Adds filesystem_manifests and the manifest, parent and delta columns of
+filesystem_states. filesystem_data becomes nullable, since only states
+written before delta encoding keep the full structure inline.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Databases stamped by init_db may already have the table from create_all
+    if 'filesystem_manifests' not in sa.inspect(op.get_bind()).get_table_names():
+        op.create_table(
+            'filesystem_manifests',
+            sa.Column('id', sa.String(length=64), nullable=False),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('entry_count', sa.Integer(), nullable=False),
+            sa.Column('data', sa.JSON(), nullable=False),
+            sa.PrimaryKeyConstraint('id')
+        )
+    # SQLite cannot add foreign keys or relax NOT NULL in place, so the table is rebuilt
+    with op.batch_alter_table('filesystem_states') as batch_op:
+        batch_op.alter_column('filesystem_data', existing_type=sa.JSON(), nullable=True)
+        batch_op.add_column(sa.Column('manifest_id', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('parent_state_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('delta', sa.JSON(), nullable=True))
+        batch_op.add_column(sa.Column('chain_depth', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_filesystem_states_manifest_id', 'filesystem_manifests',
+                                    ['manifest_id'], ['id'])
+        batch_op.create_foreign_key('fk_filesystem_states_parent_state_id', 'filesystem_states',
+                                    ['parent_state_id'], ['id'])
+
+
+def downgrade() -> None:
+    # Delta rows have no inline structure, so they are rebuilt before the columns go
+    connection = op.get_bind()
+    states = sa.table(
+        'filesystem_states',
+        sa.column('id', sa.Integer),
+        sa.column('filesystem_data', sa.JSON),
+        sa.column('manifest_id', sa.String),
+        sa.column('parent_state_id', sa.Integer),
+        sa.column('delta', sa.JSON)
+    )
+    manifests = sa.table('filesystem_manifests', sa.column('id', sa.String), sa.column('data', sa.JSON))
+    manifest_data = dict(connection.execute(sa.select(manifests.c.id, manifests.c.data)).all())
+
+    # Parents are always written before their children, so id order resolves every chain
+    resolved = {}
+    for row in connection.execute(sa.select(states).order_by(states.c.id)).mappings().all():
+        if row['filesystem_data'] is not None:
+            data = row['filesystem_data']
+        elif row['manifest_id'] is not None:
+            data = manifest_data.get(row['manifest_id'], {})
+        else:
+            data = dict(resolved.get(row['parent_state_id'], {}))
+            delta = row['delta'] or {}
+            data.update(delta.get('set', {}))
+            for path in delta.get('removed', []):
+                data.pop(path, None)
+        resolved[row['id']] = data
+        if row['filesystem_data'] is None:
+            connection.execute(states.update().where(states.c.id == row['id']).values(filesystem_data=data))
+
+    # Dropping the columns drops their foreign keys, named or not (create_all left them unnamed)
+    with op.batch_alter_table('filesystem_states') as batch_op:
+        batch_op.drop_column('chain_depth')
+        batch_op.drop_column('delta')
+        batch_op.drop_column('parent_state_id')
+        batch_op.drop_column('manifest_id')
+        batch_op.alter_column('filesystem_data', existing_type=sa.JSON(), nullable=False)
+    op.drop_table('filesystem_manifests')
@@ -0,0 +1,43 @@
+"""Add task_phase_timings for the timing spans of each task step
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Databases stamped by init_db may already have the table from create_all
+    if 'task_phase_timings' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        'task_phase_timings',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('task_id', sa.Integer(), nullable=False),
+        sa.Column('command_index', sa.Integer(), nullable=True),
+        sa.Column('phase', sa.String(length=32), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=False),
+        sa.Column('duration_ms', sa.Float(), nullable=False),
+        sa.ForeignKeyConstraint(['task_id'], ['tasks.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_task_phase_timings_phase', 'task_phase_timings', ['phase'], unique=False)
+    op.create_index('ix_task_phase_timings_task_id', 'task_phase_timings', ['task_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_task_phase_timings_task_id', table_name='task_phase_timings')
+    op.drop_index('ix_task_phase_timings_phase', table_name='task_phase_timings')
+    op.drop_table('task_phase_timings')
@@ -0,0 +1,123 @@
+"""Store task commands as rows in task_commands instead of the tasks.commands JSON list
+
+Each command becomes one task_commands row, with its output in
+task_command_outputs, and the tasks.commands column is dropped. Existing
+command lists are moved over; downgrade rebuilds them.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+OPTIONAL_FIELDS = ("capture", "resource_usage", "batch", "filesystem_changes", "unattributed_changes", "timings")
+
+tasks = sa.table('tasks', sa.column('id', sa.Integer), sa.column('commands', sa.JSON))
+task_commands = sa.table(
+    'task_commands',
+    sa.column('id', sa.Integer),
+    sa.column('task_id', sa.Integer),
+    sa.column('command_index', sa.Integer),
+    sa.column('command', sa.Text),
+    sa.column('success', sa.Boolean),
+    sa.column('timestamp', sa.DateTime),
+    *[sa.column(field, sa.JSON) for field in OPTIONAL_FIELDS]
+)
+task_command_outputs = sa.table(
+    'task_command_outputs',
+    sa.column('command_id', sa.Integer),
+    sa.column('output', sa.Text)
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        'task_commands',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('task_id', sa.Integer(), nullable=False),
+        sa.Column('command_index', sa.Integer(), nullable=False),
+        sa.Column('command', sa.Text(), nullable=False),
+        sa.Column('success', sa.Boolean(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        *[sa.Column(field, sa.JSON(), nullable=True) for field in OPTIONAL_FIELDS],
+        sa.ForeignKeyConstraint(['task_id'], ['tasks.id']),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('task_id', 'command_index', name='uq_task_commands_task_id_command_index')
+    )
+    op.create_index('ix_task_commands_task_id', 'task_commands', ['task_id'], unique=False)
+    op.create_table(
+        'task_command_outputs',
+        sa.Column('command_id', sa.Integer(), nullable=False),
+        sa.Column('output', sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(['command_id'], ['task_commands.id']),
+        sa.PrimaryKeyConstraint('command_id')
+    )
+
+    # task_commands is new and empty, so ids can be assigned here
+    connection = op.get_bind()
+    command_rows, output_rows = [], []
+    for task_id, commands in connection.execute(sa.select(tasks.c.id, tasks.c.commands)).all():
+        for index, entry in enumerate(commands or []):
+            timestamp = entry.get("timestamp")
+            command_id = len(command_rows) + 1
+            command_rows.append(dict(
+                id=command_id,
+                task_id=task_id,
+                command_index=index,
+                command=entry.get("command", ""),
+                success=entry.get("success", False),
+                timestamp=datetime.fromisoformat(timestamp) if timestamp else None,
+                **{field: entry.get(field) for field in OPTIONAL_FIELDS}
+            ))
+            output_rows.append(dict(command_id=command_id, output=entry.get("output") or ""))
+    if command_rows:
+        connection.execute(task_commands.insert(), command_rows)
+        connection.execute(task_command_outputs.insert(), output_rows)
+
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.drop_column('commands')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('tasks') as batch_op:
+        batch_op.add_column(sa.Column('commands', sa.JSON(), nullable=True))
+
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(task_commands, task_command_outputs.c.output)
+        .select_from(task_commands.outerjoin(task_command_outputs,
+                                             task_command_outputs.c.command_id == task_commands.c.id))
+        .order_by(task_commands.c.task_id, task_commands.c.command_index)
+    ).mappings().all()
+
+    commands_by_task = {}
+    for row in rows:
+        entry = {
+            "command": row["command"],
+            "output": row["output"] or "",
+            "success": row["success"],
+            "timestamp": row["timestamp"].isoformat() if row["timestamp"] else None
+        }
+        entry.update({field: row[field] for field in OPTIONAL_FIELDS if row[field] is not None})
+        commands_by_task.setdefault(row["task_id"], []).append(entry)
+
+    # The old code expects a list on every task
+    connection.execute(tasks.update().values(commands=[]))
+    for task_id, commands in commands_by_task.items():
+        connection.execute(tasks.update().where(tasks.c.id == task_id).values(commands=commands))
+
+    op.drop_table('task_command_outputs')
+    op.drop_index('ix_task_commands_task_id', table_name='task_commands')
+    op.drop_table('task_commands')
@@ -0,0 +1,16 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, JSON
+from app.core.database import Base
+
+
+class FilesystemManifest(Base):
+    """Model to store full filesystem manifests, addressed by the hash of their content."""
+    __tablename__ = 'filesystem_manifests'
+
+    # SHA-256 of the canonical JSON encoding, so identical trees share one row
+    id = Column(String(64), primary_key=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    entry_count = Column(Integer, nullable=False, default=0)
+    
+    # Same format as FilesystemState.filesystem_data
+    data = Column(JSON, nullable=False)
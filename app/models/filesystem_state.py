@@ -14,20 +14,62 @@ class FilesystemState(Base):
     state_type = Column(String(50), default="snapshot")  # Options: snapshot, before_command, after_command
     
     # Store the filesystem structure as a nested JSON object
-    # Format: { path: { type: 'file|dir', size: bytes, last_modified: timestamp, hash: 'md5' } }
-    filesystem_data = Column(JSON, nullable=False)
+    # Format: { path: { type: 'file|dir', size: bytes, last_modified: timestamp, hash: hex digest } }
+    # Hashes come from FileHasher (FS_HASH_ALGORITHM, 128-bit BLAKE2b by default); states
+    # written before that default was introduced hold MD5 hashes of the same length
+    # Only rows written before delta encoding keep the full structure inline
+    full_data = Column('filesystem_data', JSON, nullable=True)
+    
+    # Keyframe rows point at a shared content-addressed manifest
+    manifest_id = Column(String(64), ForeignKey('filesystem_manifests.id'), nullable=True)
+    
+    # Delta rows store only what changed relative to their parent state
+    # Format: { set: { path: {...} }, removed: [path] }
+    parent_state_id = Column(Integer, ForeignKey('filesystem_states.id'), nullable=True)
+    delta = Column(JSON, nullable=True)
+    chain_depth = Column(Integer, default=0)
     
     # Reference to the command if this state is related to a specific command
     command_index = Column(Integer, nullable=True)
     command_text = Column(Text, nullable=True)
     
     # Changed files during this state transition
-    # Format: [{ path: string, change_type: 'created|modified|deleted', before_hash: 'md5', after_hash: 'md5' }]
+    # Format: [{ path: string, change_type: 'created|modified|deleted', before_hash: hex, after_hash: hex }]
     changes = Column(JSON, default=list)
     
     # Relationship with Task
     task = relationship("Task", back_populates="filesystem_states")
     
+    # Relationships used to rebuild the full structure
+    manifest = relationship("FilesystemManifest")
+    parent_state = relationship("FilesystemState", remote_side=[id])
+    
+    @property
+    def filesystem_data(self):
+        """
+        The full filesystem structure, rebuilt from the manifest and delta chain on first access.
+        """
+        cached = getattr(self, '_materialized_data', None)
+        if cached is not None:
+            return cached
+        
+        if self.full_data is not None:
+            data = self.full_data
+        elif self.manifest is not None:
+            data = self.manifest.data
+        elif self.parent_state is not None:
+            # Parents cache their own structure, so siblings share the rebuild work
+            data = dict(self.parent_state.filesystem_data)
+            delta = self.delta or {}
+            data.update(delta.get('set', {}))
+            for path in delta.get('removed', []):
+                data.pop(path, None)
+        else:
+            data = {}
+        
+        self._materialized_data = data
+        return data
+    
     def to_dict(self):
         """Convert the filesystem state model to a dictionary."""
         return {
@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey
+from app.core.database import Base
+
+
+class TaskPhaseTiming(Base):
+    """Model to store one timing span of a task phase (LLM call, command, snapshot, DB write)."""
+    __tablename__ = 'task_phase_timings'
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey('tasks.id'), nullable=False, index=True)
+    
+    # Position of the command in Task.commands; null for task-level spans
+    command_index = Column(Integer, nullable=True)
+    phase = Column(String(32), nullable=False, index=True)
+    started_at = Column(DateTime, nullable=False)
+    duration_ms = Column(Float, nullable=False)
+    
+    def to_dict(self):
+        """Convert the timing span to a dictionary."""
+        return {
+            'command_index': self.command_index,
+            'phase': self.phase,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'duration_ms': self.duration_ms
+        }
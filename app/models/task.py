@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean
 from sqlalchemy.orm import relationship
 from app.core.database import Base
 
@@ -14,8 +14,9 @@ class Task(Base):
     completed_at = Column(DateTime, nullable=True)
     is_completed = Column(Boolean, default=False)
     
-    # Store the commands executed for this task
-    commands = Column(JSON, default=list)
+    # The commands executed for this task, one row per step (see Task.commands)
+    command_records = relationship("TaskCommand", back_populates="task", order_by="TaskCommand.command_index",
+                                   cascade="all, delete-orphan")
     
     # Store the final status and output
     final_status = Column(String(50), default="pending")
@@ -28,6 +29,11 @@ class Task(Base):
     # Relationship with FilesystemState
     filesystem_states = relationship("FilesystemState", back_populates="task", cascade="all, delete-orphan")
     
+    @property
+    def commands(self):
+        """The executed commands as a list of entries, in order."""
+        return [command.to_dict() for command in self.command_records]
+    
     def to_dict(self):
         """Convert the task model to a dictionary."""
         return {
@@ -0,0 +1,60 @@
+from datetime import datetime
+from sqlalchemy import Column, Integer, Text, DateTime, Boolean, JSON, ForeignKey, UniqueConstraint
+from sqlalchemy.orm import relationship
+from app.core.database import Base
+
+
+class TaskCommand(Base):
+    """Model to store one executed command (step) of a task."""
+    __tablename__ = 'task_commands'
+    __table_args__ = (UniqueConstraint('task_id', 'command_index', name='uq_task_commands_task_id_command_index'),)
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(Integer, ForeignKey('tasks.id'), nullable=False, index=True)
+
+    # Position of the command in Task.commands
+    command_index = Column(Integer, nullable=False)
+    command = Column(Text, nullable=False)
+    success = Column(Boolean, default=False)
+    timestamp = Column(DateTime, default=datetime.utcnow)
+
+    # Optional metadata, omitted from to_dict() while null
+    capture = Column(JSON, nullable=True)
+    resource_usage = Column(JSON, nullable=True)
+    batch = Column(JSON, nullable=True)
+    filesystem_changes = Column(JSON, nullable=True)
+    unattributed_changes = Column(JSON, nullable=True)
+    timings = Column(JSON, nullable=True)
+
+    # The output lives in its own table, so attaching changes or timings to a
+    # command never rewrites a large output
+    output_record = relationship("TaskCommandOutput", uselist=False, cascade="all, delete-orphan")
+    task = relationship("Task", back_populates="command_records")
+
+    OPTIONAL_FIELDS = ("capture", "resource_usage", "batch", "filesystem_changes", "unattributed_changes", "timings")
+
+    @property
+    def output(self):
+        return self.output_record.output if self.output_record is not None else ""
+
+    def to_dict(self):
+        """Convert the command to the entry format of Task.commands."""
+        entry = {
+            'command': self.command,
+            'output': self.output,
+            'success': self.success,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None
+        }
+        for field in self.OPTIONAL_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                entry[field] = value
+        return entry
+
+
+class TaskCommandOutput(Base):
+    """Model to store the output of a task command."""
+    __tablename__ = 'task_command_outputs'
+
+    command_id = Column(Integer, ForeignKey('task_commands.id'), primary_key=True)
+    output = Column(Text, nullable=False, default="")
@@ -0,0 +1,166 @@
+import os
+import queue
+import asyncio
+import logging
+from typing import Dict, Any, Optional
+
+from app.core.database import session_factory
+from app.services.task_queue import TaskJob
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTaskQueue:
+    """
+    TaskQueue for the asyncio core: every queued task is a coroutine of an
+    AsyncTaskController on one event loop instead of a job for a worker thread.
+
+    Up to max_running tasks run at once (a task waiting on the LLM or on a
+    command costs a coroutine, not a thread); the rest wait their turn. Jobs,
+    cancellation and event subscription work like TaskQueue's, with
+    asyncio.Queue subscribers. Must be used from the event loop's thread; events
+    published from other threads (snapshot workers) are handed over to the loop.
+    """
+
+    def __init__(self, task_controller, max_running: int = None, max_queued: int = None, db_session_factory=None):
+        """Initialize with the AsyncTaskController that executes tasks and the limits."""
+        self.task_controller = task_controller
+        self.max_running = int(max_running or os.getenv("ASYNC_MAX_TASKS", "500"))
+        self.max_queued = int(max_queued or os.getenv("TASK_QUEUE_SIZE", "100"))
+        self.session_factory = db_session_factory or session_factory
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._jobs: Dict[int, TaskJob] = {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def submit(self, task_id: int, task_description: str, subscriber: asyncio.Queue = None,
+               use_cache: bool = True) -> TaskJob:
+        """
+        Queue an already created task for execution.
+        subscriber, if given, receives the task's events as with subscribe().
+        Raises queue.Full when max_queued tasks are already waiting.
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._slots = asyncio.Semaphore(self.max_running)
+
+        waiting = sum(1 for job in self._jobs.values() if job.state == "queued")
+        if waiting >= self.max_queued:
+            raise queue.Full()
+
+        job = TaskJob(task_id, task_description, use_cache)
+        if subscriber is not None:
+            job.subscribers.append(subscriber)
+        self._jobs[task_id] = job
+        self._tasks[task_id] = self._loop.create_task(self._run(job), name=f"task-{task_id}")
+        return job
+
+    def subscribe(self, task_id: int) -> Optional[asyncio.Queue]:
+        """
+        Return a queue that receives (event, data) pairs for a task, followed by None
+        when it finishes. Returns None if the task is not queued or running.
+        """
+        job = self._jobs.get(task_id)
+        if job is None:
+            return None
+        events = asyncio.Queue()
+        job.subscribers.append(events)
+        return events
+
+    def cancel(self, task_id: int) -> bool:
+        """
+        Request cancellation of a queued or running task.
+        A running task stops before its next command. Returns False if the task is not active.
+        """
+        job = self._jobs.get(task_id)
+        if job is None:
+            return False
+
+        job.cancel_event.set()
+        return True
+
+    def get_job(self, task_id: int) -> Optional[TaskJob]:
+        """Return the active job for a task, if any."""
+        return self._jobs.get(task_id)
+
+    def queue_position(self, task_id: int) -> Optional[int]:
+        """Return how many queued tasks are ahead of this one, or None if it is not queued."""
+        queued = [job.task_id for job in self._jobs.values() if job.state == "queued"]
+        if task_id not in queued:
+            return None
+        return sorted(queued).index(task_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Counts of queued and running tasks."""
+        states = [job.state for job in self._jobs.values()]
+        return {
+            "max_running": self.max_running,
+            "queued": states.count("queued"),
+            "running": states.count("running")
+        }
+
+    async def shutdown(self, wait: bool = True, timeout: float = None):
+        """
+        Stop the queue: with wait, give running and queued tasks up to timeout
+        seconds to finish; whatever is left is cancelled.
+        """
+        tasks = list(self._tasks.values())
+        if not tasks:
+            return
+        if wait:
+            await asyncio.wait(tasks, timeout=timeout)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, job: TaskJob):
+        """Run one job once a slot is free."""
+        db = self.session_factory()
+        try:
+            async with self._slots:
+                job.state = "running"
+                job.result = await self.task_controller.execute_task(
+                    db,
+                    job.task_description,
+                    on_event=lambda event, data: self._publish(job, event, data),
+                    task_id=job.task_id,
+                    cancel_event=job.cancel_event,
+                    use_cache=job.use_cache
+                )
+        except asyncio.CancelledError:
+            await self._mark_failed(db, job, "Task was interrupted by a server shutdown.")
+            self._publish(job, "error", {"task_id": job.task_id, "error": "Task was interrupted."})
+            raise
+        except Exception as e:
+            logger.exception(f"Task {job.task_id} failed")
+            await self._mark_failed(db, job, str(e))
+            self._publish(job, "error", {"task_id": job.task_id, "error": str(e)})
+        finally:
+            db.close()
+            job.state = "finished"
+            self._finish(job)
+
+    async def _mark_failed(self, db, job: TaskJob, error_message: str):
+        """Record an unexpected failure so the task does not stay "running"."""
+        def mark():
+            db.rollback()
+            self.task_controller.task_service.complete_task(db, job.task_id, "failed", error_message=error_message)
+        try:
+            # Shielded so a cancelled task is still recorded
+            await asyncio.shield(asyncio.to_thread(mark))
+        except Exception:
+            logger.exception(f"Could not mark task {job.task_id} as failed")
+
+    def _publish(self, job: TaskJob, event: str, data: Dict[str, Any]):
+        """Send an event to every subscriber of a job, from any thread."""
+        for events in list(job.subscribers):
+            self._loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    def _finish(self, job: TaskJob):
+        """Close subscriber streams and forget a finished job."""
+        self._jobs.pop(job.task_id, None)
+        self._tasks.pop(job.task_id, None)
+        subscribers, job.subscribers = job.subscribers, []
+        for events in subscribers:
+            self._loop.call_soon_threadsafe(events.put_nowait, None)
@@ -1,14 +1,32 @@
 import os
-import subprocess
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Callable
+
+from app.utils.output_capture import OutputCapture, run_process, run_process_async
+from app.utils.shell_session import ShellSessionPool, AsyncShellSessionPool
+from app.utils.resource_limits import ResourceLimiter
 
 
 class CommandService:
     """Service to manage command execution and security."""
     
-    def __init__(self, allowed_commands=None, timeout=120):
-        """Initialize with optional allowed commands list and timeout."""
+    def __init__(self, allowed_commands=None, timeout=120, session_pool: ShellSessionPool = None,
+                 use_sessions: bool = None, resource_limiter: ResourceLimiter = None):
+        """
+        Initialize with optional allowed commands list and timeout.
+        Commands run with a session_id go to a persistent shell for that id, so the
+        working directory and environment carry over between them.
+        Every command runs under the CPU, memory and process limits of resource_limiter.
+        execute_command_async is the asyncio core's path; its sessions live in a
+        separate AsyncShellSessionPool.
+        """
         self.timeout = timeout
+        self.resource_limiter = resource_limiter or ResourceLimiter()
+        
+        if use_sessions is None:
+            use_sessions = os.getenv("SHELL_SESSIONS_ENABLED", "true").lower() in ['true', '1', 't']
+        self.use_sessions = use_sessions
+        self.session_pool = session_pool or (ShellSessionPool(limiter=self.resource_limiter) if use_sessions else None)
+        self.async_session_pool = AsyncShellSessionPool(limiter=self.resource_limiter) if use_sessions else None
         
         # Default allowed commands if none provided
         self.allowed_commands = allowed_commands or [
@@ -36,10 +54,16 @@ class CommandService:
         
         return {"valid": True, "message": "Command is valid."}
     
-    def execute_command(self, command: str, cwd: Optional[str] = None) -> Dict[str, Any]:
+    def execute_command(self, command: str, cwd: Optional[str] = None, session_id=None,
+                        on_output: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
         """
         Execute a shell command and capture the output.
-        Returns a dict with execution result.
+        With a session_id (and sessions enabled) the command runs in that id's
+        persistent shell; cwd then only applies when the session is started.
+        Output is captured with a size cap (see OutputCapture); on_output receives
+        it in chunks as it arrives.
+        Returns a dict with execution result, including capture metadata and the
+        command's resource_usage (CPU seconds, peak memory and IO bytes) when measured.
         """
         # First, sanitize the command
         validation = self.sanitize_command(command)
@@ -50,43 +74,129 @@ class CommandService:
                 "command": command
             }
         
+        capture = OutputCapture(on_chunk=on_output)
+        if session_id is not None and self.session_pool is not None:
+            return self._execute_in_session(command, session_id, cwd, capture)
+        
         try:
-            # Execute the command and capture the output
-            result = subprocess.run(
-                command,
-                shell=True,
-                text=True,
-                capture_output=True,
-                timeout=self.timeout,
-                cwd=cwd
-            )
-            
-            # Combine stdout and stderr
-            output = result.stdout
-            if result.stderr:
-                if output:
-                    output += "\n" + result.stderr
-                else:
-                    output = result.stderr
+            # Execute the command, streaming stdout and stderr into the capture
+            result = run_process(command, capture, self.timeout, cwd=cwd, shell=True,
+                                 limiter=self.resource_limiter)
+        except Exception as e:
+            return {
+                "success": False,
+                "output": f"Error executing command: {str(e)}",
+                "command": command
+            }
+        return self._process_result(command, result, capture)
+    
+    async def execute_command_async(self, command: str, cwd: Optional[str] = None, session_id=None,
+                                    on_output: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        execute_command for the asyncio core: the command runs with
+        asyncio.create_subprocess_exec (or in an asyncio shell session), so waiting
+        for it does not hold a thread.
+        """
+        validation = self.sanitize_command(command)
+        if not validation["valid"]:
+            return {
+                "success": False,
+                "output": validation["message"],
+                "command": command
+            }
+        
+        capture = OutputCapture(on_chunk=on_output)
+        try:
+            if session_id is not None and self.async_session_pool is not None:
+                result = await self.async_session_pool.run(session_id, command, self.timeout, cwd=cwd,
+                                                           capture=capture)
+                return self._session_result(command, result)
             
+            result = await run_process_async(["/bin/sh", "-c", command], capture, self.timeout, cwd=cwd,
+                                             limiter=self.resource_limiter)
+        except Exception as e:
             return {
-                "success": result.returncode == 0,
-                "output": output,
-                "command": command,
-                "return_code": result.returncode
+                "success": False,
+                "output": f"Error executing command: {str(e)}",
+                "command": command
             }
-        except subprocess.TimeoutExpired:
+        return self._process_result(command, result, capture)
+    
+    def _process_result(self, command: str, result: Dict[str, Any], capture: OutputCapture) -> Dict[str, Any]:
+        """Build the execution result of a command run as its own process."""
+        if result["timed_out"]:
             return {
                 "success": False,
                 "output": f"Command timed out after {self.timeout} seconds.",
-                "command": command
+                "command": command,
+                "capture": capture.metadata(),
+                "resource_usage": result["resource_usage"]
             }
+        
+        return {
+            "success": result["return_code"] == 0,
+            "output": capture.text(),
+            "command": command,
+            "return_code": result["return_code"],
+            "capture": capture.metadata(),
+            "resource_usage": result["resource_usage"]
+        }
+    
+    def session_cwd(self, session_id) -> Optional[str]:
+        """The working directory of session_id's persistent shell, or None if it has none."""
+        for pool in (self.session_pool, self.async_session_pool):
+            cwd = pool.cwd(session_id) if pool is not None else None
+            if cwd:
+                return cwd
+        return None
+    
+    def close_session(self, session_id):
+        """Close the persistent shell for session_id, if there is one."""
+        if self.session_pool is not None:
+            self.session_pool.close(session_id)
+    
+    async def close_session_async(self, session_id):
+        """Close the asyncio shell session for session_id, if there is one."""
+        if self.async_session_pool is not None:
+            await self.async_session_pool.close(session_id)
+    
+    def _execute_in_session(self, command: str, session_id, cwd: Optional[str] = None,
+                            capture: OutputCapture = None) -> Dict[str, Any]:
+        """Run a validated command in the persistent shell for session_id."""
+        try:
+            result = self.session_pool.run(session_id, command, self.timeout, cwd=cwd, capture=capture)
         except Exception as e:
             return {
                 "success": False,
                 "output": f"Error executing command: {str(e)}",
                 "command": command
             }
+        return self._session_result(command, result)
+    
+    def _session_result(self, command: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Build the execution result of a command run in a shell session."""
+        output = result["output"]
+        if result["session_restarted"]:
+            output = ("[The shell session was restarted; the working directory and environment were reset.]\n"
+                      + output)
+        
+        if result["timed_out"]:
+            return {
+                "success": False,
+                "output": (output + "\n" if output else "") + f"Command timed out after {self.timeout} seconds.",
+                "command": command,
+                "capture": result["capture"],
+                "resource_usage": result["resource_usage"]
+            }
+        
+        return {
+            "success": result["return_code"] == 0,
+            "output": output,
+            "command": command,
+            "return_code": result["return_code"],
+            "capture": result["capture"],
+            "resource_usage": result["resource_usage"]
+        }
     
     def execute_command_sequence(self, commands: List[str], cwd: Optional[str] = None) -> List[Dict[str, Any]]:
         """
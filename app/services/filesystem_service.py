@@ -1,17 +1,53 @@
 import os
+import stat
+import time
 import hashlib
 import json
+import logging
+import threading
 from datetime import datetime
 from sqlalchemy.orm import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.core.database import after_commit
 from app.models.filesystem_state import FilesystemState
+from app.models.filesystem_manifest import FilesystemManifest
+from app.utils.stat_cache import StatCache
+from app.utils.hashing import FileHasher
+from app.utils.fs_watcher import ChangeJournal
+
+logger = logging.getLogger(__name__)
 
 
 class FilesystemService:
     """Service to track and manage filesystem state."""
     
-    def __init__(self, base_path="/app"):
-        """Initialize with the base path to track."""
+    def __init__(self, base_path="/app", stat_cache_path=None, keyframe_interval=None, watch=None,
+                 hasher: FileHasher = None):
+        """Initialize with the base path to track and an optional stat cache file."""
         self.base_path = base_path
+        
+        # With an inotify change journal only the touched paths are re-read between
+        # snapshots; the journal is started lazily on the first scan
+        if watch is None:
+            watch = os.getenv("FS_WATCH_ENABLED", "true").lower() in ['true', '1', 't']
+        self.watch_enabled = watch and ChangeJournal.is_supported()
+        self._journal = None
+        self._journal_baseline = None
+        self._scan_lock = threading.Lock()
+        
+        # Snapshots are stored as deltas against the previous one, with a full
+        # manifest every keyframe_interval snapshots to bound the rebuild chain
+        self.keyframe_interval = int(keyframe_interval or os.getenv("FS_KEYFRAME_INTERVAL", "32"))
+        self._last_snapshot = None  # (state_id, filesystem_data, chain_depth)
+        self._snapshot_lock = threading.RLock()
+        
+        # Files are hashed in parallel; see FileHasher for the FS_HASH_* settings
+        self.hasher = hasher or FileHasher()
+        
+        # Hashes are reused for files whose inode, size and mtime are unchanged
+        self.stat_cache = StatCache(stat_cache_path or os.getenv("FS_STAT_CACHE_PATH"),
+                                    namespace=self.hasher.identity)
+        self.last_scan_stats = {}
     
     def capture_filesystem_state(self, db: Session, task_id=None, state_type="snapshot", 
                                 command_index=None, command_text=None):
@@ -20,22 +56,19 @@ class FilesystemService:
         Returns the ID of the created FilesystemState.
         """
         # Get the current filesystem structure
-        fs_data = self._scan_filesystem(self.base_path)
+        fs_data, _, _ = self._current_filesystem_data()
         
         # Create a new filesystem state record
-        fs_state = FilesystemState(
+        fs_state = self._store_state(
+            db,
+            fs_data,
             task_id=task_id,
             state_type=state_type,
-            filesystem_data=fs_data,
             command_index=command_index,
             command_text=command_text,
             changes=[]  # No changes for a snapshot
         )
         
-        db.add(fs_state)
-        db.commit()
-        db.refresh(fs_state)
-        
         return fs_state.id
     
     def compare_and_capture_changes(self, db: Session, previous_state_id, task_id=None, 
@@ -45,38 +78,247 @@ class FilesystemService:
         record the changes, and create a new state record.
         """
         # Get the previous state
-        previous_state = db.query(FilesystemState).filter(FilesystemState.id == previous_state_id).first()
-        if not previous_state:
-            raise ValueError(f"Previous state with ID {previous_state_id} not found")
+        previous_fs_data = self._load_state_data(db, previous_state_id)
         
         # Get the current filesystem structure
-        current_fs_data = self._scan_filesystem(self.base_path)
+        current_fs_data, baseline, touched_paths = self._current_filesystem_data()
         
-        # Compare and identify changes
-        changes = self._compare_filesystem_states(previous_state.filesystem_data, current_fs_data)
+        # Compare and identify changes; when the journal covers everything since the
+        # previous state only the touched paths need comparing
+        if touched_paths is not None and baseline is previous_fs_data:
+            changes = self._compare_filesystem_states(previous_fs_data, current_fs_data, paths=touched_paths)
+        else:
+            changes = self._compare_filesystem_states(previous_fs_data, current_fs_data)
         
         # Create a new filesystem state record with the changes
-        fs_state = FilesystemState(
+        fs_state = self._store_state(
+            db,
+            current_fs_data,
             task_id=task_id,
             state_type=state_type,
-            filesystem_data=current_fs_data,
             command_index=command_index,
             command_text=command_text,
             changes=changes
         )
         
-        db.add(fs_state)
-        db.commit()
-        db.refresh(fs_state)
-        
         return fs_state.id, changes
     
+    def _load_state_data(self, db: Session, state_id):
+        """Return the full filesystem structure of a stored state."""
+        last_snapshot = self._last_snapshot
+        if last_snapshot and last_snapshot[0] == state_id:
+            return last_snapshot[1]
+        
+        state = db.query(FilesystemState).filter(FilesystemState.id == state_id).first()
+        if not state:
+            raise ValueError(f"Previous state with ID {state_id} not found")
+        
+        return state.filesystem_data
+    
+    def _store_state(self, db: Session, fs_data, **fields):
+        """
+        Persist a filesystem state as a delta against the last snapshot,
+        or as a content-addressed manifest when a new keyframe is due.
+        """
+        with self._snapshot_lock:
+            if self._last_snapshot is None:
+                # Resume the chain from the most recent state in the database
+                latest = db.query(FilesystemState).order_by(FilesystemState.id.desc()).first()
+                if latest is not None:
+                    self._last_snapshot = (latest.id, latest.filesystem_data, latest.chain_depth or 0)
+            
+            fs_state = FilesystemState(**fields)
+            
+            if self._last_snapshot is not None and self._last_snapshot[2] + 1 < self.keyframe_interval:
+                parent_id, parent_data, parent_depth = self._last_snapshot
+                fs_state.parent_state_id = parent_id
+                fs_state.delta = self._encode_delta(parent_data, fs_data)
+                fs_state.chain_depth = parent_depth + 1
+            else:
+                fs_state.manifest_id = self._store_manifest(db, fs_data)
+                fs_state.chain_depth = 0
+            
+            # The structure is already known, so later reads skip the rebuild
+            fs_state._materialized_data = fs_data
+            
+            db.add(fs_state)
+            db.commit()
+            db.refresh(fs_state)
+            
+            # Later states may only use this one as their delta parent once it is
+            # committed; inside a unit of work that is when the whole block commits
+            snapshot = (fs_state.id, fs_data, fs_state.chain_depth)
+            after_commit(db, lambda: self._set_last_snapshot(snapshot))
+        
+        return fs_state
+    
+    def _set_last_snapshot(self, snapshot):
+        """Make a committed state the parent of the next delta, unless a newer one already is."""
+        with self._snapshot_lock:
+            if self._last_snapshot is None or self._last_snapshot[0] < snapshot[0]:
+                self._last_snapshot = snapshot
+    
+    def _store_manifest(self, db: Session, fs_data):
+        """Store a full manifest unless an identical one already exists. Returns its ID."""
+        canonical = json.dumps(fs_data, sort_keys=True, separators=(',', ':'))
+        manifest_id = hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+        
+        if db.get(FilesystemManifest, manifest_id) is None:
+            values = {"id": manifest_id, "entry_count": len(fs_data), "data": fs_data}
+            if db.get_bind().dialect.name == "sqlite":
+                # Another session may be storing the same manifest in a transaction
+                # this one cannot see yet, so the insert gives way on a conflict
+                db.execute(sqlite_insert(FilesystemManifest).values(**values).on_conflict_do_nothing())
+            else:
+                db.add(FilesystemManifest(**values))
+        
+        return manifest_id
+    
+    def _encode_delta(self, old_state, new_state):
+        """Return the entries that differ between two filesystem structures."""
+        return {
+            'set': {path: info for path, info in new_state.items() if old_state.get(path) != info},
+            'removed': [path for path in old_state if path not in new_state]
+        }
+    
+    def _current_filesystem_data(self):
+        """
+        Return (fs_data, baseline, touched_paths) for the current filesystem.
+        When the change journal is usable, fs_data is the baseline from the previous
+        call with only the journaled paths re-read; otherwise it comes from a full
+        scan and baseline and touched_paths are None.
+        """
+        with self._scan_lock:
+            journal = self._ensure_journal()
+            if journal is None:
+                return self._scan_filesystem(self.base_path), None, None
+            
+            batch = journal.drain()
+            baseline = self._journal_baseline
+            
+            if batch.overflowed or baseline is None:
+                # The journal was already running during the walk, so anything that
+                # changes mid-scan is picked up again by the next drain
+                fs_data = self._scan_filesystem(self.base_path)
+                self._journal_baseline = fs_data
+                return fs_data, None, None
+            
+            fs_data, touched_paths = self._scan_changed_paths(baseline, batch)
+            self._journal_baseline = fs_data
+            return fs_data, baseline, touched_paths
+    
+    def _ensure_journal(self):
+        """Start the change journal if needed. Returns None when watching is unavailable."""
+        if not self.watch_enabled:
+            return None
+        
+        if self._journal is None or not self._journal.running:
+            # Also covers a forked worker, which inherits the journal but not its thread
+            if self._journal is not None:
+                self._journal.stop()
+            
+            journal = ChangeJournal(self.base_path)
+            try:
+                journal.start()
+            except OSError as e:
+                logger.warning(f"Change journal unavailable, using full scans: {str(e)}")
+                self.watch_enabled = False
+                self._journal = None
+                return None
+            
+            self._journal = journal
+            self._journal_baseline = None
+        
+        return self._journal
+    
     def _scan_filesystem(self, path):
         """
         Recursively scan the filesystem and return a structured representation.
+        Files whose stat metadata is unchanged since the last scan reuse their cached hash.
         """
         result = {}
+        stats = {'mode': 'full', 'reused': 0, 'rehashed': 0, 'started_ns': time.time_ns(), 'pending': []}
+        
+        self._scan_tree(path, result, stats)
+        
+        # Forget files that disappeared
+        if path == self.base_path:
+            self.stat_cache.prune(result.keys())
+        
+        self._finish_scan(path, stats)
+        return result
+    
+    def _scan_changed_paths(self, baseline, batch):
+        """
+        Apply a change journal batch to a previous filesystem structure.
+        Returns the updated structure and the set of paths whose entries changed.
+        """
+        result = dict(baseline)
+        touched = set()
+        stats = {'mode': 'journal', 'reused': 0, 'rehashed': 0, 'started_ns': time.time_ns(), 'pending': []}
+        
+        # A directory's mtime changes whenever an entry is added to or removed from it
+        paths = set(batch.paths)
+        paths.update(os.path.dirname(path) for path in batch.paths if os.path.dirname(path))
+        
+        walked = []
+        for rel_path in sorted(paths):
+            if any(part.startswith('.') for part in rel_path.split(os.sep)):
+                continue
+            
+            # Already covered by a directory walked earlier in this pass
+            if any(rel_path.startswith(parent + os.sep) for parent in walked):
+                continue
+            
+            full_path = os.path.join(self.base_path, rel_path)
+            previous = result.get(rel_path)
+            
+            try:
+                stat_info = os.stat(full_path)
+            except OSError:
+                stat_info = None
+            
+            if stat_info is None:
+                # Deleted, together with everything below it
+                if result.pop(rel_path, None) is not None:
+                    touched.add(rel_path)
+                if previous is not None and previous.get('type') == 'dir':
+                    self._remove_subtree(result, rel_path, touched)
+                continue
+            
+            if stat.S_ISDIR(stat_info.st_mode):
+                result[rel_path] = self._dir_entry(stat_info)
+                touched.add(rel_path)
+                
+                if rel_path in batch.subtrees or previous is None or previous.get('type') != 'dir':
+                    # New or replaced directory: its contents were never seen
+                    self._remove_subtree(result, rel_path, touched)
+                    subtree = {}
+                    self._scan_tree(full_path, subtree, stats)
+                    result.update(subtree)
+                    touched.update(subtree)
+                    walked.append(rel_path)
+                continue
+            
+            if previous is not None and previous.get('type') == 'dir':
+                self._remove_subtree(result, rel_path, touched)
+            
+            result[rel_path] = self._file_entry(full_path, rel_path, stat_info, stats)
+            touched.add(rel_path)
         
+        stats['paths'] = len(paths)
+        self._finish_scan(self.base_path, stats)
+        return result, touched
+    
+    def _remove_subtree(self, fs_data, rel_path, touched):
+        """Remove every entry below a directory from a filesystem structure."""
+        prefix = rel_path + os.sep
+        for path in [path for path in fs_data if path.startswith(prefix)]:
+            del fs_data[path]
+            touched.add(path)
+    
+    def _scan_tree(self, path, result, stats):
+        """Walk a directory tree and add an entry for every non-hidden file and directory below it."""
         for root, dirs, files in os.walk(path):
             # Skip hidden directories
             dirs[:] = [d for d in dirs if not d.startswith('.')]
@@ -91,14 +333,7 @@ class FilesystemService:
                 
                 try:
                     stat_info = os.stat(file_path)
-                    file_hash = self._calculate_file_hash(file_path) if os.path.isfile(file_path) else None
-                    
-                    result[rel_path] = {
-                        'type': 'file',
-                        'size': stat_info.st_size,
-                        'last_modified': datetime.fromtimestamp(stat_info.st_mtime).isoformat(),
-                        'hash': file_hash
-                    }
+                    result[rel_path] = self._file_entry(file_path, rel_path, stat_info, stats)
                 except Exception as e:
                     # Skip files we can't access
                     continue
@@ -109,37 +344,85 @@ class FilesystemService:
                 rel_path = os.path.relpath(dir_path, self.base_path)
                 
                 try:
-                    stat_info = os.stat(dir_path)
-                    
-                    result[rel_path] = {
-                        'type': 'dir',
-                        'last_modified': datetime.fromtimestamp(stat_info.st_mtime).isoformat(),
-                    }
+                    result[rel_path] = self._dir_entry(os.stat(dir_path))
                 except Exception as e:
                     # Skip directories we can't access
                     continue
+    
+    def _file_entry(self, file_path, rel_path, stat_info, stats):
+        """
+        Build the entry for a file, reusing the cached hash when its metadata is unchanged.
+        Cache misses are queued in stats['pending'] and hashed together by _hash_pending.
+        """
+        entry = {
+            'type': 'file',
+            'size': stat_info.st_size,
+            'last_modified': datetime.fromtimestamp(stat_info.st_mtime).isoformat(),
+            'hash': None
+        }
         
-        return result
+        if stat.S_ISREG(stat_info.st_mode):
+            file_hash = self.stat_cache.lookup(rel_path, stat_info)
+            if file_hash is None:
+                stats['pending'].append((entry, file_path, rel_path, stat_info))
+            else:
+                entry['hash'] = file_hash
+                stats['reused'] += 1
+        
+        return entry
     
-    def _calculate_file_hash(self, file_path, block_size=65536):
-        """Calculate MD5 hash of a file."""
-        try:
-            md5 = hashlib.md5()
-            with open(file_path, 'rb') as f:
-                for block in iter(lambda: f.read(block_size), b''):
-                    md5.update(block)
-            return md5.hexdigest()
-        except Exception as e:
-            return None
+    def _hash_pending(self, stats):
+        """Hash every file queued during a scan across the hashing pool."""
+        pending = stats.pop('pending')
+        if not pending:
+            return
+        
+        hashes = self.hasher.hash_files([(file_path, stat_info.st_size) for _, file_path, _, stat_info in pending])
+        
+        for entry, file_path, rel_path, stat_info in pending:
+            entry['hash'] = hashes.get(file_path)
+            self.stat_cache.store(rel_path, stat_info, entry['hash'], stats['started_ns'])
+        stats['rehashed'] += len(pending)
+    
+    def _dir_entry(self, stat_info):
+        """Build the entry for a directory."""
+        return {
+            'type': 'dir',
+            'last_modified': datetime.fromtimestamp(stat_info.st_mtime).isoformat(),
+        }
+    
+    def _finish_scan(self, path, stats):
+        """Hash queued files, persist the stat cache and record statistics for a completed scan."""
+        self._hash_pending(stats)
+        self.stat_cache.save()
+        
+        started_ns = stats.pop('started_ns')
+        stats['files'] = stats['reused'] + stats['rehashed']
+        stats['duration_ms'] = round((time.time_ns() - started_ns) / 1_000_000, 2)
+        self.last_scan_stats = stats
+        
+        logger.info(
+            f"Scanned {path} ({stats['mode']}): {stats['files']} files, "
+            f"{stats['reused']} reused from stat cache, {stats['rehashed']} re-hashed "
+            f"in {stats['duration_ms']} ms"
+        )
     
-    def _compare_filesystem_states(self, old_state, new_state):
+    def _compare_filesystem_states(self, old_state, new_state, paths=None):
         """
         Compare two filesystem states and return a list of changes.
+        If paths is given, only those paths are compared.
         """
         changes = []
         
+        if paths is None:
+            new_items = new_state.items()
+            old_items = old_state.items()
+        else:
+            new_items = [(path, new_state[path]) for path in sorted(paths) if path in new_state]
+            old_items = [(path, old_state[path]) for path in sorted(paths) if path in old_state]
+        
         # Check for created and modified files
-        for path, info in new_state.items():
+        for path, info in new_items:
             if path not in old_state:
                 changes.append({
                     'path': path,
@@ -157,7 +440,7 @@ class FilesystemService:
                 })
         
         # Check for deleted files and directories
-        for path, info in old_state.items():
+        for path, info in old_items:
             if path not in new_state:
                 changes.append({
                     'path': path,
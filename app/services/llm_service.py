@@ -1,68 +1,415 @@
 import os
 import json
-import requests
-from typing import List, Dict, Any, Optional
+import threading
+import contextvars
+from typing import List, Dict, Any, Optional, Callable
+
+from app.utils.http_transport import PooledTransport, AsyncPooledTransport
+from app.utils.response_cache import ResponseCache
+
+
+ANALYSIS_QUESTION = (
+    "Is the task complete? If not, what should be the next command to execute? "
+    "Respond with a JSON object with the following structure:\n"
+    "{\n"
+    '  "task_complete": true/false,\n'
+    '  "next_command": "command to execute if task is not complete",\n'
+    '  "explanation": "brief explanation of your assessment"\n'
+    "}"
+)
 
 
 class LLMService:
-    """Service to handle interactions with the LLM for command and code generation."""
+    """
+    Service to handle interactions with the LLM for command and code generation.
+    The *_async methods are the same calls for the asyncio core; they go through
+    an AsyncPooledTransport created on first use.
+    """
     
     def __init__(self, 
                  api_url=None, 
                  model_name=None, 
                  temperature=0.3, 
                  context_length=8192, 
-                 timeout=120):
+                 timeout=120,
+                 stream=None,
+                 transport: PooledTransport = None,
+                 keep_alive=None,
+                 cache: ResponseCache = None,
+                 async_transport: AsyncPooledTransport = None):
         """Initialize with LLM configuration."""
         self.api_url = api_url or os.getenv("OLLAMA_API_URL", "http://host.docker.internal:11434/api/chat")
         self.model_name = model_name or os.getenv("OLLAMA_MODEL_NAME", "mistral-nemo:12b-instruct-2409-fp16")
         self.temperature = float(os.getenv("OLLAMA_TEMPERATURE", str(temperature)))
         self.context_length = int(os.getenv("OLLAMA_CONTEXT_LENGTH", str(context_length)))
         self.timeout = int(os.getenv("TIMEOUT_SECONDS", str(timeout)))
+        
+        # Stream command generation and stop reading once a full command has arrived
+        if stream is None:
+            stream = os.getenv("OLLAMA_STREAM", "true").lower() in ['true', '1', 't']
+        self.stream = stream
+        
+        # One pooled keep-alive transport shared by every call and thread
+        self.transport = transport or PooledTransport(read_timeout=self.timeout)
+        self._async_transport = async_transport
+        
+        # Keep the model, and with it the prompt cache, loaded between steps
+        self.keep_alive = keep_alive or os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        
+        # Answer repeated requests from the response cache instead of the model
+        if cache is None and os.getenv("LLM_CACHE_ENABLED", "true").lower() in ['true', '1', 't']:
+            cache = ResponseCache()
+        self.cache = cache
+        
+        # Prompt evaluation metrics reported by Ollama
+        self._metrics_lock = threading.Lock()
+        # Per thread and per asyncio task
+        self._last_metrics = contextvars.ContextVar(f"llm_metrics_{id(self)}", default=None)
+        self._generation = {
+            "calls": 0,
+            "calls_with_metrics": 0,
+            "prompt_eval_count": 0,
+            "prompt_eval_duration_ms": 0.0,
+            "eval_count": 0,
+            "eval_duration_ms": 0.0
+        }
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Return connection pool statistics for the LLM transport and totals of the
+        prompt evaluation metrics Ollama reported. Streams cut off early end before
+        Ollama sends its metrics, so they are not counted in calls_with_metrics.
+        """
+        with self._metrics_lock:
+            generation = dict(self._generation)
+        return {
+            "transport": self.transport.stats(),
+            "async_transport": self._async_transport.stats() if self._async_transport else None,
+            "generation": generation,
+            "cache": self.cache.stats() if self.cache else None
+        }
+    
+    @property
+    def last_metrics(self) -> Optional[Dict[str, Any]]:
+        """Metrics of the last call made from the current thread or task, if Ollama reported them."""
+        return self._last_metrics.get()
     
-    def generate_shell_command(self, messages: List[Dict[str, str]]) -> str:
+    @property
+    def async_transport(self) -> AsyncPooledTransport:
+        """The transport of the *_async methods, created on first use."""
+        if self._async_transport is None:
+            self._async_transport = AsyncPooledTransport(read_timeout=self.timeout)
+        return self._async_transport
+    
+    def generate_shell_command(self, messages: List[Dict[str, str]], 
+                               on_token: Optional[Callable[[str], None]] = None,
+                               use_cache: bool = True) -> str:
         """
         Generate a shell command based on the provided messages.
+        When streaming, the response is cut off as soon as one complete command line
+        or TASK_COMPLETE has arrived, and on_token receives each partial token.
+        use_cache=False skips the response cache for this request.
         Returns the generated command as a string.
         """
-        headers = {
-            'Content-Type': 'application/json'
-        }
+        try:
+            self._log_request("Shell Command", messages)
+            
+            cache_key, cached = self._cache_lookup("shell_command", messages, use_cache)
+            if cached is not None:
+                print("\n=== LLM Response (cached) ===")
+                print(cached)
+                if on_token:
+                    on_token(cached)
+                return cached
+            
+            if self.stream:
+                content = self._chat_stream(messages, stop_when=self._extract_command, on_token=on_token)
+                command = self._extract_command(content, final=True)
+            else:
+                command = self._chat(messages).strip()
+            
+            return self._command_result(command, cache_key)
         
+        except Exception as e:
+            print(f"Error generating shell command: {str(e)}")
+            return f"ERROR: {str(e)}"
+    
+    async def generate_shell_command_async(self, messages: List[Dict[str, str]],
+                                           on_token: Optional[Callable[[str], None]] = None,
+                                           use_cache: bool = True) -> str:
+        """generate_shell_command for the asyncio core."""
+        try:
+            self._log_request("Shell Command", messages)
+            
+            cache_key, cached = self._cache_lookup("shell_command", messages, use_cache)
+            if cached is not None:
+                print("\n=== LLM Response (cached) ===")
+                print(cached)
+                if on_token:
+                    on_token(cached)
+                return cached
+            
+            if self.stream:
+                content = await self._chat_stream_async(messages, stop_when=self._extract_command, on_token=on_token)
+                command = self._extract_command(content, final=True)
+            else:
+                command = (await self._chat_async(messages)).strip()
+            
+            return self._command_result(command, cache_key)
+        
+        except Exception as e:
+            print(f"Error generating shell command: {str(e)}")
+            return f"ERROR: {str(e)}"
+    
+    def _command_result(self, command: str, cache_key: Optional[str]) -> str:
+        """Log and cache a generated command."""
+        print("\n=== LLM Response ===")
+        print(command)
+        
+        if command:
+            self._cache_store(cache_key, command)
+        
+        return command
+    
+    def _log_request(self, kind: str, messages: List[Dict[str, str]]):
+        print(f"\n=== LLM Request ({kind}) ===")
+        print("Messages:", json.dumps(messages, indent=2))
+        print("Configuration:", json.dumps(self._options(), indent=2))
+    
+    def _cache_lookup(self, kind: str, messages: List[Dict[str, str]], use_cache: bool):
+        """Return (key, cached value) for a request; both are None when the cache is bypassed."""
+        if not use_cache or self.cache is None:
+            return None, None
+        
+        key = self.cache.make_key(kind, self.model_name, self.temperature, messages)
+        return key, self.cache.get(key)
+    
+    def _cache_store(self, key: Optional[str], value: Any):
+        """Store a successful response under the key returned by _cache_lookup."""
+        if key is not None and self.cache is not None:
+            self.cache.put(key, value)
+    
+    def _options(self) -> Dict[str, Any]:
+        """Model options sent with every request."""
+        return {
+            "temperature": self.temperature,
+            "num_ctx": self.context_length
+        }
+    
+    def _payload(self, messages: List[Dict[str, str]], stream: bool,
+                 response_format: Optional[str] = None) -> Dict[str, Any]:
+        """Build a chat request body."""
         payload = {
             "model": self.model_name,
             "messages": messages,
-            "stream": False,
-            "options": {
-                "temperature": self.temperature,
-                "num_ctx": self.context_length
-            }
+            "stream": stream,
+            "options": self._options(),
+            "keep_alive": self.keep_alive
         }
+        if response_format:
+            payload["format"] = response_format
+        return payload
+    
+    def _record_metrics(self, data: Optional[Dict[str, Any]]):
+        """Remember the prompt/eval counts and durations from a final Ollama response."""
+        metrics = None
+        if data and "prompt_eval_count" in data:
+            metrics = {
+                "prompt_eval_count": data.get("prompt_eval_count", 0),
+                "prompt_eval_duration_ms": data.get("prompt_eval_duration", 0) / 1e6,
+                "eval_count": data.get("eval_count", 0),
+                "eval_duration_ms": data.get("eval_duration", 0) / 1e6
+            }
+        self._last_metrics.set(metrics)
+        
+        with self._metrics_lock:
+            self._generation["calls"] += 1
+            if metrics:
+                self._generation["calls_with_metrics"] += 1
+                for key, value in metrics.items():
+                    self._generation[key] += value
+    
+    def _chat(self, messages: List[Dict[str, str]], response_format: Optional[str] = None) -> str:
+        """Send a non-streaming chat request and return the response content."""
+        payload = self._payload(messages, False, response_format)
+        
+        response = self.transport.post(self.api_url, json=payload, headers={'Content-Type': 'application/json'})
+        response.raise_for_status()
+        data = response.json()
+        self._record_metrics(data)
+        
+        return data.get("message", {}).get("content", "")
+    
+    async def _chat_async(self, messages: List[Dict[str, str]], response_format: Optional[str] = None) -> str:
+        """_chat on the async transport."""
+        payload = self._payload(messages, False, response_format)
+        
+        response = await self.async_transport.post(self.api_url, json=payload)
+        response.raise_for_status()
+        data = response.json()
+        self._record_metrics(data)
+        
+        return data.get("message", {}).get("content", "")
+    
+    def _chat_stream(self, messages: List[Dict[str, str]],
+                     stop_when: Optional[Callable[[str], Optional[str]]] = None,
+                     on_token: Optional[Callable[[str], None]] = None,
+                     response_format: Optional[str] = None) -> str:
+        """
+        Send a streaming chat request and read the NDJSON token stream incrementally.
+        Stops reading and closes the connection (which makes Ollama stop generating)
+        as soon as stop_when returns a value for the content received so far.
+        Returns the content received.
+        """
+        payload = self._payload(messages, True, response_format)
         
+        content = ""
+        final_chunk = None
+        response = self.transport.post(self.api_url, json=payload, headers={'Content-Type': 'application/json'},
+                                       stream=True)
         try:
-            print("\n=== LLM Request (Shell Command) ===")
-            print("Messages:", json.dumps(messages, indent=2))
-            print("Configuration:", json.dumps(payload["options"], indent=2))
-            
-            response = requests.post(self.api_url, json=payload, headers=headers, timeout=self.timeout)
             response.raise_for_status()
-            data = response.json()
             
-            print("\n=== LLM Response ===")
-            print(json.dumps(data, indent=2))
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                
+                chunk, token = self._parse_chunk(line)
+                if token:
+                    content += token
+                    if on_token:
+                        on_token(token)
+                
+                if chunk.get("done"):
+                    final_chunk = chunk
+                    break
+                if stop_when and stop_when(content) is not None:
+                    break
+        finally:
+            response.close()
+        
+        self._record_metrics(final_chunk)
+        
+        return content
+    
+    async def _chat_stream_async(self, messages: List[Dict[str, str]],
+                                 stop_when: Optional[Callable[[str], Optional[str]]] = None,
+                                 on_token: Optional[Callable[[str], None]] = None,
+                                 response_format: Optional[str] = None) -> str:
+        """_chat_stream on the async transport."""
+        payload = self._payload(messages, True, response_format)
+        
+        content = ""
+        final_chunk = None
+        response = await self.async_transport.stream(self.api_url, json=payload)
+        try:
+            response.raise_for_status()
             
-            return data.get("message", {}).get("content", "").strip()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                
+                chunk, token = self._parse_chunk(line)
+                if token:
+                    content += token
+                    if on_token:
+                        on_token(token)
+                
+                if chunk.get("done"):
+                    final_chunk = chunk
+                    break
+                if stop_when and stop_when(content) is not None:
+                    break
+        finally:
+            await response.aclose()
         
-        except Exception as e:
-            print(f"Error generating shell command: {str(e)}")
-            return f"ERROR: {str(e)}"
+        self._record_metrics(final_chunk)
+        
+        return content
+    
+    @staticmethod
+    def _parse_chunk(line) -> tuple:
+        """Decode one NDJSON line of a stream into (chunk, token), raising on an error chunk."""
+        chunk = json.loads(line)
+        if chunk.get("error"):
+            raise RuntimeError(chunk["error"])
+        return chunk, chunk.get("message", {}).get("content", "")
     
-    def generate_python_code(self, prompt: str, file_description: Optional[str] = None) -> Dict[str, Any]:
+    @staticmethod
+    def _extract_command(content: str, final: bool = False) -> Optional[str]:
+        """
+        Return the first complete command line in a (possibly partial) response,
+        skipping blank lines and markdown code fences, or TASK_COMPLETE.
+        Returns None while the command is still incomplete, unless final is set.
+        """
+        stripped = content.lstrip()
+        if stripped.startswith("TASK_COMPLETE"):
+            return "TASK_COMPLETE"
+        
+        lines = stripped.split("\n")
+        
+        # The last line has no terminating newline yet, so it may still grow
+        complete_lines = lines if final else lines[:-1]
+        for line in complete_lines:
+            line = line.strip()
+            if not line or line.startswith("```"):
+                continue
+            return line
+        
+        return stripped.strip() if final else None
+    
+    def generate_python_code(self, prompt: str, file_description: Optional[str] = None,
+                             use_cache: bool = True) -> Dict[str, Any]:
         """
         Generate Python code based on the provided prompt.
+        use_cache=False skips the response cache for this request.
         Returns a dict with the generated code and metadata.
         """
-        messages = [
+        messages = self._code_messages(prompt, file_description)
+        
+        try:
+            self._log_code_request(prompt)
+            
+            cache_key, cached = self._cache_lookup("python_code", messages, use_cache)
+            if cached is not None:
+                return self._code_result(cached, None, prompt, file_description, cached=True)
+            
+            return self._code_result(self._chat(messages), cache_key, prompt, file_description)
+        
+        except Exception as e:
+            print(f"Error generating Python code: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "prompt": prompt
+            }
+    
+    async def generate_python_code_async(self, prompt: str, file_description: Optional[str] = None,
+                                         use_cache: bool = True) -> Dict[str, Any]:
+        """generate_python_code for the asyncio core."""
+        messages = self._code_messages(prompt, file_description)
+        
+        try:
+            self._log_code_request(prompt)
+            
+            cache_key, cached = self._cache_lookup("python_code", messages, use_cache)
+            if cached is not None:
+                return self._code_result(cached, None, prompt, file_description, cached=True)
+            
+            return self._code_result(await self._chat_async(messages), cache_key, prompt, file_description)
+        
+        except Exception as e:
+            print(f"Error generating Python code: {str(e)}")
+            return {
+                "success": False,
+                "error": str(e),
+                "prompt": prompt
+            }
+    
+    @staticmethod
+    def _code_messages(prompt: str, file_description: Optional[str]) -> List[Dict[str, str]]:
+        """The chat request for generating Python code."""
+        return [
             {
                 "role": "system",
                 "content": (
@@ -80,65 +427,90 @@ class LLMService:
                               if file_description else "")
             }
         ]
-        
-        headers = {
-            'Content-Type': 'application/json'
+    
+    def _log_code_request(self, prompt: str):
+        print("\n=== LLM Request (Python Code) ===")
+        print("Prompt:", prompt)
+        print("Configuration:", json.dumps(self._options(), indent=2))
+    
+    def _code_result(self, code: str, cache_key: Optional[str], prompt: str,
+                     file_description: Optional[str], cached: bool = False) -> Dict[str, Any]:
+        """Clean up generated code, cache it and build the result dict."""
+        result = {
+            "success": True,
+            "code": code,
+            "prompt": prompt,
+            "file_description": file_description
         }
+        if cached:
+            result["cached"] = True
+            return result
         
-        payload = {
-            "model": self.model_name,
-            "messages": messages,
-            "stream": False,
-            "options": {
-                "temperature": self.temperature,
-                "num_ctx": self.context_length
-            }
-        }
+        code = code.strip()
         
-        try:
-            print("\n=== LLM Request (Python Code) ===")
-            print("Prompt:", prompt)
-            print("Configuration:", json.dumps(payload["options"], indent=2))
-            
-            response = requests.post(self.api_url, json=payload, headers=headers, timeout=self.timeout)
-            response.raise_for_status()
-            data = response.json()
-            
-            code = data.get("message", {}).get("content", "").strip()
-            
-            # Clean up code if it has markdown code blocks
-            if code.startswith("```python"):
-                code = code[len("```python"):].strip()
-            if code.startswith("```"):
-                code = code[len("```"):].strip()
-            if code.endswith("```"):
-                code = code[:-len("```")].strip()
-            
-            return {
-                "success": True,
-                "code": code,
-                "prompt": prompt,
-                "file_description": file_description
-            }
+        # Clean up code if it has markdown code blocks
+        if code.startswith("```python"):
+            code = code[len("```python"):].strip()
+        if code.startswith("```"):
+            code = code[len("```"):].strip()
+        if code.endswith("```"):
+            code = code[:-len("```")].strip()
         
-        except Exception as e:
-            print(f"Error generating Python code: {str(e)}")
-            return {
-                "success": False,
-                "error": str(e),
-                "prompt": prompt
-            }
+        if code:
+            self._cache_store(cache_key, code)
+        
+        result["code"] = code
+        return result
     
     def analyze_command_result(self, 
                               task: str, 
                               command: str, 
                               output: str, 
-                              previous_commands: List[Dict[str, Any]]) -> Dict[str, Any]:
+                              previous_commands: List[Dict[str, Any]],
+                              messages: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
         """
         Analyze the result of a command execution and determine next steps.
+        If messages (the task conversation, ending with the command's output) is given,
+        the question is appended to it instead of building a new prompt, so Ollama can
+        reuse the already evaluated prefix.
         Returns a dict with analysis and recommendation.
         """
-        messages = [
+        try:
+            if messages is not None:
+                # Ask as one more turn of the task conversation
+                response_text = self._chat(messages + [{"role": "user", "content": ANALYSIS_QUESTION}],
+                                           response_format="json")
+            else:
+                response_text = self._chat(self._analysis_messages(task, command, output, previous_commands))
+            return self._parse_json_response(response_text)
+            
+        except Exception as e:
+            return self._analysis_error(e)
+    
+    async def analyze_command_result_async(self, 
+                                           task: str, 
+                                           command: str, 
+                                           output: str, 
+                                           previous_commands: List[Dict[str, Any]],
+                                           messages: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+        """analyze_command_result for the asyncio core."""
+        try:
+            if messages is not None:
+                response_text = await self._chat_async(messages + [{"role": "user", "content": ANALYSIS_QUESTION}],
+                                                       response_format="json")
+            else:
+                response_text = await self._chat_async(
+                    self._analysis_messages(task, command, output, previous_commands))
+            return self._parse_json_response(response_text)
+            
+        except Exception as e:
+            return self._analysis_error(e)
+    
+    @staticmethod
+    def _analysis_messages(task: str, command: str, output: str,
+                           previous_commands: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """A standalone analysis request, for callers without a task conversation."""
+        return [
             {
                 "role": "system",
                 "content": (
@@ -154,49 +526,182 @@ class LLMService:
                     f"Command executed: {command}\n\n"
                     f"Command output: {output}\n\n"
                     f"Previous commands: {json.dumps(previous_commands, indent=2)}\n\n"
-                    "Is the task complete? If not, what should be the next command to execute? "
-                    "Respond with a JSON object with the following structure:\n"
-                    "{\n"
-                    '  "task_complete": true/false,\n'
-                    '  "next_command": "command to execute if task is not complete",\n'
-                    '  "explanation": "brief explanation of your assessment"\n'
-                    "}"
+                    + ANALYSIS_QUESTION
                 )
             }
         ]
-        
+    
+    @staticmethod
+    def _analysis_error(e: Exception) -> Dict[str, Any]:
+        return {
+            "task_complete": False,
+            "next_command": "",
+            "explanation": f"Error analyzing command result: {str(e)}"
+        }
+    
+    def generate_step(self, messages: List[Dict[str, str]],
+                      on_token: Optional[Callable[[str], None]] = None,
+                      use_cache: bool = True) -> Dict[str, Any]:
+        """
+        Ask for one structured step: whether the task is complete, the next command
+        (or a batch of commands) and an explanation, in a single JSON response. When
+        streaming, reading stops as soon as the JSON object is closed.
+        use_cache=False skips the response cache for this request.
+        Returns a dict with task_complete, next_command, commands (see _parse_commands),
+        explanation and the raw_response text, plus an error key if the request failed.
+        """
         try:
-            response_text = self.generate_shell_command(messages)
+            self._log_request("Step", messages)
             
-            # Extract JSON from response
-            try:
-                # Find JSON in the response
-                start_idx = response_text.find('{')
-                end_idx = response_text.rfind('}') + 1
-                
-                if start_idx >= 0 and end_idx > start_idx:
-                    json_str = response_text[start_idx:end_idx]
-                    result = json.loads(json_str)
-                else:
-                    # Default response if JSON not found
-                    result = {
-                        "task_complete": False,
-                        "next_command": "",
-                        "explanation": "Failed to parse LLM response as JSON."
-                    }
-            except json.JSONDecodeError:
-                # Default response if JSON parsing fails
-                result = {
-                    "task_complete": False,
-                    "next_command": "",
-                    "explanation": "Failed to parse LLM response as JSON."
-                }
+            cache_key, response_text = self._cache_lookup("step", messages, use_cache)
+            if response_text is not None:
+                cache_key = None
+                if on_token:
+                    on_token(response_text)
+            elif self.stream:
+                response_text = self._chat_stream(messages, stop_when=self._extract_json_object,
+                                                  on_token=on_token, response_format="json")
+            else:
+                response_text = self._chat(messages, response_format="json")
             
-            return result
+            return self._step_result(response_text, cache_key)
+        
+        except Exception as e:
+            return self._step_error(e)
+    
+    async def generate_step_async(self, messages: List[Dict[str, str]],
+                                  on_token: Optional[Callable[[str], None]] = None,
+                                  use_cache: bool = True) -> Dict[str, Any]:
+        """generate_step for the asyncio core."""
+        try:
+            self._log_request("Step", messages)
             
+            cache_key, response_text = self._cache_lookup("step", messages, use_cache)
+            if response_text is not None:
+                cache_key = None
+                if on_token:
+                    on_token(response_text)
+            elif self.stream:
+                response_text = await self._chat_stream_async(messages, stop_when=self._extract_json_object,
+                                                              on_token=on_token, response_format="json")
+            else:
+                response_text = await self._chat_async(messages, response_format="json")
+            
+            return self._step_result(response_text, cache_key)
+        
         except Exception as e:
-            return {
-                "task_complete": False,
-                "next_command": "",
-                "explanation": f"Error analyzing command result: {str(e)}"
-            } 
\ No newline at end of file
+            return self._step_error(e)
+    
+    def _step_result(self, response_text: str, cache_key: Optional[str]) -> Dict[str, Any]:
+        """Log, cache and parse a step response."""
+        print("\n=== LLM Response ===")
+        print(response_text)
+
+        # Only well-formed answers are worth replaying
+        if self._extract_json_object(response_text) is not None:
+            self._cache_store(cache_key, response_text)
+
+        step = self._parse_json_response(response_text)
+        next_command = str(step.get("next_command") or "").strip()
+        task_complete = step.get("task_complete") in (True, "true", "True") or next_command == "TASK_COMPLETE"
+        
+        return {
+            "task_complete": task_complete,
+            "next_command": "" if task_complete else next_command,
+            "commands": [] if task_complete else self._parse_commands(step),
+            "explanation": step.get("explanation", ""),
+            "raw_response": response_text
+        }
+    
+    @staticmethod
+    def _step_error(e: Exception) -> Dict[str, Any]:
+        print(f"Error generating step: {str(e)}")
+        return {
+            "task_complete": False,
+            "next_command": "",
+            "commands": [],
+            "explanation": f"Error generating step: {str(e)}",
+            "error": str(e)
+        }
+    
+    @staticmethod
+    def _parse_json_response(response_text: str) -> Dict[str, Any]:
+        """Extract the JSON object from a response, with a default result if there is none."""
+        try:
+            # Find JSON in the response
+            start_idx = response_text.find('{')
+            end_idx = response_text.rfind('}') + 1
+            
+            if start_idx >= 0 and end_idx > start_idx:
+                json_str = response_text[start_idx:end_idx]
+                return json.loads(json_str)
+        except json.JSONDecodeError:
+            pass
+        
+        # Default response if JSON is missing or cannot be parsed
+        return {
+            "task_complete": False,
+            "next_command": "",
+            "explanation": "Failed to parse LLM response as JSON."
+        }
+    
+    @staticmethod
+    def _parse_commands(step: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        Normalize a step's "commands" list to dicts with id, command and depends_on
+        (a list of ids). Entries may also be plain command strings; ids default to
+        the 1-based position.
+        """
+        commands = []
+        raw_commands = step.get("commands")
+        if not isinstance(raw_commands, list):
+            return commands
+        
+        for position, item in enumerate(raw_commands, 1):
+            if isinstance(item, str):
+                item = {"command": item}
+            if not isinstance(item, dict):
+                continue
+            command = str(item.get("command") or "").strip()
+            if not command:
+                continue
+            depends_on = item.get("depends_on") or []
+            if not isinstance(depends_on, list):
+                depends_on = [depends_on]
+            commands.append({
+                "id": str(item.get("id", position)),
+                "command": command,
+                "depends_on": [str(dependency) for dependency in depends_on]
+            })
+        
+        return commands
+    
+    @staticmethod
+    def _extract_json_object(content: str) -> Optional[str]:
+        """Return the first complete top-level JSON object in a partial response, or None."""
+        start_idx = content.find('{')
+        if start_idx < 0:
+            return None
+        
+        depth = 0
+        in_string = False
+        escaped = False
+        for idx in range(start_idx, len(content)):
+            char = content[idx]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == '{':
+                depth += 1
+            elif char == '}':
+                depth -= 1
+                if depth == 0:
+                    return content[start_idx:idx + 1]
+        
+        return None
@@ -1,15 +1,36 @@
 import os
+import logging
 import tempfile
-import subprocess
 from pathlib import Path
 
+from app.utils.output_capture import OutputCapture, run_process
+from app.utils.python_pool import PythonWorkerPool
+from app.utils.resource_limits import ResourceLimiter
+
+logger = logging.getLogger(__name__)
+
 
 class PythonService:
     """Service to manage Python code execution and file operations."""
     
-    def __init__(self, base_path="/app"):
-        """Initialize with the base path for operations."""
+    def __init__(self, base_path="/app", execution_mode=None, worker_pool: PythonWorkerPool = None,
+                 resource_limiter: ResourceLimiter = None):
+        """
+        Initialize with the base path for operations.
+        execution_mode "pool" (default) runs code on warm interpreters from a
+        PythonWorkerPool; "forkserver" forks every run from a preloaded server
+        process; "subprocess" starts a new interpreter for every run.
+        Runs are limited and measured with resource_limiter.
+        """
         self.base_path = base_path
+        self.execution_mode = execution_mode or os.getenv("PYTHON_EXECUTION_MODE", "pool")
+        self.resource_limiter = resource_limiter or ResourceLimiter()
+        
+        self.worker_pool = worker_pool
+        if self.worker_pool is None and self.execution_mode == "pool":
+            self.worker_pool = PythonWorkerPool(limiter=self.resource_limiter)
+        elif self.worker_pool is None and self.execution_mode == "forkserver":
+            self.worker_pool = PythonWorkerPool(fork=True, limiter=self.resource_limiter)
     
     def create_python_file(self, file_path, code_content):
         """
@@ -48,12 +69,18 @@ class PythonService:
                 "message": f"Failed to create Python file: {str(e)}"
             }
     
-    def execute_python_code(self, code, use_file=False):
+    def execute_python_code(self, code, use_file=False, on_output=None):
         """
         Execute Python code either directly or from a temporary file.
+        on_output, if given, receives the output in chunks as it arrives.
         Returns dict with execution result.
         """
         try:
+            if self.worker_pool is not None:
+                # Warm workers run the source directly, so no temporary file lands in base_path
+                return self._run(['python', '-c', code], on_output,
+                                 request={"code": code, "filename": "<generated>"})
+            
             if use_file:
                 # Create a temporary file
                 with tempfile.NamedTemporaryFile(suffix='.py', dir=self.base_path, delete=False) as tmp_file:
@@ -61,20 +88,7 @@ class PythonService:
                     tmp_path = tmp_file.name
                 
                 # Execute the file
-                try:
-                    output = subprocess.check_output(
-                        ['python', tmp_path], 
-                        stderr=subprocess.STDOUT,
-                        text=True,
-                        timeout=30
-                    )
-                    success = True
-                except subprocess.CalledProcessError as e:
-                    output = e.output
-                    success = False
-                except subprocess.TimeoutExpired:
-                    output = "Execution timed out after 30 seconds."
-                    success = False
+                result = self._run(['python', tmp_path], on_output)
                 
                 # Clean up the temporary file
                 try:
@@ -83,34 +97,19 @@ class PythonService:
                     pass
             else:
                 # Execute code directly through python -c
-                try:
-                    output = subprocess.check_output(
-                        ['python', '-c', code],
-                        stderr=subprocess.STDOUT,
-                        text=True,
-                        timeout=30
-                    )
-                    success = True
-                except subprocess.CalledProcessError as e:
-                    output = e.output
-                    success = False
-                except subprocess.TimeoutExpired:
-                    output = "Execution timed out after 30 seconds."
-                    success = False
+                result = self._run(['python', '-c', code], on_output)
             
-            return {
-                "success": success,
-                "output": output
-            }
+            return result
         except Exception as e:
             return {
                 "success": False,
                 "output": f"Error executing Python code: {str(e)}"
             }
     
-    def execute_python_file(self, file_path, args=None):
+    def execute_python_file(self, file_path, args=None, on_output=None):
         """
         Execute a Python file with optional arguments.
+        on_output, if given, receives the output in chunks as it arrives.
         Returns dict with execution result.
         """
         try:
@@ -143,27 +142,50 @@ class PythonService:
                     command.append(args)
             
             # Execute the file
-            try:
-                output = subprocess.check_output(
-                    command,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    timeout=30
-                )
-                success = True
-            except subprocess.CalledProcessError as e:
-                output = e.output
-                success = False
-            except subprocess.TimeoutExpired:
-                output = "Execution timed out after 30 seconds."
-                success = False
-            
-            return {
-                "success": success,
-                "output": output
-            }
+            return self._run(command, on_output,
+                             request={"path": full_path, "argv": command[2:]})
         except Exception as e:
             return {
                 "success": False,
                 "output": f"Error executing Python file: {str(e)}"
-            } 
\ No newline at end of file
+            } 
+    
+    def get_stats(self):
+        """Return execution mode and worker pool statistics."""
+        return {
+            "execution_mode": self.execution_mode,
+            "pool": self.worker_pool.stats() if self.worker_pool is not None else None
+        }
+    
+    def _run(self, command, on_output=None, timeout=30, request=None):
+        """
+        Run Python with stdout and stderr merged into a bounded capture: on a warm
+        worker when a pool is configured and request describes the run, otherwise
+        as the command in a new process.
+        Returns dict with execution result, capture metadata and resource usage.
+        """
+        capture = OutputCapture(on_chunk=on_output)
+        result = None
+        if self.worker_pool is not None and request is not None:
+            try:
+                result = self.worker_pool.run(request, timeout, capture)
+            except RuntimeError as e:
+                # No warm worker could be had; fall back to a new interpreter
+                logger.warning(f"Python worker pool unavailable: {str(e)}")
+        if result is None:
+            result = run_process(command, capture, timeout, limiter=self.resource_limiter)
+        
+        if result["timed_out"]:
+            return {
+                "success": False,
+                "output": f"Execution timed out after {timeout} seconds.",
+                "capture": capture.metadata(),
+                "resource_usage": result.get("resource_usage")
+            }
+        
+        return {
+            "success": result["return_code"] == 0,
+            "output": capture.text(),
+            "capture": capture.metadata(),
+            "resource_usage": result.get("resource_usage")
+        }
@@ -0,0 +1,141 @@
+import os
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Any
+
+from app.core.database import session_factory
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotPipeline:
+    """
+    Service to run filesystem snapshot jobs (capture, diff and persist) on background workers.
+
+    Jobs are queued in a bounded queue, so submitters block once the workers fall
+    too far behind. Jobs for the same task run in submission order, and callers
+    can wait for everything still pending for a task before touching the
+    filesystem again or finalizing it.
+    """
+
+    def __init__(self, workers: int = None, queue_size: int = None, db_session_factory=None):
+        """Initialize with worker count, queue bound and a factory for per-job DB sessions."""
+        self.workers = int(workers or os.getenv("SNAPSHOT_WORKERS", "2"))
+        self.queue_size = int(queue_size or os.getenv("SNAPSHOT_QUEUE_SIZE", "32"))
+        self.session_factory = db_session_factory or session_factory
+
+        self._queue = None
+        self._threads: List[threading.Thread] = []
+        self._started_pid = None
+        self._pending: Dict[Any, List[Future]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, task_id, job: Callable) -> Future:
+        """
+        Queue job(db) to run on a worker with its own database session.
+        Blocks while the queue is full. Returns a Future for the job's result.
+        """
+        self._ensure_started()
+
+        future = Future()
+        with self._lock:
+            pending = self._pending.setdefault(task_id, [])
+            previous = pending[-1] if pending else None
+            pending.append(future)
+
+        self._queue.put((task_id, job, future, previous))
+        return future
+
+    def wait_for_task(self, task_id, timeout: float = None):
+        """
+        Block until every job submitted for a task has finished.
+        Job failures are logged rather than raised.
+        """
+        with self._lock:
+            futures = list(self._pending.get(task_id, []))
+
+        for future in futures:
+            try:
+                future.result(timeout=timeout)
+            except Exception as e:
+                logger.error(f"Snapshot job for task {task_id} failed: {str(e)}")
+
+    def pending_count(self, task_id=None) -> int:
+        """Number of unfinished jobs, for one task or overall."""
+        with self._lock:
+            if task_id is not None:
+                return len(self._pending.get(task_id, []))
+            return sum(len(futures) for futures in self._pending.values())
+
+    def shutdown(self, wait: bool = True):
+        """Stop the workers once the queue has drained."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+            work_queue = self._queue
+
+        if work_queue is None:
+            return
+
+        for _ in threads:
+            work_queue.put(None)
+        if wait:
+            for thread in threads:
+                thread.join()
+
+    def _ensure_started(self):
+        """Start worker threads on first use, and again in a forked process."""
+        with self._lock:
+            if self._threads and self._started_pid == os.getpid():
+                return
+
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._pending = {}
+            self._started_pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._worker, name=f"snapshot-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _worker(self):
+        """Run queued jobs until a stop marker arrives."""
+        work_queue = self._queue
+
+        while True:
+            item = work_queue.get()
+            if item is None:
+                work_queue.task_done()
+                return
+
+            task_id, job, future, previous = item
+
+            # Keep jobs for one task in order; the previous job was dequeued first,
+            # so it is already running on another worker or finished
+            if previous is not None:
+                try:
+                    previous.result()
+                except Exception:
+                    pass
+
+            db = self.session_factory()
+            try:
+                future.set_result(job(db))
+            except Exception as e:
+                db.rollback()
+                future.set_exception(e)
+            finally:
+                db.close()
+                self._forget(task_id, future)
+                work_queue.task_done()
+
+    def _forget(self, task_id, future):
+        """Drop a finished job from the pending list."""
+        with self._lock:
+            pending = self._pending.get(task_id)
+            if pending and future in pending:
+                pending.remove(future)
+                if not pending:
+                    del self._pending[task_id]
@@ -0,0 +1,220 @@
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+
+from app.core.database import session_factory
+
+logger = logging.getLogger(__name__)
+
+
+class TaskJob:
+    """A task waiting for, or running on, a TaskQueue worker."""
+
+    def __init__(self, task_id: int, task_description: str, use_cache: bool = True):
+        self.task_id = task_id
+        self.task_description = task_description
+        self.use_cache = use_cache
+        self.state = "queued"  # Options: queued, running, finished
+        self.cancel_event = threading.Event()
+        self.subscribers: List[queue.Queue] = []
+        self.result: Optional[Dict[str, Any]] = None
+
+
+class TaskQueue:
+    """
+    Service to execute queued tasks on a pool of background worker threads.
+
+    Workers share the controller and services, which spend most of their time
+    waiting on the LLM and on subprocesses, so threads give many tasks in flight
+    per process. Each job runs with its own database session. Progress events
+    are fanned out to any subscribed queues.
+    """
+
+    def __init__(self, task_controller, workers: int = None, max_queued: int = None, db_session_factory=None):
+        """Initialize with the controller that executes tasks and the pool configuration."""
+        self.task_controller = task_controller
+        self.workers = int(workers or os.getenv("TASK_WORKERS", "4"))
+        self.max_queued = int(max_queued or os.getenv("TASK_QUEUE_SIZE", "100"))
+        self.session_factory = db_session_factory or session_factory
+
+        self._queue = None
+        self._threads: List[threading.Thread] = []
+        self._started_pid = None
+        self._jobs: Dict[int, TaskJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, task_id: int, task_description: str, subscriber: queue.Queue = None,
+               use_cache: bool = True) -> TaskJob:
+        """
+        Queue an already created task for execution.
+        subscriber, if given, receives the task's events as with subscribe().
+        use_cache=False makes the task bypass the LLM response cache.
+        Raises queue.Full when max_queued tasks are already waiting.
+        """
+        self._ensure_started()
+
+        job = TaskJob(task_id, task_description, use_cache)
+        if subscriber is not None:
+            job.subscribers.append(subscriber)
+        with self._lock:
+            self._jobs[task_id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(task_id, None)
+            raise
+
+        return job
+
+    def subscribe(self, task_id: int) -> Optional[queue.Queue]:
+        """
+        Return a queue that receives (event, data) pairs for a task, followed by None
+        when it finishes. Returns None if the task is not queued or running.
+        """
+        events = queue.Queue()
+        with self._lock:
+            job = self._jobs.get(task_id)
+            if job is None:
+                return None
+            job.subscribers.append(events)
+        return events
+
+    def cancel(self, task_id: int) -> bool:
+        """
+        Request cancellation of a queued or running task.
+        A running task stops before its next command. Returns False if the task is not active.
+        """
+        with self._lock:
+            job = self._jobs.get(task_id)
+        if job is None:
+            return False
+
+        job.cancel_event.set()
+        return True
+
+    def get_job(self, task_id: int) -> Optional[TaskJob]:
+        """Return the active job for a task, if any."""
+        with self._lock:
+            return self._jobs.get(task_id)
+
+    def queue_position(self, task_id: int) -> Optional[int]:
+        """Return how many queued tasks are ahead of this one, or None if it is not queued."""
+        with self._lock:
+            queued = [job.task_id for job in self._jobs.values() if job.state == "queued"]
+        if task_id not in queued:
+            return None
+        return sorted(queued).index(task_id)
+
+    def stats(self) -> Dict[str, int]:
+        """Counts of queued and running tasks."""
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+        return {
+            "workers": self.workers,
+            "queued": states.count("queued"),
+            "running": states.count("running")
+        }
+
+    def shutdown(self, wait: bool = True, timeout: float = None):
+        """
+        Stop accepting work and, if wait is set, let running and queued tasks
+        finish within timeout seconds overall. Tasks still unfinished after
+        that are marked failed, since the process is about to exit.
+        """
+        with self._lock:
+            threads, self._threads = self._threads, []
+            work_queue = self._queue
+
+        if work_queue is None or self._started_pid != os.getpid():
+            return
+
+        for _ in threads:
+            work_queue.put(None)
+        if not wait:
+            return
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()) if deadline is not None else None)
+
+        with self._lock:
+            unfinished = list(self._jobs.values())
+        for job in unfinished:
+            job.cancel_event.set()
+            db = self.session_factory()
+            try:
+                self._mark_failed(db, job, "Task was interrupted by a server shutdown.")
+            finally:
+                db.close()
+
+    def _ensure_started(self):
+        """Start worker threads on first use, and again in a forked process."""
+        with self._lock:
+            if self._threads and self._started_pid == os.getpid():
+                return
+
+            self._queue = queue.Queue(maxsize=self.max_queued)
+            self._jobs = {}
+            self._started_pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._worker, name=f"task-worker-{i}", daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+    def _worker(self):
+        """Run queued tasks until a stop marker arrives."""
+        work_queue = self._queue
+
+        while True:
+            job = work_queue.get()
+            if job is None:
+                return
+
+            db = self.session_factory()
+            try:
+                job.state = "running"
+                job.result = self.task_controller.execute_task(
+                    db,
+                    job.task_description,
+                    on_event=lambda event, data: self._publish(job, event, data),
+                    task_id=job.task_id,
+                    cancel_event=job.cancel_event,
+                    use_cache=job.use_cache
+                )
+            except Exception as e:
+                logger.exception(f"Task {job.task_id} failed")
+                self._mark_failed(db, job, str(e))
+                self._publish(job, "error", {"task_id": job.task_id, "error": str(e)})
+            finally:
+                db.close()
+                job.state = "finished"
+                self._finish(job)
+
+    def _mark_failed(self, db, job: TaskJob, error_message: str):
+        """Record an unexpected failure so the task does not stay "running"."""
+        try:
+            db.rollback()
+            self.task_controller.task_service.complete_task(db, job.task_id, "failed", error_message=error_message)
+        except Exception:
+            logger.exception(f"Could not mark task {job.task_id} as failed")
+
+    def _publish(self, job: TaskJob, event: str, data: Dict[str, Any]):
+        """Send an event to every subscriber of a job."""
+        with self._lock:
+            subscribers = list(job.subscribers)
+        for events in subscribers:
+            events.put((event, data))
+
+    def _finish(self, job: TaskJob):
+        """Close subscriber streams and forget a finished job."""
+        with self._lock:
+            self._jobs.pop(job.task_id, None)
+            subscribers, job.subscribers = job.subscribers, []
+        for events in subscribers:
+            events.put(None)
@@ -1,28 +1,42 @@
 import time
+from contextlib import nullcontext
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.orm import Session, selectinload
+from app.core.database import unit_of_work
 from app.models.task import Task
+from app.models.task_command import TaskCommand, TaskCommandOutput
+from app.models.phase_timing import TaskPhaseTiming
 from app.services.filesystem_service import FilesystemService
 from app.models.filesystem_state import FilesystemState
+from app.services.snapshot_pipeline import SnapshotPipeline
+from app.utils.change_attribution import attribute_changes
+from app.utils.timing import PhaseTimer, percentile
 
 
 class TaskService:
     """Service to manage task execution and history."""
     
-    def __init__(self, filesystem_service: FilesystemService = None):
-        """Initialize with optional filesystem service."""
+    def __init__(self, filesystem_service: FilesystemService = None, snapshot_pipeline: SnapshotPipeline = None):
+        """
+        Initialize with optional filesystem service.
+        With a snapshot pipeline, after-command snapshots are captured, diffed and
+        stored in the background instead of on the caller's thread.
+        """
         self.filesystem_service = filesystem_service or FilesystemService()
+        self.snapshot_pipeline = snapshot_pipeline
     
-    def create_task(self, db: Session, task_description: str):
+    def create_task(self, db: Session, task_description: str, final_status: str = "pending",
+                    capture_initial_state: bool = True):
         """
         Create a new task and record the initial filesystem state.
+        Queued tasks skip the initial state here and capture it in start_task.
         Returns the created task.
         """
         # Create the task
         task = Task(
             task_description=task_description,
-            commands=[],
-            final_status="pending"
+            final_status=final_status
         )
         
         db.add(task)
@@ -30,7 +44,7 @@ class TaskService:
         db.refresh(task)
         
         # Capture initial filesystem state if filesystem service is available
-        if self.filesystem_service:
+        if self.filesystem_service and capture_initial_state:
             state_id = self.filesystem_service.capture_filesystem_state(
                 db=db,
                 task_id=task.id,
@@ -39,10 +53,83 @@ class TaskService:
         
         return task
     
+    def start_task(self, db: Session, task_id: int):
+        """
+        Mark a queued task as running and record its initial filesystem state,
+        in one transaction.
+        Returns the task.
+        """
+        with unit_of_work(db):
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if not task:
+                raise ValueError(f"Task with ID {task_id} not found")
+            
+            task.final_status = "running"
+            
+            if self.filesystem_service:
+                state_id = self.filesystem_service.capture_filesystem_state(
+                    db=db,
+                    task_id=task.id,
+                    state_type="initial"
+                )
+            else:
+                db.commit()
+        
+        return task
+    
+    def fail_interrupted_tasks(self, db: Session) -> int:
+        """
+        Mark tasks left pending, queued or running by a previous process as failed.
+        Tasks only run in the process that started them, and the task queues hold
+        their jobs in memory, so these would otherwise never finish.
+        Returns the number of tasks marked.
+        """
+        count = db.query(Task).filter(Task.final_status.in_(["pending", "queued", "running"])).update({
+            Task.is_completed: True,
+            Task.completed_at: datetime.utcnow(),
+            Task.final_status: "failed",
+            Task.error_message: "Interrupted by a server restart before it finished."
+        }, synchronize_session=False)
+        db.commit()
+        return count
+    
+    def capture_before_command(self, db: Session, task_id: int, command: str):
+        """
+        Capture the filesystem state right before a command runs.
+        Returns the state ID to pass to update_task_with_command, or None.
+        """
+        if not self.filesystem_service:
+            return None
+        
+        # The previous command's snapshot must land before the filesystem moves on
+        self.wait_for_snapshots(task_id)
+        
+        task = db.query(Task).filter(Task.id == task_id).first()
+        if not task:
+            raise ValueError(f"Task with ID {task_id} not found")
+        
+        return self.filesystem_service.capture_filesystem_state(
+            db=db,
+            task_id=task.id,
+            state_type="before_command",
+            command_index=self.get_command_count(db, task.id),
+            command_text=command
+        )
+    
     def update_task_with_command(self, db: Session, task_id: int, command: str, 
-                               command_output: str, success: bool):
+                               command_output: str, success: bool, before_state_id: int = None,
+                               on_changes=None, capture: dict = None, resource_usage: dict = None,
+                               timer: PhaseTimer = None):
         """
         Update a task with a new command execution result.
+        before_state_id should come from capture_before_command; without it the
+        "before" state is captured now, after the command has already run.
+        on_changes, if given, is called with the command's filesystem changes once
+        they are stored, possibly from a snapshot worker thread.
+        capture, the output capture metadata, and resource_usage, the CPU, memory and
+        IO the command used, are stored with the command when given.
+        With a timer, the database write and the after-command snapshot are timed
+        as the db_write and snapshot_after phases.
         Returns the updated task.
         """
         task = db.query(Task).filter(Task.id == task_id).first()
@@ -50,11 +137,10 @@ class TaskService:
             raise ValueError(f"Task with ID {task_id} not found")
         
         # Get command index (position in the commands list)
-        command_index = len(task.commands)
+        command_index = self.get_command_count(db, task.id)
         
         # Capture filesystem state before command if filesystem service is available
-        before_state_id = None
-        if self.filesystem_service:
+        if self.filesystem_service and before_state_id is None:
             before_state_id = self.filesystem_service.capture_filesystem_state(
                 db=db,
                 task_id=task.id,
@@ -63,88 +149,247 @@ class TaskService:
                 command_text=command
             )
         
-        # Add command to task history
-        command_data = {
-            "command": command,
-            "output": command_output,
-            "success": success,
-            "timestamp": datetime.utcnow().isoformat()
-        }
-        
-        # Update task commands
-        updated_commands = task.commands.copy() if task.commands else []
-        updated_commands.append(command_data)
-        task.commands = updated_commands
-        
-        db.commit()
-        db.refresh(task)
+        with self._span(timer, "db_write", command_index):
+            # Add command to task history
+            db.add(self._command_record(task.id, command_index, command, command_output, success, capture,
+                                        resource_usage))
+            db.commit()
         
         # Capture filesystem state after command if filesystem service is available
         if self.filesystem_service and before_state_id:
-            after_state_id, changes = self.filesystem_service.compare_and_capture_changes(
-                db=db,
-                previous_state_id=before_state_id,
-                task_id=task.id,
-                state_type="after_command",
-                command_index=command_index,
-                command_text=command
-            )
-            
-            # Enhance command data with filesystem changes
-            updated_commands[-1]["filesystem_changes"] = changes
-            task.commands = updated_commands
-            db.commit()
+            if self.snapshot_pipeline:
+                self.snapshot_pipeline.submit(
+                    task.id,
+                    lambda job_db: self._capture_after_command(
+                        job_db, task_id, before_state_id, command_index, command, on_changes, timer
+                    )
+                )
+            else:
+                self._capture_after_command(db, task.id, before_state_id, command_index, command, on_changes, timer)
         
         return task
     
-    def complete_task(self, db: Session, task_id: int, final_status: str = "completed", 
-                     final_output: str = None, error_message: str = None):
+    def update_task_with_batch(self, db: Session, task_id: int, commands, results, before_state_id: int = None,
+                               cwd: str = None, on_changes=None, timer: PhaseTimer = None):
         """
-        Mark a task as completed and capture the final state.
+        Record a batch of commands that ran concurrently, with their results
+        (dicts with output, success and optionally capture and resource_usage).
+        One after-batch snapshot is diffed against before_state_id, and its changes
+        are split between the commands by the paths they name, relative to cwd (see
+        attribute_changes); changes no command names are stored with every command
+        of the batch as unattributed_changes.
+        on_changes, if given, is called with (position in the batch, changes) for each
+        command once they are stored, possibly from a snapshot worker thread.
+        Batch-wide phases are timed against the first command's index.
+        Returns the updated task.
         """
-        start_time = time.time()
-        
         task = db.query(Task).filter(Task.id == task_id).first()
         if not task:
             raise ValueError(f"Task with ID {task_id} not found")
         
-        # Update task
-        task.is_completed = True
-        task.completed_at = datetime.utcnow()
-        task.final_status = final_status
-        task.final_output = final_output
-        task.error_message = error_message
+        first_index = self.get_command_count(db, task.id)
+        with self._span(timer, "db_write", first_index):
+            for position, (command, result) in enumerate(zip(commands, results)):
+                record = self._command_record(task.id, first_index + position, command, result.get("output", ""),
+                                              result.get("success", False), result.get("capture"),
+                                              result.get("resource_usage"))
+                record.batch = {"first_index": first_index, "size": len(commands), "position": position}
+                db.add(record)
+            
+            db.commit()
         
-        # Calculate execution time
-        if task.created_at:
-            task.execution_time_seconds = int(time.time() - time.mktime(task.created_at.timetuple()))
+        if self.filesystem_service and before_state_id:
+            if self.snapshot_pipeline:
+                self.snapshot_pipeline.submit(
+                    task.id,
+                    lambda job_db: self._capture_after_batch(
+                        job_db, task_id, before_state_id, first_index, commands, cwd, on_changes, timer
+                    )
+                )
+            else:
+                self._capture_after_batch(db, task.id, before_state_id, first_index, commands, cwd, on_changes,
+                                          timer)
         
-        # Capture final filesystem state
-        if self.filesystem_service:
-            final_state_id = self.filesystem_service.capture_filesystem_state(
-                db=db,
-                task_id=task.id,
-                state_type="final"
-            )
+        return task
+    
+    def wait_for_snapshots(self, task_id: int):
+        """Block until every background snapshot job for a task has been stored."""
+        if self.snapshot_pipeline:
+            self.snapshot_pipeline.wait_for_task(task_id)
+    
+    def _capture_after_command(self, db: Session, task_id: int, before_state_id: int, 
+                               command_index: int, command: str, on_changes=None, timer: PhaseTimer = None):
+        """
+        Capture the state after a command, diff it against the before state and
+        attach the changes to the command entry, in one transaction. Returns the changes.
+        """
+        with unit_of_work(db):
+            with self._span(timer, "snapshot_after", command_index):
+                after_state_id, changes = self.filesystem_service.compare_and_capture_changes(
+                    db=db,
+                    previous_state_id=before_state_id,
+                    task_id=task_id,
+                    state_type="after_command",
+                    command_index=command_index,
+                    command_text=command
+                )
+            
+            # Enhance command data with filesystem changes
+            with self._span(timer, "db_write", command_index):
+                record = self._command_records(db, task_id, command_index)[0]
+                record.filesystem_changes = changes
+                db.commit()
         
-        db.commit()
+        if on_changes:
+            on_changes(changes)
+        
+        return changes
+    
+    def _capture_after_batch(self, db: Session, task_id: int, before_state_id: int, first_index: int,
+                             commands, cwd: str = None, on_changes=None, timer: PhaseTimer = None):
+        """
+        Capture the state after a batch, diff it against the before state and attach
+        each command's share of the changes to its entry, in one transaction.
+        Returns the per-command changes.
+        """
+        with unit_of_work(db):
+            with self._span(timer, "snapshot_after", first_index):
+                after_state_id, changes = self.filesystem_service.compare_and_capture_changes(
+                    db=db,
+                    previous_state_id=before_state_id,
+                    task_id=task_id,
+                    state_type="after_command",
+                    command_index=first_index + len(commands) - 1,
+                    command_text="; ".join(commands)
+                )
+                per_command, unattributed = attribute_changes(commands, changes, self.filesystem_service.base_path,
+                                                              cwd)
+            
+            with self._span(timer, "db_write", first_index):
+                records = self._command_records(db, task_id, first_index, len(commands))
+                for record, command_changes in zip(records, per_command):
+                    record.filesystem_changes = command_changes
+                    if unattributed:
+                        record.unattributed_changes = unattributed
+                db.commit()
+        
+        if on_changes:
+            for position, command_changes in enumerate(per_command):
+                on_changes(position, command_changes)
+        
+        return per_command
+    
+    @staticmethod
+    def _command_record(task_id: int, command_index: int, command: str, output: str, success: bool,
+                        capture: dict = None, resource_usage: dict = None):
+        """Build the row of one executed command, with its output in a separate row."""
+        return TaskCommand(
+            task_id=task_id,
+            command_index=command_index,
+            command=command,
+            success=success,
+            timestamp=datetime.utcnow(),
+            capture=capture or None,
+            resource_usage=resource_usage or None,
+            output_record=TaskCommandOutput(output=output or "")
+        )
+    
+    @staticmethod
+    def _command_records(db: Session, task_id: int, first_index: int, count: int = 1):
+        """The rows of count consecutive commands of a task, starting at first_index."""
+        return db.query(TaskCommand).filter(
+            TaskCommand.task_id == task_id,
+            TaskCommand.command_index >= first_index,
+            TaskCommand.command_index < first_index + count
+        ).order_by(TaskCommand.command_index).all()
+    
+    def get_command_count(self, db: Session, task_id: int) -> int:
+        """Number of commands recorded for a task."""
+        return db.query(func.count(TaskCommand.id)).filter(TaskCommand.task_id == task_id).scalar()
+    
+    def complete_task(self, db: Session, task_id: int, final_status: str = "completed", 
+                     final_output: str = None, error_message: str = None, timer: PhaseTimer = None):
+        """
+        Mark a task as completed and capture the final state, in one transaction.
+        With a timer, its spans (plus the final snapshot and the whole task) are stored
+        in task_phase_timings and summed per phase into each command's "timings".
+        """
+        start_time = time.time()
+        
+        # Flush pending snapshot jobs so the final state follows every command
+        self.wait_for_snapshots(task_id)
+        
+        with unit_of_work(db):
+            task = db.query(Task).filter(Task.id == task_id).first()
+            if not task:
+                raise ValueError(f"Task with ID {task_id} not found")
+            
+            # Update task
+            task.is_completed = True
+            task.completed_at = datetime.utcnow()
+            task.final_status = final_status
+            task.final_output = final_output
+            task.error_message = error_message
+            
+            # Calculate execution time
+            if task.created_at:
+                task.execution_time_seconds = int(time.time() - time.mktime(task.created_at.timetuple()))
+            
+            # Capture final filesystem state
+            if self.filesystem_service:
+                with self._span(timer, "snapshot_final"):
+                    final_state_id = self.filesystem_service.capture_filesystem_state(
+                        db=db,
+                        task_id=task.id,
+                        state_type="final"
+                    )
+            
+            if timer is not None:
+                timer.record("task", None, timer.started_at, timer.elapsed_ms())
+                self._store_timings(db, task, timer)
+            
+            db.commit()
         db.refresh(task)
         
         return task
     
+    def _store_timings(self, db: Session, task: Task, timer: PhaseTimer):
+        """Add a task's timing spans as rows and attach per-command phase totals to its commands."""
+        for span in timer.spans():
+            db.add(TaskPhaseTiming(task_id=task.id, **span))
+        
+        totals = timer.by_command()
+        if totals:
+            records = db.query(TaskCommand).filter(
+                TaskCommand.task_id == task.id,
+                TaskCommand.command_index.in_(list(totals))
+            ).all()
+            for record in records:
+                record.timings = totals[record.command_index]
+    
+    @staticmethod
+    def _span(timer: PhaseTimer, phase: str, index: int = None):
+        """A timing span on timer, or a no-op without one."""
+        return timer.span(phase, index) if timer is not None else nullcontext()
+    
     def get_task(self, db: Session, task_id: int):
         """Get a task by ID."""
         return db.query(Task).filter(Task.id == task_id).first()
     
     def get_recent_tasks(self, db: Session, limit: int = 10):
         """Get the most recent tasks."""
-        return db.query(Task).order_by(Task.created_at.desc()).limit(limit).all()
+        return db.query(Task).options(self._with_commands()).order_by(Task.created_at.desc()).limit(limit).all()
+    
+    @staticmethod
+    def _with_commands():
+        """Query option that loads tasks' commands and outputs in two extra queries rather than per command."""
+        return selectinload(Task.command_records).selectinload(TaskCommand.output_record)
     
     def get_task_history(self, db: Session, task_id: int):
         """
         Get detailed task history, including commands and filesystem changes.
         """
-        task = db.query(Task).filter(Task.id == task_id).first()
+        task = db.query(Task).options(self._with_commands()).filter(Task.id == task_id).first()
         if not task:
             raise ValueError(f"Task with ID {task_id} not found")
         
@@ -153,7 +398,42 @@ class TaskService:
             FilesystemState.task_id == task_id
         ).order_by(FilesystemState.timestamp).all()
         
+        phase_timings = db.query(TaskPhaseTiming).filter(
+            TaskPhaseTiming.task_id == task_id
+        ).order_by(TaskPhaseTiming.started_at).all()
+        
         return {
             "task": task.to_dict(),
-            "filesystem_states": [state.to_dict() for state in filesystem_states]
-        } 
\ No newline at end of file
+            "filesystem_states": [state.to_dict() for state in filesystem_states],
+            "phase_timings": [timing.to_dict() for timing in phase_timings]
+        }
+    
+    def get_phase_stats(self, db: Session, limit: int = 100):
+        """
+        Latency percentiles by phase across the most recent tasks.
+        Returns a dict with the number of tasks and, per phase, count, total, mean,
+        p50, p95, p99 and max in milliseconds. Per-step phases are aggregated per span.
+        """
+        task_ids = [row.id for row in db.query(Task.id).order_by(Task.created_at.desc()).limit(limit)]
+        rows = db.query(TaskPhaseTiming.phase, TaskPhaseTiming.duration_ms).filter(
+            TaskPhaseTiming.task_id.in_(task_ids)
+        ).all() if task_ids else []
+        
+        durations = {}
+        for phase, duration_ms in rows:
+            durations.setdefault(phase, []).append(duration_ms)
+        
+        phases = {}
+        for phase, values in sorted(durations.items()):
+            values.sort()
+            phases[phase] = {
+                "count": len(values),
+                "total_ms": round(sum(values), 3),
+                "mean_ms": round(sum(values) / len(values), 3),
+                "p50_ms": percentile(values, 0.50),
+                "p95_ms": percentile(values, 0.95),
+                "p99_ms": percentile(values, 0.99),
+                "max_ms": values[-1]
+            }
+        
+        return {"tasks": len(task_ids), "phases": phases} 
\ No newline at end of file
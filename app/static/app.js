@@ -14,15 +14,18 @@ document.addEventListener('DOMContentLoaded', function() {
         
         if (!task) return;
         
+        // Entry that is filled in as progress events arrive
+        const entry = createCommandHistoryEntry(task);
+        
         try {
-            // Show loading modal
+            // Show loading modal until the first event arrives
             document.getElementById('loadingMessage').textContent = 'Executing task...';
             loadingModal.show();
             
             // Disable input while processing
             taskInput.disabled = true;
             
-            const response = await fetch('/api/execute', {
+            const response = await fetch('/api/execute/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -30,14 +33,20 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify({ task: task })
             });
             
-            const data = await response.json();
-            
-            if (data.error) {
-                throw new Error(data.error);
+            if (!response.ok) {
+                const data = await response.json();
+                throw new Error(data.error || 'Failed to execute task');
             }
             
-            // Add to command history
-            addToCommandHistory(task, data);
+            await readEventStream(response, (event, data) => {
+                loadingModal.hide();
+                handleTaskEvent(entry, event, data);
+                
+                // Files may have changed after each command
+                if (event === 'filesystem_changes' && data.changes.length > 0) {
+                    updateDirectoryTree();
+                }
+            });
             
             // Update directory tree after command execution
             updateDirectoryTree();
@@ -47,7 +56,7 @@ document.addEventListener('DOMContentLoaded', function() {
             
         } catch (error) {
             console.error('Error:', error);
-            addToCommandHistory(task, { error: error.message || 'Failed to execute task' });
+            setCommandHistoryResult(entry, { error: error.message || 'Failed to execute task' });
         } finally {
             // Re-enable input
             taskInput.disabled = false;
@@ -257,6 +266,11 @@ async function updateDirectoryTree() {
 }
 
 function addToCommandHistory(task, result) {
+    const entry = createCommandHistoryEntry(task);
+    setCommandHistoryResult(entry, result);
+}
+
+function createCommandHistoryEntry(task) {
     const history = document.getElementById('commandHistory');
     const entry = document.createElement('div');
     entry.className = 'command-entry';
@@ -267,9 +281,19 @@ function addToCommandHistory(task, result) {
     taskElement.textContent = `Task: ${task}`;
     entry.appendChild(taskElement);
     
-    // Add output or error
+    // Add output, filled in as the task progresses
     const outputElement = document.createElement('div');
     outputElement.className = 'command-output';
+    entry.appendChild(outputElement);
+    
+    // Add to history
+    history.insertBefore(entry, history.firstChild);
+    return entry;
+}
+
+function setCommandHistoryResult(entry, result) {
+    const outputElement = entry.querySelector('.command-output');
+    outputElement.classList.remove('error-output', 'success-output');
     
     if (result.error) {
         outputElement.classList.add('error-output');
@@ -282,11 +306,82 @@ function addToCommandHistory(task, result) {
         }
         outputElement.textContent = result.output;
     }
+}
+
+function handleTaskEvent(entry, event, data) {
+    const outputElement = entry.querySelector('.command-output');
     
-    entry.appendChild(outputElement);
+    switch (event) {
+        case 'command':
+            outputElement.textContent += `Command: ${data.command}\n`;
+            break;
+        case 'command_output':
+            // Live output; the complete (possibly truncated) output follows in command_result
+            if (entry.dataset.streamingIndex !== String(data.index)) {
+                entry.dataset.streamingIndex = data.index;
+                outputElement.textContent += 'Output:\n';
+            }
+            outputElement.textContent += data.chunk;
+            break;
+        case 'command_result':
+            if (entry.dataset.streamingIndex === String(data.index)) {
+                outputElement.textContent += '\n';
+            } else {
+                outputElement.textContent += `Output:\n${data.output || ''}\n`;
+            }
+            if (data.capture && data.capture.truncated) {
+                outputElement.textContent += `[Output truncated: ${data.capture.omitted_bytes} of ${data.capture.total_bytes} bytes omitted]\n`;
+            }
+            break;
+        case 'filesystem_changes':
+            if (data.changes.length > 0) {
+                outputElement.textContent += `[${data.changes.length} filesystem changes for command ${data.index + 1}]\n`;
+            }
+            break;
+        case 'analysis':
+            if (data.explanation) {
+                outputElement.textContent += `Analysis: ${data.explanation}\n\n`;
+            }
+            break;
+        case 'task_complete':
+        case 'error':
+            setCommandHistoryResult(entry, data);
+            break;
+    }
+}
+
+async function readEventStream(response, onEvent) {
+    // Parse a text/event-stream body incrementally
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
     
-    // Add to history
-    history.insertBefore(entry, history.firstChild);
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        
+        buffer += decoder.decode(value, { stream: true });
+        
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) >= 0) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let event = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice('event: '.length);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice('data: '.length);
+                }
+            });
+            
+            if (data) {
+                onEvent(event, JSON.parse(data));
+            }
+        }
+    }
 }
 
 async function loadTaskHistory() {
@@ -466,8 +561,12 @@ function getStatusBadgeClass(status) {
         case 'failed':
             return 'bg-danger';
         case 'pending':
+        case 'queued':
             return 'bg-warning';
+        case 'running':
+            return 'bg-info';
         case 'incomplete':
+        case 'cancelled':
             return 'bg-warning';
         default:
             return 'bg-secondary';
@@ -0,0 +1,89 @@
+import os
+import re
+import shlex
+import fnmatch
+from typing import Dict, Any, List, Optional, Tuple
+
+# Characters that make a token a glob pattern rather than a literal path
+GLOB_CHARS = set("*?[")
+
+SHELL_OPERATORS = {"&&", "||", "|", ";", "&"}
+
+REDIRECTION = re.compile(r"^\d*(>>|>|<)&?")
+
+
+def command_paths(command: str, base_path: str, cwd: Optional[str] = None) -> List[str]:
+    """
+    Return the tokens of a shell command that may name paths, relative to base_path.
+    Program names, options, shell operators and tokens outside base_path are skipped.
+    """
+    try:
+        tokens = shlex.split(command, comments=True)
+    except ValueError:
+        tokens = command.split()
+
+    base = os.path.abspath(base_path)
+    start = os.path.abspath(cwd or base_path)
+    paths = []
+    command_word = True
+    for token in tokens:
+        if token in SHELL_OPERATORS:
+            command_word = True
+            continue
+        if command_word:
+            # The program name is not a path the command writes to
+            command_word = False
+            continue
+
+        # Redirections such as 2>err.log or >>out.txt name a path after the operator
+        token = REDIRECTION.sub("", token)
+        if not token or token.startswith("-"):
+            continue
+
+        absolute = os.path.normpath(os.path.join(start, os.path.expanduser(token)))
+        if absolute == base or not absolute.startswith(base + os.sep):
+            continue
+        paths.append(os.path.relpath(absolute, base))
+    return paths
+
+
+def _match(path: str, token: str) -> int:
+    """
+    How closely a token names a changed path: 3 if it is the path, 2 if the path is
+    inside it, 1 if it is inside the path (a parent directory it created), else 0.
+    """
+    if GLOB_CHARS & set(token):
+        if fnmatch.fnmatch(path, token):
+            return 3
+        return 2 if any(fnmatch.fnmatch(path[:i], token) for i in range(len(path)) if path[i] == "/") else 0
+    if path == token:
+        return 3
+    if path.startswith(token + "/"):
+        return 2
+    return 1 if token.startswith(path + "/") else 0
+
+
+def attribute_changes(commands: List[str], changes: List[Dict[str, Any]], base_path: str,
+                      cwd: Optional[str] = None) -> Tuple[List[List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    Split the filesystem changes of commands that ran concurrently between them.
+
+    A change goes to the commands that name it most closely: the path itself, else
+    a directory containing it, else a path inside it. Returns one change list per
+    command and the changes no command could be matched with.
+    """
+    mentioned = [command_paths(command, base_path, cwd) for command in commands]
+    per_command: List[List[Dict[str, Any]]] = [[] for _ in commands]
+    unattributed = []
+
+    for change in changes:
+        scores = [max((_match(change["path"], token) for token in tokens), default=0) for tokens in mentioned]
+        best = max(scores, default=0)
+        if not best:
+            unattributed.append(change)
+            continue
+        for i, score in enumerate(scores):
+            if score == best:
+                per_command[i].append(change)
+
+    return per_command, unattributed
@@ -0,0 +1,138 @@
+import os
+from typing import Dict, List, Optional, Tuple
+
+# Rough average for English text, shell output and code; errs towards overestimating
+CHARS_PER_TOKEN = 3.5
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the token count of a string without a model-specific tokenizer."""
+    if not text:
+        return 0
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+class ContextManager:
+    """
+    Conversation history for one task, kept under a prompt token budget.
+
+    The system prompt and the task turn are always sent. Every later step is an
+    (assistant, user) pair; command outputs are cut to their head and tail before
+    they are added, and when the history no longer fits, the oldest steps are
+    dropped and listed by command only in the task turn.
+
+    Prompts are append-only between evictions, so each one extends the previous
+    one and Ollama can reuse its evaluated prefix. Eviction drops steps down to
+    evict_to of the budget at once, rather than one step per call, so the prefix
+    changes as rarely as possible.
+    """
+
+    # Per-message overhead of the chat template (role markers, separators)
+    MESSAGE_OVERHEAD_TOKENS = 4
+
+    def __init__(self,
+                 system_prompt: str,
+                 task_prompt: str,
+                 token_budget: int = None,
+                 max_output_tokens: int = None,
+                 response_reserve: int = None,
+                 evict_to: float = None):
+        """
+        Initialize with the fixed opening turns and budget configuration.
+        token_budget defaults to LLM_CONTEXT_BUDGET, or OLLAMA_CONTEXT_LENGTH minus
+        response_reserve tokens left for the model's reply.
+        """
+        self.system_prompt = system_prompt
+        self.task_prompt = task_prompt
+
+        self.response_reserve = int(response_reserve or os.getenv("LLM_RESPONSE_RESERVE", "1024"))
+        if token_budget is None and os.getenv("LLM_CONTEXT_BUDGET"):
+            token_budget = int(os.getenv("LLM_CONTEXT_BUDGET"))
+        if token_budget is None:
+            token_budget = int(os.getenv("OLLAMA_CONTEXT_LENGTH", "8192")) - self.response_reserve
+        self.token_budget = token_budget
+        self.max_output_tokens = int(max_output_tokens or os.getenv("LLM_MAX_OUTPUT_TOKENS", "1024"))
+        self.evict_to = float(evict_to or os.getenv("LLM_CONTEXT_EVICT_TO", "0.6"))
+
+        # (command, assistant content, user content) per step
+        self._steps: List[Tuple[str, str, str]] = []
+        self._dropped = 0
+        self.prompt_tokens: List[int] = []
+
+    def add_step(self, command: str, assistant_content: str, user_content: str):
+        """Record one step: what the assistant answered and what was reported back."""
+        self._steps.append((command, assistant_content, user_content))
+
+    def truncate_output(self, output: str, max_tokens: int = None) -> str:
+        """
+        Cut long command output down to its head and tail with an elision marker.
+        The cut is moved to line boundaries where possible.
+        """
+        max_chars = int((max_tokens or self.max_output_tokens) * CHARS_PER_TOKEN)
+        if not output or len(output) <= max_chars:
+            return output
+
+        # Errors and summaries tend to be at the end, so keep a little more of the tail
+        head_chars = max_chars * 2 // 5
+        tail_chars = max_chars - head_chars
+
+        head = output[:head_chars]
+        newline = head.rfind('\n')
+        if newline > head_chars // 2:
+            head = head[:newline + 1]
+
+        tail = output[-tail_chars:]
+        newline = tail.find('\n')
+        if 0 <= newline < tail_chars // 2:
+            tail = tail[newline + 1:]
+
+        elided = output[len(head):len(output) - len(tail)]
+        marker = f"... [{elided.count(chr(10))} lines, {len(elided)} characters elided] ...\n"
+        if not head.endswith('\n'):
+            marker = '\n' + marker
+        return head + marker + tail
+
+    def messages(self) -> List[Dict[str, str]]:
+        """
+        Build the prompt for the next LLM call. Once it exceeds the budget, the oldest
+        steps are dropped until it is under evict_to of the budget. The most recent
+        step is always kept. The estimated size is recorded in prompt_tokens.
+        """
+        messages = self._build()
+        tokens = self.count_tokens(messages)
+        if tokens > self.token_budget:
+            while tokens > self.token_budget * self.evict_to and self._dropped < len(self._steps) - 1:
+                self._dropped += 1
+                messages = self._build()
+                tokens = self.count_tokens(messages)
+
+        self.prompt_tokens.append(tokens)
+        return messages
+
+    def count_tokens(self, messages: List[Dict[str, str]]) -> int:
+        """Estimate the prompt tokens for a message list."""
+        return sum(estimate_tokens(message["content"]) + self.MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    @property
+    def last_prompt_tokens(self) -> Optional[int]:
+        return self.prompt_tokens[-1] if self.prompt_tokens else None
+
+    @property
+    def dropped_steps(self) -> int:
+        return self._dropped
+
+    def _build(self) -> List[Dict[str, str]]:
+        """Assemble the opening turns, a note about dropped steps and the kept steps."""
+        task_content = self.task_prompt
+        if self._dropped:
+            dropped = [command for command, _, _ in self._steps[:self._dropped]]
+            task_content += (f"\nEarlier commands already executed (outputs omitted to save space): {dropped}")
+
+        messages = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": task_content}
+        ]
+        for _, assistant_content, user_content in self._steps[self._dropped:]:
+            messages.append({"role": "assistant", "content": assistant_content})
+            messages.append({"role": "user", "content": user_content})
+        return messages
@@ -0,0 +1,256 @@
+import os
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from typing import Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# inotify event masks (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def _load_libc():
+    """Return libc with the inotify functions, or None when they are unavailable."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class JournalBatch:
+    """Paths touched since the previous drain of a ChangeJournal."""
+
+    def __init__(self, paths: Set[str], subtrees: Set[str], overflowed: bool):
+        # Paths (relative to the base path) whose entries must be re-read
+        self.paths = paths
+        # Directories that appeared and must be walked as a whole
+        self.subtrees = subtrees
+        # When True the journal lost events and a full scan is required
+        self.overflowed = overflowed
+
+
+class ChangeJournal:
+    """
+    Record created, modified and deleted paths under a directory using inotify.
+
+    A background thread drains the inotify queue and accumulates touched paths
+    until drain() is called. If the kernel queue overflows, or a watch cannot be
+    added, the next batch is flagged as overflowed so callers fall back to a
+    full scan.
+    """
+
+    def __init__(self, base_path: str):
+        """Initialize with the directory tree to watch."""
+        self.base_path = base_path
+        self._libc = None
+        self._fd = -1
+        self._wd_paths = {}
+        self._pending_moves = {}
+        self._dirty: Set[str] = set()
+        self._subtrees: Set[str] = set()
+        self._overflowed = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def is_supported() -> bool:
+        """Check whether inotify is available on this platform."""
+        return os.name == 'posix' and _load_libc() is not None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Create the inotify instance, watch the tree and start the reader thread."""
+        self._libc = _load_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+
+        self._stop.clear()
+        self._watch_tree('')
+
+        self._thread = threading.Thread(target=self._read_loop, name="fs-change-journal", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reader thread and release the inotify instance."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        self._wd_paths = {}
+
+    def drain(self) -> JournalBatch:
+        """Return the paths touched since the last drain and reset the journal."""
+        # Pick up anything the reader thread has not seen yet
+        self._read_events()
+
+        with self._lock:
+            # Directories moved out of the tree never get a matching IN_MOVED_TO
+            for old_path in self._pending_moves.values():
+                self._forget_subtree(old_path)
+            self._pending_moves = {}
+
+            batch = JournalBatch(self._dirty, self._subtrees, self._overflowed)
+            self._dirty = set()
+            self._subtrees = set()
+            self._overflowed = False
+
+        return batch
+
+    def _read_loop(self):
+        """Read inotify events until stopped."""
+        while not self._stop.is_set():
+            try:
+                readable, _, _ = select.select([self._fd], [], [], 0.5)
+            except (OSError, ValueError):
+                break
+            if readable:
+                self._read_events()
+
+    def _read_events(self):
+        """Read and apply every queued inotify event."""
+        if self._fd < 0:
+            return
+
+        with self._lock:
+            while True:
+                try:
+                    buffer = os.read(self._fd, 64 * 1024)
+                except BlockingIOError:
+                    return
+                except OSError:
+                    self._overflowed = True
+                    return
+
+                offset = 0
+                while offset + _EVENT_HEADER.size <= len(buffer):
+                    wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buffer, offset)
+                    offset += _EVENT_HEADER.size
+                    name = buffer[offset:offset + length].rstrip(b'\0').decode('utf-8', 'surrogateescape')
+                    offset += length
+                    self._handle_event(wd, mask, cookie, name)
+
+    def _handle_event(self, wd, mask, cookie, name):
+        """Update the journal for one event. Must be called with the lock held."""
+        if mask & IN_Q_OVERFLOW:
+            logger.warning("inotify queue overflowed; the next snapshot will use a full scan")
+            self._overflowed = True
+            return
+
+        if mask & IN_IGNORED:
+            self._wd_paths.pop(wd, None)
+            return
+
+        dir_path = self._wd_paths.get(wd)
+        if dir_path is None:
+            return
+
+        if not name:
+            # Event about the watched directory itself
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF) and dir_path:
+                self._dirty.add(dir_path)
+            return
+
+        if name.startswith('.'):
+            return
+
+        rel_path = os.path.join(dir_path, name) if dir_path else name
+        self._dirty.add(rel_path)
+
+        if mask & IN_ISDIR:
+            if mask & IN_CREATE:
+                self._watch_tree(rel_path)
+                self._subtrees.add(rel_path)
+            elif mask & IN_MOVED_FROM:
+                self._pending_moves[cookie] = rel_path
+            elif mask & IN_MOVED_TO:
+                old_path = self._pending_moves.pop(cookie, None)
+                if old_path is not None:
+                    self._rename_subtree(old_path, rel_path)
+                else:
+                    self._watch_tree(rel_path)
+                self._subtrees.add(rel_path)
+
+    def _watch_tree(self, rel_path):
+        """Add watches for a directory and every non-hidden directory below it."""
+        root_path = os.path.join(self.base_path, rel_path) if rel_path else self.base_path
+
+        for root, dirs, _ in os.walk(root_path):
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            root_rel_path = os.path.relpath(root, self.base_path)
+            if not self._add_watch('' if root_rel_path == '.' else root_rel_path):
+                return
+
+    def _add_watch(self, rel_path) -> bool:
+        """Watch a single directory. Returns False if the watch limit was hit."""
+        full_path = os.path.join(self.base_path, rel_path) if rel_path else self.base_path
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(full_path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logger.warning("inotify watch limit reached; falling back to full scans")
+                self._overflowed = True
+                return False
+            # The directory vanished before we could watch it
+            return True
+
+        self._wd_paths[wd] = rel_path
+        return True
+
+    def _rename_subtree(self, old_path, new_path):
+        """Point watches below a moved directory at its new location."""
+        prefix = old_path + os.sep
+        for wd, path in list(self._wd_paths.items()):
+            if path == old_path:
+                self._wd_paths[wd] = new_path
+            elif path.startswith(prefix):
+                self._wd_paths[wd] = new_path + path[len(old_path):]
+
+    def _forget_subtree(self, rel_path):
+        """Remove watches for a directory that left the tree."""
+        prefix = rel_path + os.sep
+        for wd, path in list(self._wd_paths.items()):
+            if path == rel_path or path.startswith(prefix):
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._wd_paths[wd]
+
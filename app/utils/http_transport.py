@@ -0,0 +1,228 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ProtocolError
+from urllib3.util.retry import Retry
+
+
+class PooledTransport:
+    """
+    Thread-safe HTTP transport with a shared keep-alive connection pool.
+
+    Every thread gets its own requests.Session (sessions carry mutable state such
+    as cookies), but all sessions mount the same HTTPAdapter, so TCP connections
+    to the LLM host are pooled and reused across threads. Connection failures,
+    connections reset or closed before any response (typically a stale pooled
+    connection) and 502/503/504 responses are retried with exponential backoff.
+    Read timeouts, errors once a response has started and 500 responses are not:
+    the model may still be generating or have failed on the request itself, and a
+    retry would submit the whole generation again. Timeouts are split into
+    connect and read.
+    """
+
+    # Responses from a proxy or server that did not take the request on
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self,
+                 pool_size: int = None,
+                 retries: int = None,
+                 backoff_factor: float = None,
+                 connect_timeout: float = None,
+                 read_timeout: float = None):
+        """Initialize the pool; unset values come from the LLM_* environment variables."""
+        self.pool_size = int(pool_size or os.getenv("LLM_POOL_SIZE", "10"))
+        self.retries = int(retries if retries is not None else os.getenv("LLM_RETRIES", "3"))
+        self.backoff_factor = float(backoff_factor if backoff_factor is not None
+                                    else os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+        self.connect_timeout = float(connect_timeout or os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(read_timeout or os.getenv("TIMEOUT_SECONDS", "120"))
+
+        retry = Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=0,
+            other=0,
+            status=self.retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            # LLM calls are POSTs; only requests the server never started on are retried
+            allowed_methods=frozenset(["GET", "POST"]),
+            raise_on_status=False
+        )
+        self._adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                                    max_retries=retry, pool_block=False)
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._retried = 0
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """POST through the pool. Uses (connect_timeout, read_timeout) unless timeout is given."""
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+
+        with self._lock:
+            self._requests += 1
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self._lock:
+                    self._retried += 1
+                time.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+            try:
+                return self._session().post(url, **kwargs)
+            except requests.RequestException as e:
+                # urllib3 counts resets as read errors, which it leaves unretried (read=0)
+                if _aborted_before_response(e) and attempt < self.retries:
+                    continue
+                with self._lock:
+                    self._errors += 1
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        """Request and connection counts, including how many requests reused a pooled connection."""
+        connections = 0
+        pool_requests = 0
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                pool_requests += pool.num_requests
+
+        with self._lock:
+            requests_sent = self._requests
+            errors = self._errors
+            retried = self._retried
+
+        reused = max(pool_requests - connections, 0)
+        return {
+            "requests": requests_sent,
+            "errors": errors,
+            "retries": retried,
+            "connections_opened": connections,
+            "connections_reused": reused,
+            "reuse_ratio": round(reused / pool_requests, 3) if pool_requests else 0.0,
+            "pool_size": self.pool_size
+        }
+
+    def close(self):
+        """Close pooled connections."""
+        self._adapter.close()
+
+    def _session(self) -> requests.Session:
+        """Return this thread's session, bound to the shared adapter."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            self._local.session = session
+        return session
+
+
+class AsyncPooledTransport:
+    """
+    Keep-alive HTTP transport for the asyncio core, built on httpx.AsyncClient.
+
+    One client (and connection pool) is shared by every coroutine; it must be used
+    from a single event loop. Connection failures, disconnects before any
+    response and 502/503/504 responses are retried with exponential backoff, like
+    PooledTransport; read timeouts, errors once a response has started and 500
+    responses are not.
+    """
+
+    RETRY_STATUSES = PooledTransport.RETRY_STATUSES
+
+    def __init__(self,
+                 pool_size: int = None,
+                 retries: int = None,
+                 backoff_factor: float = None,
+                 connect_timeout: float = None,
+                 read_timeout: float = None):
+        """Initialize the pool; unset values come from the LLM_* environment variables."""
+        import httpx
+
+        self.pool_size = int(pool_size or os.getenv("LLM_ASYNC_POOL_SIZE", "100"))
+        self.retries = int(retries if retries is not None else os.getenv("LLM_RETRIES", "3"))
+        self.backoff_factor = float(backoff_factor if backoff_factor is not None
+                                    else os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+        self.connect_timeout = float(connect_timeout or os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+        self.read_timeout = float(read_timeout or os.getenv("TIMEOUT_SECONDS", "120"))
+
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+        )
+        self._requests = 0
+        self._errors = 0
+        self._retried = 0
+
+    async def post(self, url: str, **kwargs):
+        """POST through the pool and return the httpx.Response with its body read."""
+        return await self._send(url, False, kwargs)
+
+    async def stream(self, url: str, **kwargs):
+        """
+        POST through the pool without reading the body; iterate it with aiter_lines()
+        and call aclose() when done. Closing early drops the connection.
+        """
+        return await self._send(url, True, kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Request, error and retry counts."""
+        return {
+            "requests": self._requests,
+            "errors": self._errors,
+            "retries": self._retried,
+            "pool_size": self.pool_size
+        }
+
+    async def close(self):
+        """Close pooled connections."""
+        await self._client.aclose()
+
+    async def _send(self, url: str, stream: bool, kwargs):
+        import httpx
+
+        self._requests += 1
+        request = self._client.build_request("POST", url, **kwargs)
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self._retried += 1
+                await asyncio.sleep(self.backoff_factor * (2 ** (attempt - 1)))
+            try:
+                # The body is read separately below, so errors here come before any response
+                response = await self._client.send(request, stream=True)
+            except httpx.HTTPError as e:
+                if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError,
+                                  httpx.ReadError)) and attempt < self.retries:
+                    continue
+                self._errors += 1
+                raise
+            if response.status_code in self.RETRY_STATUSES and attempt < self.retries:
+                await response.aclose()
+                continue
+            if not stream:
+                try:
+                    await response.aread()
+                except httpx.HTTPError:
+                    self._errors += 1
+                    raise
+                finally:
+                    await response.aclose()
+            return response
+
+
+def _aborted_before_response(error: requests.RequestException) -> bool:
+    """Whether the connection was reset or closed by the server before a response arrived."""
+    reason = error.args[0] if error.args else None
+    if isinstance(reason, MaxRetryError):
+        reason = reason.reason
+    return (isinstance(error, requests.ConnectionError) and isinstance(reason, ProtocolError)
+            and len(reason.args) > 1 and isinstance(reason.args[1], (ConnectionResetError, BrokenPipeError)))
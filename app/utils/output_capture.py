@@ -0,0 +1,387 @@
+import os
+import time
+import asyncio
+import uuid
+import codecs
+import signal
+import logging
+import tempfile
+import selectors
+import subprocess
+from typing import Callable, Dict, Any, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+
+class OutputCapture:
+    """
+    Bounded capture of a process's output, fed incrementally.
+
+    Up to max_bytes are kept in memory. Past that, only the first head_bytes
+    and a ring buffer of the last max_bytes - head_bytes are kept, and the full
+    output is spilled to a file in spill_dir (itself capped at spill_max_bytes),
+    so a huge `cat` cannot exhaust memory, bloat the task record or the next
+    prompt. on_chunk receives decoded text as it arrives, up to max_bytes.
+
+    Before a spill file is opened, older spill files are pruned: those last
+    written more than spill_retention seconds ago, then the oldest until the
+    directory holds at most spill_dir_max_bytes.
+    """
+
+    def __init__(self,
+                 max_bytes: int = None,
+                 head_bytes: int = None,
+                 spill_dir: str = None,
+                 spill_max_bytes: int = None,
+                 spill_retention: int = None,
+                 spill_dir_max_bytes: int = None,
+                 on_chunk: Optional[Callable[[str], None]] = None):
+        """Initialize limits; unset values come from the CAPTURE_* environment variables."""
+        self.max_bytes = int(max_bytes or os.getenv("CAPTURE_MAX_BYTES", str(1024 * 1024)))
+        self.head_bytes = int(head_bytes or self.max_bytes // 4)
+        self.spill_dir = spill_dir if spill_dir is not None else os.getenv(
+            "CAPTURE_SPILL_DIR", os.path.join(tempfile.gettempdir(), "command-output"))
+        self.spill_max_bytes = int(spill_max_bytes or os.getenv("CAPTURE_SPILL_MAX_BYTES", str(100 * 1024 * 1024)))
+        self.spill_retention = int(spill_retention or os.getenv("CAPTURE_SPILL_RETENTION", "86400"))
+        self.spill_dir_max_bytes = int(spill_dir_max_bytes or os.getenv("CAPTURE_SPILL_DIR_MAX_BYTES",
+                                                                        str(1024 * 1024 * 1024)))
+        self.on_chunk = on_chunk
+
+        self.total_bytes = 0
+        self.spill_path = None
+        self._buffer = bytearray()
+        self._head = None
+        self._tail = None
+        self._spill = None
+        self._spilled_bytes = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    @property
+    def truncated(self) -> bool:
+        return self._head is not None
+
+    def write(self, data: bytes):
+        """Add a chunk of output."""
+        if not data:
+            return
+
+        if self.on_chunk and self.total_bytes < self.max_bytes:
+            self.on_chunk(self._decoder.decode(bytes(data[:self.max_bytes - self.total_bytes])))
+        self.total_bytes += len(data)
+
+        if self._head is None:
+            self._buffer += data
+            if len(self._buffer) > self.max_bytes:
+                self._start_truncating()
+            return
+
+        self._write_spill(data)
+        tail_bytes = self.max_bytes - self.head_bytes
+        self._tail += data
+        if len(self._tail) > tail_bytes:
+            del self._tail[:len(self._tail) - tail_bytes]
+
+    def close(self):
+        """Flush and close the spill file, if any."""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def text(self) -> str:
+        """The captured output, with an elision marker where the middle was dropped."""
+        if self._head is None:
+            return bytes(self._buffer).decode(errors="replace")
+
+        omitted = self.total_bytes - len(self._head) - len(self._tail)
+        marker = f"\n... [{omitted} bytes omitted"
+        if self.spill_path:
+            marker += f"; full output in {self.spill_path}"
+        marker += "] ...\n"
+        return (bytes(self._head).decode(errors="replace") + marker
+                + bytes(self._tail).decode(errors="replace"))
+
+    def metadata(self) -> Dict[str, Any]:
+        """Truncation metadata to report alongside the output."""
+        kept = len(self._buffer) if self._head is None else len(self._head) + len(self._tail)
+        return {
+            "total_bytes": self.total_bytes,
+            "truncated": self.truncated,
+            "omitted_bytes": self.total_bytes - kept,
+            "spill_path": self.spill_path,
+            "spill_complete": self.spill_path is not None and self._spilled_bytes == self.total_bytes
+        }
+
+    def _start_truncating(self):
+        """Switch from keeping everything to keeping head and tail, spilling the rest."""
+        data = bytes(self._buffer)
+        self._buffer = bytearray()
+        self._head = bytearray(data[:self.head_bytes])
+        self._tail = bytearray(data[-(self.max_bytes - self.head_bytes):])
+
+        if self.spill_dir:
+            try:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                self._prune_spill_dir()
+                self.spill_path = os.path.join(self.spill_dir, f"output-{int(time.time())}-{uuid.uuid4().hex[:8]}.log")
+                self._spill = open(self.spill_path, "wb")
+            except OSError as e:
+                logger.warning(f"Could not create output spill file in {self.spill_dir}: {str(e)}")
+                self.spill_path = None
+        self._write_spill(data)
+
+    def _prune_spill_dir(self):
+        """Remove expired spill files, then the oldest ones until the directory fits its budget."""
+        files = []
+        for entry in os.scandir(self.spill_dir):
+            if not (entry.name.startswith("output-") and entry.name.endswith(".log")):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        # This file may reach spill_max_bytes, so leave room for it
+        budget = max(self.spill_dir_max_bytes - self.spill_max_bytes, 0)
+        cutoff = time.time() - self.spill_retention
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in sorted(files):
+            if mtime >= cutoff and total <= budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Another capture may have pruned it first
+                continue
+            total -= size
+
+    def _write_spill(self, data: bytes):
+        if self._spill is None:
+            return
+        room = self.spill_max_bytes - self._spilled_bytes
+        if room <= 0:
+            return
+        self._spill.write(data[:room])
+        self._spilled_bytes += min(len(data), room)
+
+
+def run_process(args: Union[str, List[str]],
+                capture: OutputCapture,
+                timeout: float,
+                cwd: Optional[str] = None,
+                shell: bool = False,
+                limiter=None) -> Dict[str, Any]:
+    """
+    Run a process with stdout and stderr merged, streaming its output into capture.
+    On timeout the process and its children are killed.
+    With a ResourceLimiter the process runs under its per-command limits.
+    Returns a dict with return_code (None on timeout), timed_out and resource_usage
+    (None without a limiter).
+    """
+    group = limiter.create_group() if limiter is not None else None
+    if limiter is not None:
+        args = limiter.wrap_command(args, group, timeout)
+    try:
+        process = subprocess.Popen(
+            args,
+            shell=shell,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+    except Exception:
+        if group is not None:
+            limiter.collect(group)
+        raise
+    deadline = time.monotonic() + timeout
+    fd = process.stdout.fileno()
+    timed_out = False
+
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(fd, selectors.EVENT_READ)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                if not selector.select(remaining):
+                    continue
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    break
+                capture.write(chunk)
+    finally:
+        if timed_out:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        process.stdout.close()
+        capture.close()
+
+    return_code, rusage = _wait_with_rusage(process, 5)
+    usage = limiter.collect(group, rusage) if limiter is not None else None
+
+    return {"return_code": None if timed_out else return_code, "timed_out": timed_out, "resource_usage": usage}
+
+
+def _wait_with_rusage(process: subprocess.Popen, timeout: float):
+    """
+    Reap a process with wait4 so its resource usage (and that of the children it
+    waited for) is available, killing it if it is still running after timeout.
+    Returns (return_code, rusage).
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        except ChildProcessError:
+            # Already reaped elsewhere
+            return process.wait(), None
+        if pid:
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return process.returncode, rusage
+        if time.monotonic() >= deadline:
+            process.kill()
+            _, status, rusage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            return process.returncode, rusage
+        time.sleep(0.005)
+
+
+def read_framed(fd: int, pending: bytes, marker: bytes, deadline: float, capture: OutputCapture):
+    """
+    Stream output from fd into capture until a line "\\n<marker><status>\\n" arrives,
+    the deadline passes or the stream ends. pending holds bytes read earlier but not
+    yet consumed. Returns (outcome, status, pending) where outcome is "done",
+    "timeout" or "eof"; status is the bytes after the marker when done.
+    """
+    framed = b"\n" + marker
+    # Enough trailing bytes to hold a marker line that is still arriving
+    holdback = len(framed) + 16
+
+    with selectors.DefaultSelector() as selector:
+        selector.register(fd, selectors.EVENT_READ)
+
+        while True:
+            index = pending.find(framed)
+            if index >= 0:
+                line_end = pending.find(b"\n", index + len(framed))
+                if line_end >= 0:
+                    capture.write(pending[:index])
+                    return "done", pending[index + len(framed):line_end], pending[line_end + 1:]
+            elif len(pending) > holdback:
+                capture.write(pending[:-holdback])
+                pending = pending[-holdback:]
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                capture.write(pending)
+                return "timeout", None, b""
+
+            if not selector.select(remaining):
+                continue
+
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                capture.write(pending)
+                return "eof", None, b""
+            pending += chunk
+
+
+async def run_process_async(args: List[str],
+                            capture: OutputCapture,
+                            timeout: float,
+                            cwd: Optional[str] = None,
+                            limiter=None) -> Dict[str, Any]:
+    """
+    run_process for the asyncio core, started with asyncio.create_subprocess_exec.
+    The process and its children are also killed if the awaiting task is cancelled.
+    resource_usage is only measured in a cgroup; the event loop reaps the process,
+    so its wait4() rusage is not available.
+    """
+    group = limiter.create_group() if limiter is not None else None
+    if limiter is not None:
+        args = limiter.wrap_command(args, group, timeout)
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True
+        )
+    except Exception:
+        if group is not None:
+            limiter.collect(group)
+        raise
+
+    async def pump():
+        while True:
+            chunk = await process.stdout.read(65536)
+            if not chunk:
+                return
+            capture.write(chunk)
+
+    timed_out = False
+    try:
+        await asyncio.wait_for(pump(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+    except BaseException:
+        # Cancelled; do not leave the command running
+        _kill_group(process.pid)
+        raise
+    finally:
+        capture.close()
+    if timed_out:
+        _kill_group(process.pid)
+
+    return_code = await process.wait()
+    usage = limiter.collect(group) if limiter is not None else None
+
+    return {"return_code": None if timed_out else return_code, "timed_out": timed_out, "resource_usage": usage}
+
+
+def _kill_group(pid: int):
+    """Kill a process started in its own session and everything it started."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def read_framed_async(reader: asyncio.StreamReader, pending: bytes, marker: bytes, deadline: float,
+                            capture: OutputCapture):
+    """read_framed for an asyncio stream; same arguments and result."""
+    framed = b"\n" + marker
+    holdback = len(framed) + 16
+
+    while True:
+        index = pending.find(framed)
+        if index >= 0:
+            line_end = pending.find(b"\n", index + len(framed))
+            if line_end >= 0:
+                capture.write(pending[:index])
+                return "done", pending[index + len(framed):line_end], pending[line_end + 1:]
+        elif len(pending) > holdback:
+            capture.write(pending[:-holdback])
+            pending = pending[-holdback:]
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            capture.write(pending)
+            return "timeout", None, b""
+
+        try:
+            chunk = await asyncio.wait_for(reader.read(65536), remaining)
+        except asyncio.TimeoutError:
+            continue
+        if not chunk:
+            capture.write(pending)
+            return "eof", None, b""
+        pending += chunk
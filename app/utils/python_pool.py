@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import signal
+import logging
+import threading
+import subprocess
+from contextlib import nullcontext
+from typing import Dict, Any, List, Optional
+
+from app.utils.output_capture import OutputCapture, read_framed
+from app.utils.resource_limits import ResourceLimiter
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_worker.py")
+
+
+class PythonWorker:
+    """
+    One warm interpreter running python_worker.py, driven over a control pipe.
+    With fork set it is a fork server that runs every request in a forked child.
+    """
+
+    # Extra time a fork server gets to report a timeout it enforces itself
+    FORK_TIMEOUT_GRACE = 5
+
+    def __init__(self, preload: List[str], memory_mb: int, cwd: Optional[str] = None, start_timeout: float = 60,
+                 fork: bool = False, limiter: ResourceLimiter = None):
+        """Start the interpreter and wait until it has preloaded its modules."""
+        self.fork = fork
+        self.limiter = limiter
+        self.runs = 0
+        self._pending = b""
+
+        read_fd, write_fd = os.pipe()
+        ready_marker = f"__PYTHON_WORKER_READY_{uuid.uuid4().hex}__"
+        env = dict(os.environ,
+                   PYTHON_WORKER_PRELOAD=",".join(preload),
+                   PYTHON_WORKER_MEMORY_MB=str(memory_mb),
+                   PYTHON_WORKER_READY_MARKER=ready_marker)
+        try:
+            self._process = subprocess.Popen(
+                [sys.executable, "-u", WORKER_SCRIPT, str(read_fd)] + (["--fork"] if fork else []),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                pass_fds=(read_fd,),
+                cwd=cwd,
+                env=env,
+                start_new_session=True
+            )
+        finally:
+            os.close(read_fd)
+        self._control = os.fdopen(write_fd, "w")
+
+        startup = OutputCapture(spill_dir="")
+        outcome, _, self._pending = read_framed(self._process.stdout.fileno(), b"", ready_marker.encode(),
+                                                time.monotonic() + start_timeout, startup)
+        if startup.total_bytes:
+            logger.warning(f"Python worker startup output: {startup.text().strip()}")
+        if outcome != "done":
+            self.close()
+            raise RuntimeError(f"Python worker failed to start ({outcome})")
+
+    @property
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    def run(self, request: Dict[str, Any], timeout: float, capture: OutputCapture) -> Dict[str, Any]:
+        """
+        Send one request and stream its output into capture.
+        Returns a dict with return_code (None if unknown), timed_out and resource_usage
+        (measured with the limiter, if any). A worker that timed out or died is closed.
+        """
+        tracker = self.limiter.track(self._process.pid) if self.limiter is not None else None
+        with tracker or nullcontext():
+            result = self._run(request, timeout, capture)
+        result["resource_usage"] = tracker.usage if tracker is not None else None
+        return result
+
+    def _run(self, request: Dict[str, Any], timeout: float, capture: OutputCapture) -> Dict[str, Any]:
+        marker = f"__PYTHON_WORKER_DONE_{uuid.uuid4().hex}__"
+        self.runs += 1
+        deadline = time.monotonic() + timeout
+        if self.fork:
+            # The fork server kills an overrunning child itself and stays usable
+            deadline += self.FORK_TIMEOUT_GRACE
+        try:
+            self._control.write(json.dumps(dict(request, marker=marker, timeout=timeout)) + "\n")
+            self._control.flush()
+        except (BrokenPipeError, OSError):
+            self.close()
+            return {"return_code": None, "timed_out": False}
+
+        try:
+            outcome, status, self._pending = read_framed(self._process.stdout.fileno(), self._pending,
+                                                         marker.encode(), deadline, capture)
+        finally:
+            capture.close()
+
+        if outcome == "done" and status == b"timeout":
+            return {"return_code": None, "timed_out": True}
+        if outcome == "done":
+            try:
+                return {"return_code": int(status), "timed_out": False}
+            except ValueError:
+                return {"return_code": None, "timed_out": False}
+
+        self.close()
+        return {"return_code": self._process.returncode if outcome == "eof" else None,
+                "timed_out": outcome == "timeout"}
+
+    def close(self):
+        """Kill the interpreter and anything it started."""
+        if self.alive:
+            try:
+                os.killpg(self._process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        if self.limiter is not None:
+            self.limiter.release(self._process.pid)
+        for stream in (getattr(self, "_control", None), self._process.stdout):
+            try:
+                if stream is not None:
+                    stream.close()
+            except OSError:
+                pass
+
+
+class PythonWorkerPool:
+    """
+    Pool of warm Python interpreters for running generated code.
+
+    Workers import the preload modules once at startup, so short snippets skip
+    interpreter startup and heavy imports. Each run gets a fresh __main__
+    namespace; modules imported by earlier runs stay loaded, so workers are
+    replaced after max_runs runs, after a timeout and when they die. Address
+    space growth per worker is capped at memory_mb. Replacements are started in
+    the background so the pool stays warm.
+
+    With fork set, workers are fork servers: each run happens in a forked
+    copy-on-write child, so runs are isolated from each other and workers are
+    not recycled after max_runs. The server enforces the timeout on its child.
+    """
+
+    def __init__(self,
+                 size: int = None,
+                 preload: List[str] = None,
+                 max_runs: int = None,
+                 memory_mb: int = None,
+                 cwd: Optional[str] = None,
+                 fork: bool = False,
+                 limiter: ResourceLimiter = None,
+                 acquire_timeout: float = None):
+        """
+        Initialize the pool; unset values come from the PYTHON_WORKER_* environment variables.
+        With a limiter every run is measured, and with cgroups also limited; the
+        workers' own memory cap stays memory_mb. A run waits at most acquire_timeout
+        seconds for an idle worker.
+        """
+        self.size = int(size or os.getenv("PYTHON_WORKERS", "2"))
+        if preload is None:
+            preload = [name.strip() for name in os.getenv("PYTHON_PRELOAD_MODULES", "").split(",") if name.strip()]
+        self.preload = preload
+        self.max_runs = int(max_runs or os.getenv("PYTHON_WORKER_MAX_RUNS", "50"))
+        self.memory_mb = int(memory_mb if memory_mb is not None else os.getenv("PYTHON_WORKER_MEMORY_MB", "1024"))
+        self.cwd = cwd
+        self.fork = fork
+        self.limiter = limiter
+        self.acquire_timeout = float(acquire_timeout or os.getenv("PYTHON_WORKER_ACQUIRE_TIMEOUT", "5"))
+
+        self._idle: "queue.Queue[PythonWorker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started_pid = None
+        self._workers = 0
+        self._counters = {"runs": 0, "started": 0, "recycled": 0, "timeouts": 0}
+
+    def run(self, request: Dict[str, Any], timeout: float, capture: OutputCapture) -> Dict[str, Any]:
+        """
+        Run a request ({"code": ..., "filename": ...} or {"path": ..., "argv": [...]})
+        on a warm worker. Returns a dict with return_code and timed_out.
+        Raises RuntimeError if no worker is idle within acquire_timeout.
+        """
+        worker = self._acquire()
+        try:
+            result = worker.run(request, timeout, capture)
+        finally:
+            self._release(worker)
+
+        with self._lock:
+            self._counters["runs"] += 1
+            if result["timed_out"]:
+                self._counters["timeouts"] += 1
+        return result
+
+    def warm(self):
+        """Start the configured number of workers in the background."""
+        self._ensure_started()
+
+    def stats(self) -> Dict[str, int]:
+        """Worker and run counters."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["workers"] = self._workers
+        stats["idle"] = self._idle.qsize()
+        return stats
+
+    def shutdown(self):
+        """Stop every idle worker; busy ones are stopped when they are released."""
+        with self._lock:
+            self._started_pid = None
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            worker.close()
+            with self._lock:
+                self._workers -= 1
+
+    def _ensure_started(self):
+        """Spawn the workers on first use, and again in a forked process."""
+        with self._lock:
+            if self._started_pid == os.getpid():
+                return
+            self._started_pid = os.getpid()
+            self._idle = queue.Queue()
+            self._workers = self.size
+
+        for _ in range(self.size):
+            self._spawn_async()
+
+    def _acquire(self) -> PythonWorker:
+        """
+        Take an idle worker, waiting up to acquire_timeout for one to become available.
+        Workers that could not be started are replaced first, so a pool that failed to
+        spawn recovers once spawning works again.
+        """
+        self._ensure_started()
+        with self._lock:
+            missing = self.size - self._workers if self._started_pid == os.getpid() else 0
+            self._workers += max(missing, 0)
+        for _ in range(missing):
+            self._spawn_async()
+
+        try:
+            return self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise RuntimeError(f"No Python worker became available within {self.acquire_timeout} seconds")
+
+    def _release(self, worker: PythonWorker):
+        """Return a healthy worker to the pool, or replace it."""
+        if worker.alive and (self.fork or worker.runs < self.max_runs):
+            self._idle.put(worker)
+            return
+
+        worker.close()
+        with self._lock:
+            self._counters["recycled"] += 1
+            current = self._started_pid == os.getpid()
+            if not current:
+                self._workers -= 1
+        if current:
+            self._spawn_async()
+
+    def _spawn_async(self):
+        """Start a worker on a background thread and add it to the idle queue."""
+        threading.Thread(target=self._spawn, name="python-worker-spawn", daemon=True).start()
+
+    def _spawn(self):
+        idle = self._idle
+        for attempt in range(3):
+            try:
+                worker = PythonWorker(self.preload, self.memory_mb, self.cwd, fork=self.fork, limiter=self.limiter)
+            except Exception as e:
+                logger.error(f"Could not start Python worker: {str(e)}")
+                time.sleep(1 + attempt)
+                continue
+            with self._lock:
+                self._counters["started"] += 1
+            idle.put(worker)
+            return
+
+        # The next _acquire spawns a replacement
+        with self._lock:
+            self._workers -= 1
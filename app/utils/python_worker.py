@@ -0,0 +1,181 @@
+"""
+Warm Python worker, started by PythonWorkerPool.
+
+Run as a script (not imported): `python python_worker.py <control fd> [--fork]`.
+It imports the modules named in PYTHON_WORKER_PRELOAD once, then reads one JSON
+request per line from the control fd and runs it in a fresh __main__ namespace.
+Code output goes to the worker's stdout/stderr; after each request a line
+"\\n<marker><exit status>\\n" is written to stdout so the parent can frame the
+output.
+
+With --fork the worker is a fork server: every request runs in a forked,
+copy-on-write child that shares the preloaded modules but nothing it changes,
+and the server kills the child's process group once the request's timeout
+passes, reporting the status "timeout".
+
+Only the standard library is used here, so starting a worker does not import
+the application.
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import signal
+import select
+import builtins
+import importlib
+import traceback
+
+
+def preload(modules):
+    """Import the configured modules; a missing one is reported and skipped."""
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"python worker: could not preload {name}: {e}", file=sys.stderr)
+
+
+def limit_memory(megabytes):
+    """Cap address space growth at megabytes beyond what the worker uses after preloading."""
+    if megabytes <= 0:
+        return
+    try:
+        import resource
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        limit = current + megabytes * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except Exception as e:
+        print(f"python worker: could not set memory limit: {e}", file=sys.stderr)
+
+
+def print_user_traceback(error):
+    """Print a traceback without the worker's and runpy's own frames."""
+    internal = (os.path.abspath(__file__), os.path.abspath(runpy.__file__), "<frozen runpy>")
+    tb = error.__traceback__
+    while tb is not None and (tb.tb_frame.f_code.co_filename in internal
+                              or os.path.abspath(tb.tb_frame.f_code.co_filename) in internal):
+        tb = tb.tb_next
+    traceback.print_exception(type(error), error, tb)
+
+
+def run(request):
+    """Run one request in a fresh namespace and return its exit status."""
+    saved_argv = sys.argv[:]
+    saved_path = sys.path[:]
+    saved_cwd = os.getcwd()
+    try:
+        if request.get("path"):
+            sys.argv = [request["path"]] + list(request.get("argv") or [])
+            sys.path.insert(0, os.path.dirname(os.path.abspath(request["path"])))
+            runpy.run_path(request["path"], run_name="__main__")
+        else:
+            sys.argv = ["-c"]
+            namespace = {"__name__": "__main__", "__builtins__": builtins}
+            exec(compile(request["code"], request.get("filename") or "<string>", "exec"), namespace)
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    except BaseException as e:
+        print_user_traceback(e)
+        return 1
+    finally:
+        sys.argv = saved_argv
+        sys.path[:] = saved_path
+        try:
+            os.chdir(saved_cwd)
+        except OSError:
+            pass
+
+
+def run_forked(request, memory_mb, control_fd):
+    """Run one request in a forked child and return its exit status, or "timeout"."""
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        # Child: own process group so a timeout also kills anything it starts
+        status = 1
+        try:
+            os.setsid()
+            os.close(control_fd)
+            if "random" in sys.modules:
+                sys.modules["random"].seed()
+            limit_memory(memory_mb)
+            status = run(request)
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status if isinstance(status, int) and 0 <= status < 256 else 1)
+
+    return wait_child(pid, float(request.get("timeout") or 30))
+
+
+def wait_child(pid, timeout):
+    """Wait for a child until timeout, killing its process group if it overruns."""
+    deadline = time.monotonic() + timeout
+    pidfd = None
+    if hasattr(os, "pidfd_open"):
+        try:
+            pidfd = os.pidfd_open(pid)
+        except OSError:
+            pidfd = None
+
+    try:
+        while True:
+            finished, wait_status = os.waitpid(pid, os.WNOHANG)
+            if finished:
+                return os.waitstatus_to_exitcode(wait_status)
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                os.waitpid(pid, 0)
+                return "timeout"
+
+            if pidfd is not None:
+                select.select([pidfd], [], [], remaining)
+            else:
+                time.sleep(min(remaining, 0.001))
+    finally:
+        if pidfd is not None:
+            os.close(pidfd)
+
+
+def main():
+    control = os.fdopen(int(sys.argv[1]), "r")
+    fork = "--fork" in sys.argv[2:]
+    memory_mb = int(os.getenv("PYTHON_WORKER_MEMORY_MB", "0"))
+
+    # Resolve imports like `python -c` does (from the working directory), not from this script's directory
+    sys.path[0] = ""
+
+    preload([name.strip() for name in os.getenv("PYTHON_WORKER_PRELOAD", "").split(",") if name.strip()])
+    if not fork:
+        limit_memory(memory_mb)
+
+    ready_marker = os.getenv("PYTHON_WORKER_READY_MARKER", "")
+    sys.stdout.flush()
+    os.write(1, f"\n{ready_marker}0\n".encode())
+
+    for line in control:
+        request = json.loads(line)
+        status = run_forked(request, memory_mb, control.fileno()) if fork else run(request)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.write(1, f"\n{request['marker']}{status}\n".encode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+import os
+import math
+import uuid
+import shlex
+import logging
+import threading
+from typing import Dict, Any, List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+CGROUP_MOUNT = "/sys/fs/cgroup"
+
+# cpu.max period in microseconds
+CPU_PERIOD_USEC = 100000
+
+
+class ResourceLimiter:
+    """
+    Per-command CPU, memory and process limits with resource accounting.
+
+    With a writable cgroup v2 hierarchy every command runs in its own cgroup below
+    cgroup_root (by default a "commands" group under the service's own cgroup),
+    with cpu.max, memory.max and pids.max set, and its usage is read from the
+    cgroup's cpu.stat, memory.peak and io.stat. Otherwise limits fall back to
+    rlimits: RLIMIT_CPU caps CPU time at timeout * cpu_quota seconds and
+    RLIMIT_AS caps address space (not RSS) at memory_max_mb; pids_max needs
+    cgroups, as RLIMIT_NPROC counts every process of the user. Usage then comes
+    from wait4() rusage or /proc counters. A value of 0 disables that limit.
+    """
+
+    def __init__(self,
+                 cpu_quota: float = None,
+                 memory_max_mb: int = None,
+                 pids_max: int = None,
+                 cgroup_root: str = None,
+                 enabled: bool = None):
+        """Initialize limits; unset values come from the COMMAND_* environment variables."""
+        if enabled is None:
+            enabled = os.getenv("RESOURCE_LIMITS_ENABLED", "true").lower() in ['true', '1', 't']
+        self.enabled = enabled
+        self.cpu_quota = float(cpu_quota if cpu_quota is not None else os.getenv("COMMAND_CPU_QUOTA", "1.0"))
+        self.memory_max_mb = int(memory_max_mb if memory_max_mb is not None
+                                 else os.getenv("COMMAND_MEMORY_MAX_MB", "1024"))
+        self.pids_max = int(pids_max if pids_max is not None else os.getenv("COMMAND_PIDS_MAX", "256"))
+        self.cgroup_root = cgroup_root if cgroup_root is not None else os.getenv("COMMAND_CGROUP_ROOT", "")
+
+        self._mode = None
+        self._root = None
+        self._lock = threading.Lock()
+        # Groups of tracked requests that left processes behind, by the tracked pid
+        self._leftover_groups: Dict[int, List[str]] = {}
+        self._leftover_lock = threading.Lock()
+
+    @property
+    def mode(self) -> str:
+        """"cgroup", "rlimit" or "off", detected on first use."""
+        with self._lock:
+            if self._mode is None:
+                self._mode = self._detect()
+            return self._mode
+
+    def describe(self) -> Dict[str, Any]:
+        """The limiting mode and configured limits."""
+        return {
+            "mode": self.mode,
+            "cgroup_root": self._root,
+            "cpu_quota": self.cpu_quota,
+            "memory_max_mb": self.memory_max_mb,
+            "pids_max": self.pids_max
+        }
+
+    def create_group(self) -> Optional[str]:
+        """Create a cgroup with the configured limits for one command, or return None without cgroups."""
+        if self.mode != "cgroup":
+            return None
+        path = os.path.join(self._root, f"cmd-{uuid.uuid4().hex[:12]}")
+        try:
+            os.mkdir(path)
+            if self.cpu_quota > 0:
+                _write(path, "cpu.max", f"{int(self.cpu_quota * CPU_PERIOD_USEC)} {CPU_PERIOD_USEC}")
+            if self.memory_max_mb > 0:
+                _write(path, "memory.max", str(self.memory_max_mb * 1024 * 1024))
+                try:
+                    # Without this the limit only moves the excess to swap
+                    _write(path, "memory.swap.max", "0")
+                except OSError:
+                    pass
+            if self.pids_max > 0:
+                _write(path, "pids.max", str(self.pids_max))
+            return path
+        except OSError as e:
+            logger.warning(f"Could not create command cgroup {path}: {str(e)}")
+            self._remove_group(path)
+            return None
+
+    def wrap_command(self, args: Union[str, List[str]], group: Optional[str],
+                     timeout: float) -> Union[str, List[str]]:
+        """
+        Return args with a shell prefix that puts the process in its limits before
+        the command starts: it joins group when there is one, otherwise it sets
+        rlimits with ulimit. A shell command string gets the prefix itself; an
+        argument list is exec'd from a /bin/sh wrapper. Nothing runs in the forked
+        child before exec, so Popen keeps its fast spawn path and is safe to call
+        from threads.
+        """
+        prefix = self._limit_script(group, timeout)
+        if not prefix:
+            return args
+        if isinstance(args, str):
+            return prefix + args
+        return ["/bin/sh", "-c", prefix + 'exec "$@"', "sh", *args]
+
+    def limit_process(self, pid: int, timeout: float):
+        """
+        Apply the rlimit fallback to a long-lived process (a shell session) before
+        each command it runs; the command's processes inherit the limits.
+        RLIMIT_CPU counts the process's own CPU time over its whole life, so only
+        its soft limit is set, to what the process has used so far plus one
+        command's budget; the hard limit is left as is so the next command can
+        raise the soft limit again.
+        """
+        if self.mode != "rlimit":
+            return
+        import resource
+        for limit, value in self._rlimits(timeout):
+            try:
+                if limit == resource.RLIMIT_CPU:
+                    used = _own_cpu_seconds(pid)
+                    if used is None:
+                        continue
+                    hard = resource.prlimit(pid, limit)[1]
+                    soft = math.ceil(used) + value[0]
+                    value = (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard)
+                resource.prlimit(pid, limit, value)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not set resource limits on process {pid}: {str(e)}")
+
+    def collect(self, group: Optional[str], rusage=None) -> Optional[Dict[str, Any]]:
+        """
+        Read the usage of a finished command from its cgroup (which is then removed)
+        or from its wait4() rusage. Returns None when nothing was measured.
+        """
+        if group is not None:
+            usage = self._group_usage(group)
+            self._remove_group(group)
+            return usage
+        if rusage is not None:
+            return {
+                "cpu_seconds": round(rusage.ru_utime + rusage.ru_stime, 3),
+                # ru_maxrss is in kilobytes on Linux; it is the largest single process
+                "peak_memory_bytes": rusage.ru_maxrss * 1024,
+                "io_read_bytes": rusage.ru_inblock * 512,
+                "io_write_bytes": rusage.ru_oublock * 512,
+                "source": "rusage"
+            }
+        return None
+
+    def track(self, pid: int) -> "UsageTracker":
+        """
+        Measure what a long-lived process (a shell session or Python worker) and
+        its children use while handling one request:
+
+            with limiter.track(pid) as tracker:
+                ...
+            tracker.usage
+        """
+        return UsageTracker(self, pid)
+
+    def _cpu_seconds(self, timeout: float) -> int:
+        """The CPU time budget of one command, or 0 for none."""
+        if self.cpu_quota > 0 and timeout:
+            return max(1, math.ceil(timeout * self.cpu_quota))
+        return 0
+
+    def release(self, pid: int):
+        """
+        Remove the cgroups that requests tracked on pid left processes behind in,
+        killing those processes. Call when the long-lived process is closed.
+        """
+        with self._leftover_lock:
+            groups = self._leftover_groups.pop(pid, [])
+        for group in groups:
+            self._remove_group(group)
+
+    def _rlimits(self, timeout: float):
+        import resource
+        limits = []
+        cpu_seconds = self._cpu_seconds(timeout)
+        if cpu_seconds:
+            # SIGXCPU at the soft limit, SIGKILL a second later
+            limits.append((resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1)))
+        if self.memory_max_mb > 0:
+            memory = self.memory_max_mb * 1024 * 1024
+            limits.append((resource.RLIMIT_AS, (memory, memory)))
+        return limits
+
+    def _limit_script(self, group: Optional[str], timeout: float) -> str:
+        """
+        Shell lines that enter group or set the rlimits; a command whose limits
+        cannot be applied exits with status 126 instead of running unlimited.
+        """
+        if self.mode == "off":
+            return ""
+        if group is not None:
+            lines = [f"echo $$ > {shlex.quote(os.path.join(group, 'cgroup.procs'))}"]
+        else:
+            lines = []
+            cpu_seconds = self._cpu_seconds(timeout)
+            if cpu_seconds:
+                # SIGXCPU at the soft limit, SIGKILL a second later
+                lines.append(f"ulimit -S -t {cpu_seconds} && ulimit -H -t {cpu_seconds + 1}")
+            if self.memory_max_mb > 0:
+                lines.append(f"ulimit -v {self.memory_max_mb * 1024}")
+        return "".join(f"{line} || exit 126\n" for line in lines)
+
+    def _detect(self) -> str:
+        """Set up the cgroup root when cgroup v2 is usable, else fall back to rlimits."""
+        if not self.enabled:
+            return "off"
+        if not os.path.exists(os.path.join(CGROUP_MOUNT, "cgroup.controllers")):
+            logger.info("cgroup v2 is not mounted; limiting commands with rlimits")
+            return "rlimit"
+
+        root = self.cgroup_root
+        if not root:
+            root = os.path.join(_own_cgroup(), "commands")
+        root = os.path.join(CGROUP_MOUNT, root.lstrip("/")) if not root.startswith(CGROUP_MOUNT) else root
+
+        try:
+            # Controllers must be enabled on every level down to the command groups
+            os.makedirs(root, exist_ok=True)
+            wanted = {"cpu", "memory", "pids"}
+            available = set(_read(os.path.dirname(root), "cgroup.subtree_control").split())
+            missing = wanted - available
+            if missing:
+                _write(os.path.dirname(root), "cgroup.subtree_control", " ".join(f"+{name}" for name in missing))
+            _write(root, "cgroup.subtree_control", " ".join(f"+{name}" for name in wanted))
+            os.makedirs(os.path.join(root, "idle"), exist_ok=True)
+        except OSError as e:
+            # Typically EBUSY (the parent has processes) or EACCES (not delegated)
+            logger.info(f"Cannot use cgroup {root} for commands ({str(e)}); set COMMAND_CGROUP_ROOT to a "
+                        f"delegated cgroup. Limiting commands with rlimits")
+            return "rlimit"
+
+        self._root = root
+        return "cgroup"
+
+    def _group_usage(self, group: str) -> Dict[str, Any]:
+        usage = {"source": "cgroup"}
+        try:
+            cpu = _read_keyed(group, "cpu.stat")
+            usage["cpu_seconds"] = round(cpu.get("usage_usec", 0) / 1e6, 3)
+            usage["cpu_throttled_seconds"] = round(cpu.get("throttled_usec", 0) / 1e6, 3)
+        except OSError:
+            pass
+        try:
+            usage["peak_memory_bytes"] = int(_read(group, "memory.peak"))
+        except (OSError, ValueError):
+            # memory.peak needs Linux 5.19
+            usage["peak_memory_bytes"] = None
+        try:
+            usage["oom_killed"] = _read_keyed(group, "memory.events").get("oom_kill", 0) > 0
+        except OSError:
+            pass
+        try:
+            usage["pids_limited"] = _read_keyed(group, "pids.events").get("max", 0) > 0
+        except OSError:
+            pass
+
+        read_bytes = write_bytes = 0
+        try:
+            for line in _read(group, "io.stat").splitlines():
+                fields = dict(field.split("=", 1) for field in line.split()[1:] if "=" in field)
+                read_bytes += int(fields.get("rbytes", 0))
+                write_bytes += int(fields.get("wbytes", 0))
+        except (OSError, ValueError):
+            pass
+        usage["io_read_bytes"] = read_bytes
+        usage["io_write_bytes"] = write_bytes
+        return usage
+
+    def _move(self, pid: int, group: str) -> bool:
+        try:
+            _write(group, "cgroup.procs", str(pid))
+            return True
+        except OSError as e:
+            logger.warning(f"Could not move process {pid} to {group}: {str(e)}")
+            return False
+
+    def _remove_group(self, group: str):
+        """Remove a command cgroup, killing whatever the command left running in it."""
+        try:
+            _write(group, "cgroup.kill", "1")
+        except OSError:
+            pass
+        try:
+            os.rmdir(group)
+        except OSError:
+            # Killed processes may take a moment to leave; the kernel frees the group later
+            logger.debug(f"Could not remove cgroup {group}")
+
+
+class UsageTracker:
+    """Usage of a long-lived process over one request; see ResourceLimiter.track."""
+
+    def __init__(self, limiter: ResourceLimiter, pid: int):
+        self.limiter = limiter
+        self.pid = pid
+        self.usage: Optional[Dict[str, Any]] = None
+        self._group = None
+        self._start = None
+
+    def __enter__(self):
+        self._group = self.limiter.create_group()
+        if self._group is not None and not self.limiter._move(self.pid, self._group):
+            self.limiter._remove_group(self._group)
+            self._group = None
+        if self._group is None and self.limiter.mode != "off":
+            self._start = _proc_counters(self.pid)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._group is not None:
+            # Back to the idle group; children the request left behind stay in its group
+            try:
+                _write(os.path.join(self.limiter._root, "idle"), "cgroup.procs", str(self.pid))
+                exited = False
+            except OSError:
+                # The process exited, e.g. a shell killed on timeout
+                exited = True
+            self.usage = self.limiter._group_usage(self._group)
+            if exited:
+                # Its close has already run, so nothing would remove the group later
+                self.limiter._remove_group(self._group)
+                return False
+            try:
+                os.rmdir(self._group)
+            except OSError:
+                # Processes left behind keep it alive; it is removed when the process is closed
+                with self.limiter._leftover_lock:
+                    self.limiter._leftover_groups.setdefault(self.pid, []).append(self._group)
+        elif self._start is not None:
+            end = _proc_counters(self.pid)
+            if end is not None:
+                # Counters include children the process has reaped; peak memory is not available
+                self.usage = {
+                    "cpu_seconds": round(end["cpu_seconds"] - self._start["cpu_seconds"], 3),
+                    "peak_memory_bytes": None,
+                    "io_read_bytes": end["io_read_bytes"] - self._start["io_read_bytes"],
+                    "io_write_bytes": end["io_write_bytes"] - self._start["io_write_bytes"],
+                    "source": "proc"
+                }
+        return False
+
+
+def _own_cgroup() -> str:
+    """The cgroup v2 path of this process, relative to the cgroup mount."""
+    with open("/proc/self/cgroup") as f:
+        for line in f:
+            if line.startswith("0::"):
+                return line[3:].strip()
+    return "/"
+
+
+def _own_cpu_seconds(pid: int) -> Optional[float]:
+    """CPU time a process has used itself, without its children."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _proc_counters(pid: int) -> Optional[Dict[str, float]]:
+    """CPU time and storage IO of a process and the children it has reaped."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # Fields after the command name, which may contain spaces
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = sum(int(value) for value in fields[11:15])
+        counters = {"cpu_seconds": ticks / os.sysconf("SC_CLK_TCK"), "io_read_bytes": 0, "io_write_bytes": 0}
+    except (OSError, IndexError, ValueError):
+        return None
+    try:
+        with open(f"/proc/{pid}/io") as f:
+            io = dict(line.split(": ", 1) for line in f.read().splitlines() if ": " in line)
+        counters["io_read_bytes"] = int(io.get("read_bytes", 0))
+        counters["io_write_bytes"] = int(io.get("write_bytes", 0))
+    except (OSError, ValueError):
+        pass
+    return counters
+
+
+def _read(group: str, name: str) -> str:
+    with open(os.path.join(group, name)) as f:
+        return f.read().strip()
+
+
+def _read_keyed(group: str, name: str) -> Dict[str, int]:
+    """Parse a flat "key value" cgroup file such as cpu.stat."""
+    values = {}
+    for line in _read(group, name).splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].isdigit():
+            values[parts[0]] = int(parts[1])
+    return values
+
+
+def _write(group: str, name: str, value: str):
+    with open(os.path.join(group, name), "w") as f:
+        f.write(value)
@@ -0,0 +1,197 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """
+    Two-tier cache of LLM responses keyed by the normalized request.
+
+    The key covers the kind of request, the model, the temperature and the
+    messages with whitespace collapsed, so resubmitting a task that only differs
+    in spacing is answered from the cache. At temperature 0 the model's answer
+    is deterministic, so a replayed task is served from the cache step by step
+    for as long as its command outputs come out the same.
+
+    Entries live in an in-memory LRU and, when a path is given, in a SQLite file
+    that survives restarts. Both tiers expire entries after ttl_seconds.
+    """
+
+    WHITESPACE = re.compile(r"\s+")
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 max_entries: int = None,
+                 max_disk_entries: int = None,
+                 ttl_seconds: float = None):
+        """Initialize the tiers; unset values come from the LLM_CACHE_* environment variables."""
+        self.path = path if path is not None else os.getenv("LLM_CACHE_PATH", "")
+        self.max_entries = int(max_entries or os.getenv("LLM_CACHE_SIZE", "512"))
+        self.max_disk_entries = int(max_disk_entries or os.getenv("LLM_CACHE_DISK_SIZE", "10000"))
+        self.ttl_seconds = float(ttl_seconds or os.getenv("LLM_CACHE_TTL", "86400"))
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expired": 0
+        }
+
+    @classmethod
+    def make_key(cls, kind: str, model: str, temperature: float, messages: List[Dict[str, str]]) -> str:
+        """Build the cache key for a request."""
+        normalized = [
+            [message.get("role", ""), cls.WHITESPACE.sub(" ", message.get("content", "")).strip()]
+            for message in messages
+        ]
+        payload = json.dumps([kind, model, round(float(temperature), 3), normalized], separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for a key, or None on a miss or an expired entry."""
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._counters["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+                self._counters["expired"] += 1
+
+        value = self._disk_get(key, now)
+        with self._lock:
+            if value is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["disk_hits"] += 1
+        self._memory_put(key, value, now + self.ttl_seconds)
+        return value
+
+    def put(self, key: str, value: Any):
+        """Store a JSON-serializable value in both tiers."""
+        expires_at = time.time() + self.ttl_seconds
+        self._memory_put(key, value, expires_at)
+        self._disk_put(key, value, expires_at)
+        with self._lock:
+            self._counters["stores"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["memory_entries"] = len(self._memory)
+
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 3) if lookups else 0.0
+        stats["persistent"] = bool(self.path)
+        return stats
+
+    def clear(self):
+        """Remove every entry from both tiers."""
+        with self._lock:
+            self._memory.clear()
+        conn = self._connection()
+        if conn is not None:
+            with conn:
+                conn.execute("DELETE FROM llm_cache")
+
+    def _memory_put(self, key: str, value: Any, expires_at: float):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def _disk_get(self, key: str, now: float) -> Optional[Any]:
+        """Look a key up in the SQLite tier, refreshing its last-used time."""
+        conn = self._connection()
+        if conn is None:
+            return None
+
+        try:
+            row = conn.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] <= now:
+                with conn:
+                    conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                with self._lock:
+                    self._counters["expired"] += 1
+                return None
+            with conn:
+                conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            return json.loads(row[0])
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache lookup failed: {str(e)}")
+            return None
+
+    def _disk_put(self, key: str, value: Any, expires_at: float):
+        """Write an entry to the SQLite tier and trim it to max_disk_entries."""
+        conn = self._connection()
+        if conn is None:
+            return
+
+        now = time.time()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(value), expires_at, now)
+                )
+                conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+                conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    "SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache write failed: {str(e)}")
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """Return this thread's connection to the SQLite tier, or None if it is disabled."""
+        if not self.path:
+            return None
+
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and getattr(self._local, "pid", None) == os.getpid():
+            return conn
+
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_used ON llm_cache (last_used)")
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache at {self.path} is unavailable: {str(e)}")
+            self.path = ""
+            return None
+
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
@@ -0,0 +1,463 @@
+import os
+import time
+import asyncio
+import uuid
+import shlex
+import signal
+import logging
+import threading
+import subprocess
+from contextlib import nullcontext
+from typing import Dict, Any, Optional
+
+from app.utils.output_capture import OutputCapture, read_framed, read_framed_async
+from app.utils.resource_limits import ResourceLimiter
+
+logger = logging.getLogger(__name__)
+
+
+def _framed_script(command: str):
+    """
+    Return (marker, script): the script runs command through eval and then prints
+    a line with the random marker and the exit status.
+    """
+    marker = f"__SHELL_SESSION_DONE_{uuid.uuid4().hex}__"
+    script = (
+        f"eval {shlex.quote(command)} </dev/null 2>&1\n"
+        f"printf '\\n{marker}%d\\n' \"$?\"\n"
+    )
+    return marker, script
+
+
+class ShellSession:
+    """
+    A long-lived shell process that runs commands sent over its stdin pipe.
+
+    Every command is run through eval with stderr merged into stdout and stdin
+    from /dev/null, followed by a printf of a random sentinel and the exit
+    status, so the output of one command can be told apart from the next. The
+    working directory, environment variables and shell variables persist
+    between commands. A session that times out or whose shell exits is dead and
+    must be replaced. With a ResourceLimiter each command runs under its limits
+    and its resource usage is measured.
+    """
+
+    def __init__(self, shell: str = None, cwd: Optional[str] = None, limiter: ResourceLimiter = None):
+        """Start the shell process."""
+        self.shell = shell or os.getenv("SHELL_SESSION_SHELL", "/bin/bash")
+        self.limiter = limiter
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.commands_run = 0
+        self.lock = threading.Lock()
+
+        # A new process group lets a timeout kill the shell and everything it started
+        self._process = subprocess.Popen(
+            [self.shell],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=cwd,
+            start_new_session=True
+        )
+        self._buffer = b""
+
+    @property
+    def alive(self) -> bool:
+        return self._process.poll() is None
+
+    @property
+    def cwd(self) -> Optional[str]:
+        """The shell's current working directory, or None if it cannot be read."""
+        try:
+            return os.readlink(f"/proc/{self._process.pid}/cwd")
+        except OSError:
+            return None
+
+    def run(self, command: str, timeout: float, capture: OutputCapture = None) -> Dict[str, Any]:
+        """
+        Run one command and wait for its sentinel, streaming its output into capture.
+        Returns a dict with output, capture metadata, return_code (None if unknown),
+        timed_out and resource_usage. If the shell timed out or exited, the session is
+        dead afterwards.
+        """
+        capture = capture or OutputCapture()
+        marker, script = _framed_script(command)
+
+        if self.limiter is not None:
+            # Without cgroups the shell's rlimits are inherited by the command it starts
+            self.limiter.limit_process(self._process.pid, timeout)
+
+        self.last_used = time.time()
+        self.commands_run += 1
+        tracker = self.limiter.track(self._process.pid) if self.limiter is not None else None
+        with tracker or nullcontext():
+            try:
+                self._process.stdin.write(script.encode())
+                self._process.stdin.flush()
+            except (BrokenPipeError, OSError):
+                self.close()
+                return {"output": "Shell session exited unexpectedly.", "capture": capture.metadata(),
+                        "return_code": None, "timed_out": False, "resource_usage": None}
+
+            try:
+                return_code, timed_out = self._read_until(marker.encode(), time.monotonic() + timeout, capture)
+            finally:
+                capture.close()
+        self.last_used = time.time()
+        return {
+            "output": capture.text(),
+            "capture": capture.metadata(),
+            "return_code": return_code,
+            "timed_out": timed_out,
+            "resource_usage": tracker.usage if tracker is not None else None
+        }
+
+    def close(self):
+        """Kill the shell and any process it started."""
+        if self.alive:
+            try:
+                os.killpg(self._process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            pass
+        if self.limiter is not None:
+            self.limiter.release(self._process.pid)
+        for stream in (self._process.stdin, self._process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+    def _read_until(self, marker: bytes, deadline: float, capture: OutputCapture):
+        """
+        Stream shell output into capture until the marker line, the deadline or the
+        shell exiting. Returns (return_code, timed_out).
+        """
+        outcome, status, self._buffer = read_framed(self._process.stdout.fileno(), self._buffer,
+                                                   marker, deadline, capture)
+        if outcome == "done":
+            return (int(status) if status.isdigit() else None), False
+
+        self.close()
+        if outcome == "timeout":
+            return None, True
+        # The shell exited, e.g. because the command ran `exit`
+        return self._process.returncode, False
+
+
+class ShellSessionPool:
+    """
+    Shell sessions keyed by an id (one per task), created on first use.
+
+    Dead sessions are replaced on the next command, sessions idle for longer than
+    idle_timeout seconds are closed, and once max_sessions are open the least
+    recently used one is closed to make room.
+    """
+
+    def __init__(self, max_sessions: int = None, idle_timeout: float = None, shell: str = None,
+                 limiter: ResourceLimiter = None):
+        """Initialize the pool; unset values come from the SHELL_SESSION_* environment variables."""
+        self.max_sessions = int(max_sessions or os.getenv("SHELL_SESSION_MAX", "32"))
+        self.idle_timeout = float(idle_timeout or os.getenv("SHELL_SESSION_IDLE_TIMEOUT", "600"))
+        self.shell = shell
+        self.limiter = limiter
+
+        self._sessions: Dict[Any, ShellSession] = {}
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._recycled = 0
+
+    def run(self, session_id, command: str, timeout: float, cwd: Optional[str] = None,
+            capture: OutputCapture = None) -> Dict[str, Any]:
+        """
+        Run a command in the session for session_id, starting or replacing it as needed.
+        The result has session_restarted set when a dead session had to be replaced,
+        which means its working directory and environment were lost.
+        """
+        session = self._acquire(session_id, cwd)
+        with session.lock:
+            restarted = False
+            if not session.alive:
+                session = self._replace(session_id, session, cwd)
+                restarted = True
+            result = session.run(command, timeout, capture)
+            result["session_restarted"] = restarted
+            return result
+
+    def cwd(self, session_id) -> Optional[str]:
+        """The working directory of the live session for session_id, or None."""
+        with self._lock:
+            session = self._sessions.get(session_id) if self._pid == os.getpid() else None
+        return session.cwd if session is not None and session.alive else None
+
+    def close(self, session_id):
+        """Close the session for session_id, if any."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+
+    def close_all(self):
+        """Close every session."""
+        with self._lock:
+            sessions, self._sessions = list(self._sessions.values()), {}
+        for session in sessions:
+            session.close()
+
+    def stats(self) -> Dict[str, int]:
+        """Counts of open, created and recycled sessions."""
+        with self._lock:
+            return {
+                "open": len(self._sessions),
+                "created": self._created,
+                "recycled": self._recycled
+            }
+
+    def _acquire(self, session_id, cwd: Optional[str]) -> ShellSession:
+        """Return the session for session_id, creating it and closing idle or excess sessions."""
+        expired = []
+        with self._lock:
+            # Sessions inherited from a parent process belong to that process
+            if self._pid != os.getpid():
+                self._sessions = {}
+                self._pid = os.getpid()
+
+            now = time.time()
+            for key, session in list(self._sessions.items()):
+                if key != session_id and now - session.last_used > self.idle_timeout and not session.lock.locked():
+                    expired.append(self._sessions.pop(key))
+
+            session = self._sessions.get(session_id)
+            if session is None:
+                while len(self._sessions) >= self.max_sessions:
+                    idle = [(s.last_used, key) for key, s in self._sessions.items() if not s.lock.locked()]
+                    if not idle:
+                        break
+                    expired.append(self._sessions.pop(min(idle)[1]))
+
+                session = ShellSession(self.shell, cwd, self.limiter)
+                self._sessions[session_id] = session
+                self._created += 1
+
+        for session_to_close in expired:
+            session_to_close.close()
+        return session
+
+    def _replace(self, session_id, dead: ShellSession, cwd: Optional[str]) -> ShellSession:
+        """Swap a dead session for a fresh one. Called with the dead session's lock held."""
+        logger.info(f"Replacing shell session {session_id} after its shell exited")
+        dead.close()
+
+        session = ShellSession(self.shell, cwd, self.limiter)
+        # The caller keeps holding the dead session's lock, which still serializes this id
+        session.lock = dead.lock
+        with self._lock:
+            self._sessions[session_id] = session
+            self._created += 1
+            self._recycled += 1
+        return session
+
+
+class AsyncShellSession:
+    """
+    ShellSession for the asyncio core: the same protocol over a shell started with
+    asyncio.create_subprocess_exec. Create it with AsyncShellSession.start().
+    """
+
+    def __init__(self, shell: str = None, limiter: ResourceLimiter = None):
+        self.shell = shell or os.getenv("SHELL_SESSION_SHELL", "/bin/bash")
+        self.limiter = limiter
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.commands_run = 0
+        self.lock = asyncio.Lock()
+        self._process = None
+        self._buffer = b""
+
+    @classmethod
+    async def start(cls, shell: str = None, cwd: Optional[str] = None,
+                    limiter: ResourceLimiter = None) -> "AsyncShellSession":
+        """Start the shell process."""
+        session = cls(shell, limiter)
+        session._process = await asyncio.create_subprocess_exec(
+            session.shell,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=cwd,
+            start_new_session=True
+        )
+        return session
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+
+    @property
+    def cwd(self) -> Optional[str]:
+        """The shell's current working directory, or None if it cannot be read."""
+        try:
+            return os.readlink(f"/proc/{self._process.pid}/cwd")
+        except OSError:
+            return None
+
+    async def run(self, command: str, timeout: float, capture: OutputCapture = None) -> Dict[str, Any]:
+        """ShellSession.run, awaiting the output instead of blocking on it."""
+        capture = capture or OutputCapture()
+        marker, script = _framed_script(command)
+
+        if self.limiter is not None:
+            self.limiter.limit_process(self._process.pid, timeout)
+
+        self.last_used = time.time()
+        self.commands_run += 1
+        tracker = self.limiter.track(self._process.pid) if self.limiter is not None else None
+        with tracker or nullcontext():
+            try:
+                self._process.stdin.write(script.encode())
+                await self._process.stdin.drain()
+            except (BrokenPipeError, ConnectionResetError, OSError):
+                await self.close()
+                return {"output": "Shell session exited unexpectedly.", "capture": capture.metadata(),
+                        "return_code": None, "timed_out": False, "resource_usage": None}
+
+            try:
+                outcome, status, self._buffer = await read_framed_async(
+                    self._process.stdout, self._buffer, marker.encode(), time.monotonic() + timeout, capture)
+            except BaseException:
+                # Cancelled mid-command; the shell's state is unknown
+                await self.close()
+                raise
+            finally:
+                capture.close()
+        self.last_used = time.time()
+
+        if outcome == "done":
+            return_code, timed_out = (int(status) if status.isdigit() else None), False
+        else:
+            await self.close()
+            return_code, timed_out = (None, True) if outcome == "timeout" else (self._process.returncode, False)
+        return {
+            "output": capture.text(),
+            "capture": capture.metadata(),
+            "return_code": return_code,
+            "timed_out": timed_out,
+            "resource_usage": tracker.usage if tracker is not None else None
+        }
+
+    async def close(self):
+        """Kill the shell and any process it started."""
+        if self._process is None:
+            return
+        if self.alive:
+            try:
+                os.killpg(self._process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        try:
+            await asyncio.wait_for(self._process.wait(), 5)
+        except asyncio.TimeoutError:
+            pass
+        if self.limiter is not None:
+            self.limiter.release(self._process.pid)
+        if self._process.stdin is not None:
+            self._process.stdin.close()
+
+
+class AsyncShellSessionPool:
+    """
+    ShellSessionPool for the asyncio core, used from a single event loop.
+
+    Sessions are replaced, expired and evicted the same way; max_sessions defaults
+    to ASYNC_SHELL_SESSION_MAX since one process runs many more tasks at once.
+    """
+
+    def __init__(self, max_sessions: int = None, idle_timeout: float = None, shell: str = None,
+                 limiter: ResourceLimiter = None):
+        """Initialize the pool; unset values come from the environment."""
+        self.max_sessions = int(max_sessions or os.getenv("ASYNC_SHELL_SESSION_MAX", "512"))
+        self.idle_timeout = float(idle_timeout or os.getenv("SHELL_SESSION_IDLE_TIMEOUT", "600"))
+        self.shell = shell
+        self.limiter = limiter
+
+        self._sessions: Dict[Any, AsyncShellSession] = {}
+        self._created = 0
+        self._recycled = 0
+
+    async def run(self, session_id, command: str, timeout: float, cwd: Optional[str] = None,
+                  capture: OutputCapture = None) -> Dict[str, Any]:
+        """ShellSessionPool.run for the asyncio core."""
+        session = await self._acquire(session_id, cwd)
+        async with session.lock:
+            restarted = False
+            if not session.alive:
+                logger.info(f"Replacing shell session {session_id} after its shell exited")
+                await session.close()
+                lock = session.lock
+                session = await AsyncShellSession.start(self.shell, cwd, self.limiter)
+                session.lock = lock
+                self._sessions[session_id] = session
+                self._created += 1
+                self._recycled += 1
+                restarted = True
+            result = await session.run(command, timeout, capture)
+            result["session_restarted"] = restarted
+            return result
+
+    def cwd(self, session_id) -> Optional[str]:
+        """The working directory of the live session for session_id, or None."""
+        session = self._sessions.get(session_id)
+        return session.cwd if session is not None and session.alive else None
+
+    async def close(self, session_id):
+        """Close the session for session_id, if any."""
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            await session.close()
+
+    async def close_all(self):
+        """Close every session."""
+        sessions, self._sessions = list(self._sessions.values()), {}
+        await asyncio.gather(*(session.close() for session in sessions))
+
+    def stats(self) -> Dict[str, int]:
+        """Counts of open, created and recycled sessions."""
+        return {
+            "open": len(self._sessions),
+            "created": self._created,
+            "recycled": self._recycled
+        }
+
+    async def _acquire(self, session_id, cwd: Optional[str]) -> AsyncShellSession:
+        """Return the session for session_id, creating it and closing idle or excess sessions."""
+        expired = []
+        now = time.time()
+        for key, session in list(self._sessions.items()):
+            if key != session_id and now - session.last_used > self.idle_timeout and not session.lock.locked():
+                expired.append(self._sessions.pop(key))
+
+        session = self._sessions.get(session_id)
+        if session is None:
+            while len(self._sessions) >= self.max_sessions:
+                idle = [(s.last_used, key) for key, s in self._sessions.items() if not s.lock.locked()]
+                if not idle:
+                    break
+                expired.append(self._sessions.pop(min(idle)[1]))
+
+            session = await AsyncShellSession.start(self.shell, cwd, self.limiter)
+            # Another coroutine may have started one for this id meanwhile
+            if session_id in self._sessions:
+                expired.append(session)
+                session = self._sessions[session_id]
+            else:
+                self._sessions[session_id] = session
+                self._created += 1
+
+        for session_to_close in expired:
+            await session_to_close.close()
+        return session
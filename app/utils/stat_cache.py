@@ -0,0 +1,116 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Dict, Optional, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class StatCache:
+    """
+    Cache of file hashes keyed by path and stat metadata.
+
+    An entry is only reused while the file's (st_ino, st_size, st_mtime_ns) still
+    match, so any write that touches the metadata forces a re-hash. The cache can
+    optionally be persisted to a JSON file so it survives restarts; a persisted
+    cache written under a different namespace (hash algorithm) is discarded.
+    """
+
+    def __init__(self, path: Optional[str] = None, namespace: str = None, racy_window_seconds: float = 2.0):
+        """Initialize with an optional file to persist the cache to."""
+        self.path = path
+        self.namespace = namespace
+        # Files modified this close to the scan could still change within the same
+        # mtime tick, so their hashes are not trusted on the next scan
+        self.racy_window_ns = int(racy_window_seconds * 1_000_000_000)
+        self._entries: Dict[str, list] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+
+        if self.path:
+            self.load()
+
+    def lookup(self, rel_path: str, stat_info: os.stat_result) -> Optional[str]:
+        """Return the cached hash if the file's metadata is unchanged, otherwise None."""
+        with self._lock:
+            entry = self._entries.get(rel_path)
+
+        if entry is None:
+            return None
+
+        ino, size, mtime_ns, file_hash = entry
+        if ino == stat_info.st_ino and size == stat_info.st_size and mtime_ns == stat_info.st_mtime_ns:
+            return file_hash
+        return None
+
+    def store(self, rel_path: str, stat_info: os.stat_result, file_hash: Optional[str], scan_started_ns: int = None):
+        """Record the hash computed for a file with the given metadata."""
+        scan_started_ns = scan_started_ns or time.time_ns()
+
+        with self._lock:
+            if file_hash is None or stat_info.st_mtime_ns >= scan_started_ns - self.racy_window_ns:
+                # Too recent (or unreadable) to be trusted later
+                if self._entries.pop(rel_path, None) is not None:
+                    self._dirty = True
+                return
+
+            self._entries[rel_path] = [stat_info.st_ino, stat_info.st_size, stat_info.st_mtime_ns, file_hash]
+            self._dirty = True
+
+    def prune(self, seen_paths: Iterable[str]):
+        """Drop entries for files that no longer exist."""
+        seen = set(seen_paths)
+        with self._lock:
+            stale = [path for path in self._entries if path not in seen]
+            for path in stale:
+                del self._entries[path]
+            if stale:
+                self._dirty = True
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        with self._lock:
+            self._entries = {}
+            self._dirty = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        """Load cache entries from the persistence file, if it exists."""
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get('namespace') == self.namespace:
+                with self._lock:
+                    self._entries = data.get('entries', {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable stat cache at {self.path}: {str(e)}")
+
+    def save(self):
+        """Write the cache to the persistence file if it has changed."""
+        if not self.path:
+            return
+
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = dict(self._entries)
+            self._dirty = False
+
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            # Write to a temporary file first so a crash never leaves a truncated cache
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'namespace': self.namespace, 'entries': entries}, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Failed to persist stat cache to {self.path}: {str(e)}")
@@ -0,0 +1,69 @@
+import math
+import time
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+
+class PhaseTimer:
+    """
+    High-resolution timing spans for the phases of one task.
+
+    Each span has a phase name (llm_step, command, snapshot_after, ...), the index
+    of the command it belongs to (None for task-level spans), its UTC start time
+    and its duration in milliseconds from a monotonic clock. Spans may be recorded
+    from snapshot worker threads.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.utcnow()
+        self._start = time.perf_counter()
+        self._spans: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, phase: str, index: Optional[int] = None):
+        """Time the body of a with block as one span."""
+        started_at = datetime.utcnow()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, index, started_at, (time.perf_counter() - start) * 1000)
+
+    def record(self, phase: str, index: Optional[int], started_at: datetime, duration_ms: float):
+        with self._lock:
+            self._spans.append({
+                "phase": phase,
+                "command_index": index,
+                "started_at": started_at,
+                "duration_ms": round(duration_ms, 3)
+            })
+
+    def elapsed_ms(self) -> float:
+        """Milliseconds since the timer was created."""
+        return (time.perf_counter() - self._start) * 1000
+
+    def spans(self) -> List[Dict[str, Any]]:
+        """A copy of the recorded spans, in recording order."""
+        with self._lock:
+            return [dict(span) for span in self._spans]
+
+    def by_command(self) -> Dict[int, Dict[str, float]]:
+        """Total milliseconds per phase for each command index."""
+        totals: Dict[int, Dict[str, float]] = {}
+        for span in self.spans():
+            if span["command_index"] is None:
+                continue
+            phases = totals.setdefault(span["command_index"], {})
+            phases[span["phase"]] = round(phases.get(span["phase"], 0) + span["duration_ms"], 3)
+        return totals
+
+
+def percentile(sorted_values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of already sorted values, or None if there are none."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
@@ -0,0 +1,118 @@
+"""
+Compare snapshot hashing throughput: the original serial MD5 path against FileHasher.
+
+Usage:
+    python -m benchmarks.bench_hashing [--small-files 5000] [--large-files 8] [--large-size-mb 64]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+from app.utils.hashing import FileHasher
+
+
+def build_tree(root, small_files, small_size, large_files, large_size):
+    """Create a synthetic tree of small and large files filled with random bytes."""
+    for i in range(small_files):
+        directory = os.path.join(root, f"dir{i % 50}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"file{i}.txt"), 'wb') as f:
+            f.write(os.urandom(small_size))
+
+    os.makedirs(os.path.join(root, "large"), exist_ok=True)
+    chunk = os.urandom(1024 * 1024)
+    for i in range(large_files):
+        with open(os.path.join(root, "large", f"blob{i}.bin"), 'wb') as f:
+            for _ in range(large_size // len(chunk)):
+                f.write(chunk)
+
+
+def list_files(root):
+    """Return every file below root with its size."""
+    files = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            files.append((path, os.path.getsize(path)))
+    return files
+
+
+def serial_md5(file_path, block_size=65536):
+    """The hashing path FilesystemService used before FileHasher."""
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def measure(name, fn, files, total_bytes, repeat):
+    """Run fn over all files and return the best of repeat timings."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(files)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return {
+        "name": name,
+        "seconds": round(best, 4),
+        "mb_per_second": round(total_bytes / (1024 * 1024) / best, 1),
+        "files_per_second": round(len(files) / best, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--small-files", type=int, default=5000)
+    parser.add_argument("--small-size", type=int, default=4096, help="bytes per small file")
+    parser.add_argument("--large-files", type=int, default=8)
+    parser.add_argument("--large-size-mb", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="bench-hashing-")
+    try:
+        build_tree(root, args.small_files, args.small_size, args.large_files, args.large_size_mb * 1024 * 1024)
+        files = list_files(root)
+        total_bytes = sum(size for _, size in files)
+
+        # Warm the page cache so every run measures hashing rather than disk reads
+        serial_md5_all = lambda items: [serial_md5(path) for path, _ in items]
+        serial_md5_all(files)
+
+        configurations = [
+            ("serial md5 (baseline)", serial_md5_all),
+            ("serial blake2b", FileHasher("blake2b", workers=1).hash_files),
+            (f"pool md5 x{args.workers}", FileHasher("md5", workers=args.workers).hash_files),
+            (f"pool blake2b x{args.workers}", FileHasher("blake2b", workers=args.workers).hash_files),
+            (f"pool blake2b x{args.workers} partial>=8MiB",
+             FileHasher("blake2b", workers=args.workers, partial_threshold=8 * 1024 * 1024).hash_files),
+        ]
+
+        results = [measure(name, fn, files, total_bytes, args.repeat) for name, fn in configurations]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    baseline = results[0]["seconds"]
+    print(f"{len(files)} files, {total_bytes / (1024 * 1024):.1f} MiB")
+    for result in results:
+        result["speedup"] = round(baseline / result["seconds"], 2)
+        print(f"{result['name']:<40} {result['seconds']:>8.3f}s {result['mb_per_second']:>9.1f} MiB/s "
+              f"{result['files_per_second']:>10.1f} files/s {result['speedup']:>6.2f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"files": len(files), "bytes": total_bytes, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""
+Measure how much of each step's prompt Ollama has to evaluate, for the old prompt
+layout (a new prompt per step that restates the command history) and the
+append-only layout kept by ContextManager.
+
+Runs a scripted task against a real Ollama server: the model's replies are
+kept in the conversation, but the command outputs are synthetic so both layouts
+see the same steps. Reports prompt_eval_count and prompt_eval_duration per step.
+
+Usage:
+    python -m benchmarks.bench_prompt_cache [--url http://localhost:11434/api/chat] [--model NAME] [--steps 8]
+"""
+import os
+import sys
+import json
+import uuid
+import argparse
+
+from app.services.llm_service import LLMService
+from app.utils.context_manager import ContextManager
+
+SYSTEM_PROMPT = (
+    "You are an AI assistant that helps execute shell commands based on the user's task. "
+    "Work one shell command at a time. After each command, evaluate if the task is complete based on the command output. "
+    "Respond only with a JSON object with the keys task_complete, next_command and explanation."
+)
+
+
+def synthetic_output(step, lines):
+    """Deterministic command output of a realistic size."""
+    return "\n".join(f"-rw-r--r-- 1 app app {step * 1000 + i:>8} Jan  1 00:00 file_{step}_{i}.txt"
+                     for i in range(lines))
+
+
+def run_rebuild(llm, task, steps, lines):
+    """The old layout: every step builds a new prompt restating the task, history and latest output."""
+    results = []
+    history = []
+    for step in range(steps):
+        output = synthetic_output(step, lines) if step else ""
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": (
+                f"Task: {task}\n\n"
+                f"Command output: {output}\n\n"
+                f"Previous commands: {json.dumps(history, indent=2)}\n\n"
+                "Is the task complete? If not, what should be the next command to execute?"
+            )}
+        ]
+        llm.generate_step(messages)
+        results.append(llm.last_metrics)
+        history.append({"command": f"ls -l dir{step}", "output": output, "success": True})
+    return results
+
+
+def run_append(llm, task, steps, lines):
+    """The append-only layout: each prompt extends the previous one."""
+    results = []
+    context = ContextManager(SYSTEM_PROMPT, f"Task: {task}")
+    for step in range(steps):
+        step_result = llm.generate_step(context.messages())
+        results.append(llm.last_metrics)
+        context.add_step(f"ls -l dir{step}", step_result.get("raw_response") or "{}",
+                         f"Command succeeded. Output:\n{context.truncate_output(synthetic_output(step, lines))}")
+    return results
+
+
+def summarize(name, metrics):
+    """Print per-step metrics and return totals."""
+    print(f"\n{name}")
+    print(f"{'step':>4} {'prompt_eval_count':>18} {'prompt_eval_ms':>15}")
+    total_count = 0
+    total_ms = 0.0
+    for step, step_metrics in enumerate(metrics):
+        if not step_metrics:
+            print(f"{step:>4} {'n/a':>18} {'n/a':>15}")
+            continue
+        total_count += step_metrics["prompt_eval_count"]
+        total_ms += step_metrics["prompt_eval_duration_ms"]
+        print(f"{step:>4} {step_metrics['prompt_eval_count']:>18} {step_metrics['prompt_eval_duration_ms']:>15.1f}")
+    print(f"{'total':>4} {total_count:>18} {total_ms:>15.1f}")
+    return {"name": name, "steps": metrics, "prompt_eval_count": total_count, "prompt_eval_duration_ms": total_ms}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/chat"))
+    parser.add_argument("--model", default=None, help="defaults to OLLAMA_MODEL_NAME")
+    parser.add_argument("--steps", type=int, default=8)
+    parser.add_argument("--output-lines", type=int, default=40, help="lines of synthetic output per command")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    # Metrics only arrive with Ollama's final response, so do not cut streams short
+    llm = LLMService(api_url=args.url, model_name=args.model, stream=False)
+
+    # Load the model first so neither layout pays for it
+    llm.generate_step([{"role": "user", "content": "Respond with {}"}])
+
+    # A unique task per run keeps one layout from reusing the other's cache
+    results = []
+    for name, run in (("rebuild per step (before)", run_rebuild), ("append-only (after)", run_append)):
+        task = f"List the files in every directory and count them. Run {uuid.uuid4().hex[:8]}."
+        results.append(summarize(name, run(llm, task, args.steps, args.output_lines)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"model": llm.model_name, "steps": args.steps, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Compare the latency of running short Python snippets on a new interpreter per run
+(the original PythonService path, subprocess.check_output(['python', '-c', ...]))
+against the warm worker pool and the fork server, which forks a preloaded
+process for every run.
+
+Usage:
+    python -m benchmarks.bench_python_exec [--runs 30] [--preload json,decimal]
+
+With --preload numpy,pandas the snippet imports those modules, which is where
+warm workers save the most.
+"""
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+from app.utils.output_capture import OutputCapture
+from app.utils.python_pool import PythonWorkerPool
+
+
+def snippet_for(preload):
+    """A short snippet that uses the preloaded modules, like typical generated code."""
+    imports = "".join(f"import {name}\n" for name in preload)
+    return imports + "print(sum(range(1000)))\n"
+
+
+def measure(name, fn, runs):
+    """Time fn runs times and return latency percentiles in milliseconds."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "name": name,
+        "mean_ms": round(statistics.mean(timings), 2),
+        "p50_ms": round(timings[len(timings) // 2], 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=30)
+    parser.add_argument("--preload", default="json,decimal", help="comma separated modules to import")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    preload = [name.strip() for name in args.preload.split(",") if name.strip()]
+    code = snippet_for(preload)
+
+    def cold():
+        subprocess.check_output([sys.executable, "-c", code], stderr=subprocess.STDOUT)
+
+    pool = PythonWorkerPool(size=2, preload=preload, max_runs=args.runs * 2)
+    forkserver = PythonWorkerPool(size=2, preload=preload, fork=True)
+
+    def warm():
+        pool.run({"code": code, "filename": "<bench>"}, 30, OutputCapture(spill_dir=""))
+
+    def forked():
+        forkserver.run({"code": code, "filename": "<bench>"}, 30, OutputCapture(spill_dir=""))
+
+    # The first run waits for the workers to start; keep it out of the measurement
+    warm()
+    forked()
+
+    results = [
+        measure("new interpreter per run (baseline)", cold, args.runs),
+        measure("warm worker pool", warm, args.runs),
+        measure("fork server", forked, args.runs)
+    ]
+    pool.shutdown()
+    forkserver.shutdown()
+
+    baseline = results[0]["mean_ms"]
+    print(f"snippet imports: {', '.join(preload) or 'nothing'}; {args.runs} runs each")
+    for result in results:
+        result["speedup"] = round(baseline / result["mean_ms"], 1)
+        print(f"{result['name']:<40} mean {result['mean_ms']:>9.2f} ms  p50 {result['p50_ms']:>9.2f} ms  "
+              f"p95 {result['p95_ms']:>9.2f} ms  {result['speedup']:>7.1f}x")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({"preload": preload, "runs": args.runs, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Compare the Flask development server (`python -m flask run`, what the Dockerfile
+used to start) with gunicorn using gunicorn.conf.py, both run as subprocesses
+against a mock Ollama server (see benchmarks/mock_ollama.py).
+
+For each server it measures startup time (process start until the first API
+response, --startup-runs times), then runs a load test: --concurrency clients
+issuing API and static requests for --duration seconds (requests/sec and
+latency percentiles), and --tasks tasks submitted over HTTP and polled to
+completion (tasks/sec).
+
+Usage:
+    python -m benchmarks.bench_server [--servers dev,gunicorn] [--startup-runs 5] [--duration 10]
+                                      [--concurrency 16] [--tasks 20] [--output results.json]
+
+Results are written as JSON with --output so runs can be compared for regressions.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import signal
+import argparse
+import tempfile
+import threading
+import subprocess
+import contextlib
+
+import requests
+
+from benchmarks.mock_ollama import MockOllama
+from benchmarks.bench_tasks import build_tree, latency_summary, run_http
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READY_PATH = "/api/llm/stats"
+LOAD_PATHS = ["/api/tasks", "/api/llm/stats", "/", "/api/metrics/phases"]
+
+
+def free_port():
+    with contextlib.closing(socket.socket()) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_command(name, port):
+    """Command line that starts the named server on port."""
+    if name == "dev":
+        return [sys.executable, "-m", "flask", "--app", "app.main:app", "run",
+                "--host=127.0.0.1", f"--port={port}"]
+    if name == "gunicorn":
+        return [sys.executable, "-m", "gunicorn", "-c", os.path.join(REPO_ROOT, "gunicorn.conf.py"),
+                "--bind", f"127.0.0.1:{port}", "app.main:app"]
+    raise ValueError(f"Unknown server: {name}")
+
+
+def start_server(name, env, cwd, log_path):
+    """Start a server and wait for its first API response; returns (process, base_url, startup_ms)."""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    log = open(log_path, 'a')
+    start = time.perf_counter()
+    process = subprocess.Popen(server_command(name, port), env=env, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+
+    deadline = start + 60
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited with {process.returncode}, see {log_path}")
+        try:
+            if requests.get(base_url + READY_PATH, timeout=1).status_code == 200:
+                return process, base_url, (time.perf_counter() - start) * 1000
+        except requests.RequestException:
+            pass
+        time.sleep(0.01)
+
+    stop_server(process)
+    raise RuntimeError(f"{name} did not answer within 60s, see {log_path}")
+
+
+def stop_server(process, timeout=30):
+    """Stop a server with SIGTERM, as a container runtime would."""
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run_requests(base_url, concurrency, duration):
+    """Issue LOAD_PATHS round robin from concurrency clients; returns latencies in ms and the error count."""
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(offset):
+        session = requests.Session()
+        local, n = [], offset
+        while time.perf_counter() < stop_at:
+            path = LOAD_PATHS[n % len(LOAD_PATHS)]
+            n += 1
+            start = time.perf_counter()
+            try:
+                ok = session.get(base_url + path, timeout=30).status_code == 200
+            except requests.RequestException:
+                ok = False
+            if ok:
+                local.append((time.perf_counter() - start) * 1000)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", default="dev,gunicorn", help="comma separated: dev and gunicorn")
+    parser.add_argument("--startup-runs", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=10, help="seconds of request load per server")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--tasks", type=int, default=20, help="tasks submitted per server")
+    parser.add_argument("--tree-files", type=int, default=200, help="synthetic workspace size")
+    parser.add_argument("--first-token-ms", type=float, default=50)
+    parser.add_argument("--tokens-per-sec", type=float, default=100)
+    parser.add_argument("--keep", action="store_true", help="keep the temporary workspace, databases and logs")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    servers = [name.strip() for name in args.servers.split(",") if name.strip()]
+
+    mock = MockOllama(first_token_ms=args.first_token_ms, tokens_per_sec=args.tokens_per_sec)
+    mock.start()
+
+    work_dir = tempfile.mkdtemp(prefix="bench-server-")
+    # Shell sessions start in the server's working directory
+    tree = os.path.join(work_dir, "app")
+    os.makedirs(tree)
+    build_tree(tree, args.tree_files)
+
+    results = []
+    try:
+        for name in servers:
+            env = dict(os.environ,
+                       PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+                       DATABASE_URL=f"sqlite:///{os.path.join(work_dir, name + '.db')}",
+                       OLLAMA_API_URL=mock.url,
+                       LLM_CACHE_ENABLED="false",
+                       TASK_QUEUE_SIZE=str(max(args.tasks, 100)),
+                       FS_STAT_CACHE_PATH=os.path.join(work_dir, f"{name}-stat-cache.db"),
+                       CAPTURE_SPILL_DIR=os.path.join(work_dir, f"{name}-spill"))
+            log_path = os.path.join(work_dir, f"{name}.log")
+
+            startup = []
+            for _ in range(args.startup_runs):
+                process, _, startup_ms = start_server(name, env, tree, log_path)
+                stop_server(process)
+                startup.append(startup_ms)
+
+            process, base_url, _ = start_server(name, env, tree, log_path)
+            try:
+                start = time.perf_counter()
+                outcomes = run_http(base_url, args.tasks, args.concurrency, name)
+                task_seconds = time.perf_counter() - start
+
+                latencies, errors = run_requests(base_url, args.concurrency, args.duration)
+            finally:
+                stop_server(process)
+
+            result = {
+                "server": name,
+                "startup": latency_summary(startup),
+                "requests": len(latencies),
+                "request_errors": errors,
+                "requests_per_sec": round(len(latencies) / args.duration, 2),
+                "request_latency": latency_summary(latencies),
+                "tasks": args.tasks,
+                "tasks_succeeded": sum(1 for _, _, success in outcomes if success),
+                "tasks_per_sec": round(args.tasks / task_seconds, 2),
+                "task_latency": latency_summary([latency for latency, _, _ in outcomes])
+            }
+            results.append(result)
+            print(f"{name:<9} startup p50 {result['startup']['p50_ms']:>7.1f} ms  "
+                  f"{result['requests_per_sec']:>8.1f} req/s  p50 {result['request_latency']['p50_ms']:>7.1f} ms  "
+                  f"p99 {result['request_latency']['p99_ms']:>7.1f} ms  errors {errors}  "
+                  f"{result['tasks_per_sec']:>6.2f} tasks/s  ok {result['tasks_succeeded']}/{args.tasks}")
+    finally:
+        mock.stop()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "config": {key: value for key, value in vars(args).items() if key != "output"},
+                "cpu_count": os.cpu_count(),
+                "results": results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
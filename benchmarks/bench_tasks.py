@@ -0,0 +1,268 @@
+"""
+Measure task throughput end to end against a mock Ollama server (see
+benchmarks/mock_ollama.py), so no model is needed.
+
+For every synthetic workspace size and concurrency level, runs --tasks tasks
+either straight through TaskController.execute_task (one thread per concurrent
+task, like the TaskQueue workers) or through the HTTP API (POST /api/execute,
+then polling /api/tasks/<id>/status) on a local Flask server ("http") or on the
+ASGI app with the asyncio core under uvicorn ("asgi"). Reports tasks/sec,
+task latency percentiles, per-phase latency percentiles from the stored timing
+spans, database commits per task with their mean latency, and how much the
+database grew. Set DB_UNIT_OF_WORK=false or SQLITE_JOURNAL_MODE=DELETE and
+SQLITE_SYNCHRONOUS=FULL to compare against the untuned database layer.
+
+Usage:
+    python -m benchmarks.bench_tasks [--tasks 20] [--concurrency 1,4,16] [--tree-files 0,1000]
+                                     [--mode controller,http,asgi] [--first-token-ms 50] [--tokens-per-sec 100]
+                                     [--step-mode single] [--output results.json]
+
+Results are written as JSON with --output so runs can be compared for regressions.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.mock_ollama import MockOllama
+from app.utils.timing import percentile
+
+DB_TABLES = ["tasks", "task_commands", "task_command_outputs", "filesystem_states", "filesystem_manifests",
+             "task_phase_timings"]
+
+
+def build_tree(root, files):
+    """Create a synthetic workspace of small text files spread over directories."""
+    for i in range(files):
+        directory = os.path.join(root, "src", f"pkg{i % 40}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"module{i}.py"), 'w') as f:
+            f.write(f"# synthetic module {i}\n" + "x = 1\n" * (i % 20))
+
+
+def database_size(path):
+    """Bytes used by an SQLite database, including its WAL file."""
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+
+def row_counts(db):
+    from sqlalchemy import text
+    return {table: db.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar() for table in DB_TABLES}
+
+
+def latency_summary(values):
+    values = sorted(round(value, 2) for value in values)
+    return {
+        "mean_ms": round(sum(values) / len(values), 2) if values else None,
+        "p50_ms": percentile(values, 0.50),
+        "p95_ms": percentile(values, 0.95),
+        "p99_ms": percentile(values, 0.99)
+    }
+
+
+def run_controller(controller, session_factory, tasks, concurrency, run_id):
+    """Execute tasks directly on the controller; returns per-task latencies in ms and task ids."""
+    def one(n):
+        db = session_factory()
+        try:
+            start = time.perf_counter()
+            result = controller.execute_task(db, f"Benchmark task #{run_id}_{n}", use_cache=False)
+            return (time.perf_counter() - start) * 1000, result["task_id"], result.get("success", False)
+        finally:
+            db.close()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(tasks)))
+
+
+def run_http(base_url, tasks, concurrency, run_id):
+    """Submit tasks over HTTP and poll until each finishes; returns per-task latencies in ms and task ids."""
+    import requests
+    session = requests.Session()
+
+    def one(n):
+        start = time.perf_counter()
+        response = session.post(f"{base_url}/api/execute",
+                                json={"task": f"Benchmark task #{run_id}_{n}", "use_cache": False})
+        response.raise_for_status()
+        task_id = response.json()["task_id"]
+        while True:
+            status = session.get(f"{base_url}/api/tasks/{task_id}/status").json()
+            if status.get("is_completed"):
+                return (time.perf_counter() - start) * 1000, task_id, status.get("status") == "completed"
+            time.sleep(0.02)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(one, range(tasks)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=20, help="tasks per run")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--tree-files", default="0,1000", help="comma separated synthetic workspace sizes")
+    parser.add_argument("--mode", default="controller,http,asgi",
+                        help="comma separated: controller, http (Flask) and asgi (asyncio core)")
+    parser.add_argument("--first-token-ms", type=float, default=50)
+    parser.add_argument("--tokens-per-sec", type=float, default=100)
+    parser.add_argument("--prompt-tokens-per-sec", type=float, default=0)
+    parser.add_argument("--no-stream", action="store_true", help="disable streaming LLM responses")
+    parser.add_argument("--step-mode", default="single", help="single, batch or two_call")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary workspace and database")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    concurrency_levels = [int(value) for value in args.concurrency.split(",") if value]
+    tree_sizes = [int(value) for value in args.tree_files.split(",") if value]
+    modes = [mode.strip() for mode in args.mode.split(",") if mode.strip()]
+
+    mock = MockOllama(first_token_ms=args.first_token_ms, tokens_per_sec=args.tokens_per_sec,
+                      prompt_tokens_per_sec=args.prompt_tokens_per_sec)
+    mock.start()
+
+    # The application reads its configuration at import time, so set it up first
+    work_dir = tempfile.mkdtemp(prefix="bench-tasks-")
+    db_path = os.path.join(work_dir, "bench.db")
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "OLLAMA_API_URL": mock.url,
+        "OLLAMA_STREAM": "false" if args.no_stream else "true",
+        "LLM_STEP_MODE": args.step_mode,
+        "LLM_CACHE_ENABLED": "false",
+        "TASK_WORKERS": str(max(concurrency_levels)),
+        "TASK_QUEUE_SIZE": str(max(args.tasks, 100)),
+        "FS_STAT_CACHE_PATH": os.path.join(work_dir, "stat-cache.db"),
+        "CAPTURE_SPILL_DIR": os.path.join(work_dir, "spill")
+    })
+
+    from app.core.database import init_db, session_factory, commit_stats
+    from app.services.task_service import TaskService
+    from app.services.filesystem_service import FilesystemService
+    from app.services.llm_service import LLMService
+    from app.services.command_service import CommandService
+    from app.services.python_service import PythonService
+    from app.services.snapshot_pipeline import SnapshotPipeline
+    from app.controllers.task_controller import TaskController
+
+    init_db()
+    # Per-request logging would dominate the measurement
+    logging.disable(logging.INFO)
+    results = []
+    original_cwd = os.getcwd()
+    server = None
+    asgi_server = None
+
+    try:
+        for tree_files in tree_sizes:
+            tree = os.path.join(work_dir, f"app-{tree_files}")
+            os.makedirs(tree)
+            build_tree(tree, tree_files)
+            # Shell sessions start in the process's working directory
+            os.chdir(tree)
+
+            filesystem_service = FilesystemService(base_path=tree)
+            task_service = TaskService(filesystem_service, SnapshotPipeline())
+            controller = TaskController(task_service, LLMService(), CommandService(),
+                                        PythonService(base_path=tree), max_commands=len(mock.script) + 2)
+
+            if "http" in modes:
+                from werkzeug.serving import make_server
+                from app.controllers import api_controller
+                if server is None:
+                    with contextlib.redirect_stdout(open(os.devnull, "w")):
+                        from app.core.app import create_app
+                        server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+                    threading.Thread(target=server.serve_forever, name="bench-http", daemon=True).start()
+            if "asgi" in modes and asgi_server is None:
+                import uvicorn
+                with contextlib.redirect_stdout(open(os.devnull, "w")):
+                    from app.core.asgi import create_asgi_app
+                    asgi_server = uvicorn.Server(uvicorn.Config(create_asgi_app(), host="127.0.0.1", port=0,
+                                                                log_level="warning"))
+                threading.Thread(target=asgi_server.run, name="bench-asgi", daemon=True).start()
+                while not asgi_server.started:
+                    time.sleep(0.05)
+
+            if "http" in modes or "asgi" in modes:
+                from app.controllers import api_controller
+                # Point the API's services at this run's workspace
+                api_controller.filesystem_service.base_path = tree
+                api_controller.python_service.base_path = tree
+
+            for mode in modes:
+                for concurrency in concurrency_levels:
+                    run_id = f"{mode}_{tree_files}_{concurrency}"
+                    db = session_factory()
+                    rows_before = row_counts(db)
+                    bytes_before = database_size(db_path)
+                    commits_before, commit_ms_before = commit_stats.commits, commit_stats.total_ms
+
+                    start = time.perf_counter()
+                    # The services print every LLM request and response
+                    with contextlib.redirect_stdout(open(os.devnull, "w")):
+                        if mode == "http":
+                            base_url = f"http://127.0.0.1:{server.server_port}"
+                            outcomes = run_http(base_url, args.tasks, concurrency, run_id)
+                        elif mode == "asgi":
+                            port = asgi_server.servers[0].sockets[0].getsockname()[1]
+                            outcomes = run_http(f"http://127.0.0.1:{port}", args.tasks, concurrency, run_id)
+                        else:
+                            outcomes = run_controller(controller, session_factory, args.tasks, concurrency, run_id)
+                    elapsed = time.perf_counter() - start
+
+                    commits = commit_stats.commits - commits_before
+                    commit_ms = commit_stats.total_ms - commit_ms_before
+                    db.expire_all()
+                    rows_after = row_counts(db)
+                    phases = task_service.get_phase_stats(db, limit=args.tasks)["phases"]
+                    db.close()
+
+                    result = {
+                        "mode": mode,
+                        "tree_files": tree_files,
+                        "concurrency": concurrency,
+                        "tasks": args.tasks,
+                        "succeeded": sum(1 for _, _, success in outcomes if success),
+                        "seconds": round(elapsed, 3),
+                        "tasks_per_sec": round(args.tasks / elapsed, 2),
+                        "task_latency": latency_summary([latency for latency, _, _ in outcomes]),
+                        "phases": {name: {key: stats[key] for key in ("count", "p50_ms", "p95_ms", "p99_ms")}
+                                   for name, stats in phases.items()},
+                        "db_commits_per_task": round(commits / args.tasks, 2),
+                        "db_commit_mean_ms": round(commit_ms / commits, 3) if commits else None,
+                        "db_bytes_growth": database_size(db_path) - bytes_before,
+                        "db_rows_growth": {table: rows_after[table] - rows_before[table] for table in DB_TABLES}
+                    }
+                    results.append(result)
+                    print(f"{mode:<10} files {tree_files:>6}  x{concurrency:<3} {result['tasks_per_sec']:>7.2f} tasks/s  "
+                          f"p50 {result['task_latency']['p50_ms']:>8.1f} ms  p95 {result['task_latency']['p95_ms']:>8.1f} ms  "
+                          f"ok {result['succeeded']}/{args.tasks}  {result['db_commits_per_task']:.1f} commits/task  "
+                          f"db +{result['db_bytes_growth'] / 1024:.0f} KiB")
+    finally:
+        os.chdir(original_cwd)
+        if server is not None:
+            server.shutdown()
+        if asgi_server is not None:
+            asgi_server.should_exit = True
+        mock.stop()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                "config": {key: value for key, value in vars(args).items() if key != "output"},
+                "script_steps": len(mock.script),
+                "results": results
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
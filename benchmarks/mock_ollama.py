@@ -0,0 +1,214 @@
+"""
+A local stand-in for Ollama's /api/chat that answers with a scripted command
+sequence, so the service can be benchmarked without a model.
+
+The step is the number of assistant turns in the request, and a "#tag" in the
+first user message (e.g. "Task: benchmark #17") replaces {tag} in the script, so
+concurrent tasks work in separate directories. Requests with format "json" get
+the single-call step object (or a batch in batch mode, and the completion
+assessment in two-call mode); other requests get the bare command, or
+TASK_COMPLETE after the last one. Python code requests get a short snippet.
+
+Latency is first_token_ms (plus prompt_tokens_per_sec for the prompt, if set)
+and the response then arrives at tokens_per_sec, streamed as NDJSON when the
+request asks for it. Final chunks carry prompt_eval_count and eval_count like
+Ollama's.
+
+Usage:
+    python -m benchmarks.mock_ollama [--port 11435] [--first-token-ms 50] [--tokens-per-sec 100]
+"""
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_SCRIPT = [
+    "mkdir -p runs/{tag}",
+    "echo benchmark > runs/{tag}/notes.txt",
+    "ls runs/{tag}",
+    "cat runs/{tag}/notes.txt",
+    "find runs/{tag} -type f"
+]
+
+# Ollama counts tokens; the mock approximates them from characters
+CHARS_PER_TOKEN = 4
+
+
+class MockOllama:
+    """A threaded mock Ollama server; start() binds it and returns its /api/chat URL."""
+
+    def __init__(self, script=None, first_token_ms: float = 50, tokens_per_sec: float = 100,
+                 prompt_tokens_per_sec: float = 0, host: str = "127.0.0.1", port: int = 0):
+        self.script = list(script or DEFAULT_SCRIPT)
+        self.first_token_ms = first_token_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.prompt_tokens_per_sec = prompt_tokens_per_sec
+        self.requests = 0
+        self._lock = threading.Lock()
+
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                mock._handle(self)
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    # Clients drop kept-alive connections once they have what they need
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/chat"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-ollama", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        """Serve on the calling thread until interrupted."""
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._server.server_close()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def respond(self, payload) -> str:
+        """The scripted response content for a chat request."""
+        messages = payload.get("messages", [])
+        system = next((m["content"] for m in messages if m.get("role") == "system"), "")
+        first_user = next((m["content"] for m in messages if m.get("role") == "user"), "")
+        if "Python code" in system:
+            return "print('benchmark')"
+
+        match = re.search(r"#(\w+)", first_user)
+        tag = match.group(1) if match else "0"
+        step = sum(1 for m in messages if m.get("role") == "assistant")
+        complete = step >= len(self.script)
+        command = "" if complete else self.script[step].replace("{tag}", tag)
+
+        if payload.get("format") != "json":
+            return "TASK_COMPLETE" if complete else command
+        if '"commands"' in system:
+            commands = [] if complete else [{"id": "1", "command": command, "depends_on": []}]
+            return json.dumps({"task_complete": complete, "commands": commands, "explanation": f"step {step}"})
+        return json.dumps({"task_complete": complete, "next_command": command, "explanation": f"step {step}"})
+
+    def _handle(self, handler: BaseHTTPRequestHandler):
+        length = int(handler.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(handler.rfile.read(length) or b"{}")
+        except ValueError:
+            handler.send_error(400, "invalid JSON")
+            return
+        with self._lock:
+            self.requests += 1
+
+        content = self.respond(payload)
+        prompt_chars = sum(len(m.get("content", "")) for m in payload.get("messages", []))
+        prompt_tokens = max(1, prompt_chars // CHARS_PER_TOKEN)
+        tokens = [content[i:i + CHARS_PER_TOKEN] for i in range(0, len(content), CHARS_PER_TOKEN)] or [""]
+
+        start = time.perf_counter()
+        delay = self.first_token_ms / 1000
+        if self.prompt_tokens_per_sec:
+            delay += prompt_tokens / self.prompt_tokens_per_sec
+        time.sleep(delay)
+        prompt_duration = time.perf_counter() - start
+        per_token = 1 / self.tokens_per_sec if self.tokens_per_sec else 0
+
+        def final(message_content):
+            return {
+                "model": payload.get("model", "mock"),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "message": {"role": "assistant", "content": message_content},
+                "done": True,
+                "total_duration": int((time.perf_counter() - start) * 1e9),
+                "prompt_eval_count": prompt_tokens,
+                "prompt_eval_duration": int(prompt_duration * 1e9),
+                "eval_count": len(tokens),
+                "eval_duration": int(len(tokens) * per_token * 1e9)
+            }
+
+        try:
+            if not payload.get("stream", True):
+                time.sleep(len(tokens) * per_token)
+                body = json.dumps(final(content)).encode()
+                handler.send_response(200)
+                handler.send_header("Content-Type", "application/json")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+                return
+
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/x-ndjson")
+            handler.send_header("Transfer-Encoding", "chunked")
+            handler.end_headers()
+            for token in tokens:
+                time.sleep(per_token)
+                self._write_chunk(handler, {
+                    "model": payload.get("model", "mock"),
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "message": {"role": "assistant", "content": token},
+                    "done": False
+                })
+            self._write_chunk(handler, final(""))
+            handler.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stops reading once it has a complete command, like with Ollama
+            handler.close_connection = True
+
+    @staticmethod
+    def _write_chunk(handler, data):
+        line = json.dumps(data).encode() + b"\n"
+        handler.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        handler.wfile.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--first-token-ms", type=float, default=50)
+    parser.add_argument("--tokens-per-sec", type=float, default=100)
+    parser.add_argument("--prompt-tokens-per-sec", type=float, default=0,
+                        help="add prompt evaluation time proportional to the prompt size (0 disables)")
+    parser.add_argument("--script", help="JSON file with the list of commands to hand out")
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+
+    mock = MockOllama(script, args.first_token_ms, args.tokens_per_sec, args.prompt_tokens_per_sec,
+                      host=args.host, port=args.port)
+    print(f"Mock Ollama listening on {mock.url}")
+    mock.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""
+Gunicorn configuration for running the Flask app in production.
+
+Usage:
+    gunicorn app.main:app
+
+Gunicorn picks this file up from the working directory. The app is imported
+once in the master (preload) and forked into GUNICORN_WORKERS gthread workers
+of GUNICORN_THREADS threads each. Tasks run on the TaskQueue of the worker
+that accepted them, and cancelling a task or reading its queue position only
+works on that worker, so there is one worker by default and requests scale
+with threads. Raise GUNICORN_WORKERS only if cancellation does not matter.
+
+On SIGTERM every worker stops accepting connections, finishes in-flight
+requests and then drains its TaskQueue for up to TASK_DRAIN_TIMEOUT seconds
+before exiting.
+"""
+import os
+
+cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+drain_timeout = int(os.getenv("TASK_DRAIN_TIMEOUT", "300"))
+
+bind = f"{os.getenv('FLASK_HOST', '0.0.0.0')}:{os.getenv('FLASK_PORT', '5220')}"
+preload_app = True
+worker_class = "gthread"
+# One TaskQueue per worker; see the docstring
+workers = int(os.getenv("GUNICORN_WORKERS") or 1)
+# Request threads mostly wait on SQLite or hold an SSE stream open for a whole task
+threads = int(os.getenv("GUNICORN_THREADS") or max(16, 8 * cores))
+keepalive = 5
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+# Covers in-flight requests plus the task drain before the master kills a worker
+graceful_timeout = drain_timeout + 30
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    """Drop database connections inherited from the master; each worker opens its own."""
+    from app.core import database
+    database.engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    """Let queued and running tasks finish, then release sessions and workers."""
+    from app.controllers import api_controller
+
+    server.log.info(f"Worker {worker.pid} draining tasks (up to {drain_timeout}s)")
+    api_controller.task_queue.shutdown(wait=True, timeout=drain_timeout)
+    if api_controller.snapshot_pipeline is not None:
+        api_controller.snapshot_pipeline.shutdown(wait=True)
+    if api_controller.command_service.session_pool is not None:
+        api_controller.command_service.session_pool.close_all()
+    if api_controller.python_service.worker_pool is not None:
+        api_controller.python_service.worker_pool.shutdown()